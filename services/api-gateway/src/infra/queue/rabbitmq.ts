@@ -11,6 +11,17 @@ export interface QueuePublisher {
 
 const EXCHANGE = "notifications.direct";
 
+// Must match PUSH_HIGH_PRIORITY_MIN / PUSH_LOW_PRIORITY_MAX in push-service
+const PUSH_HIGH_PRIORITY_MIN = 2;
+const PUSH_LOW_PRIORITY_MAX = 0;
+
+function pushRoutingKey(priority: unknown): string {
+  if (typeof priority !== "number") return "push";
+  if (priority >= PUSH_HIGH_PRIORITY_MIN) return "push.high";
+  if (priority <= PUSH_LOW_PRIORITY_MAX) return "push.low";
+  return "push";
+}
+
 export class RabbitMQPublisher implements QueuePublisher {
   private connection: any;
   private channel: any;
@@ -23,9 +34,13 @@ export class RabbitMQPublisher implements QueuePublisher {
 
     await this.channel.assertQueue("email.queue", { durable: true });
     await this.channel.assertQueue("push.queue", { durable: true });
+    await this.channel.assertQueue("push.queue.high", { durable: true });
+    await this.channel.assertQueue("push.queue.low", { durable: true });
 
     await this.channel.bindQueue("email.queue", EXCHANGE, "email");
     await this.channel.bindQueue("push.queue", EXCHANGE, "push");
+    await this.channel.bindQueue("push.queue.high", EXCHANGE, "push.high");
+    await this.channel.bindQueue("push.queue.low", EXCHANGE, "push.low");
 
     logger.info("RabbitMQ connected and queues bound");
   }
@@ -55,7 +70,9 @@ export class RabbitMQPublisher implements QueuePublisher {
     const channel = this.getChannel();
     const payload = Buffer.from(JSON.stringify(message));
 
-    const ok = channel.publish(EXCHANGE, "push", payload, {
+    const routingKey = pushRoutingKey((message as { priority?: unknown }).priority);
+
+    const ok = channel.publish(EXCHANGE, routingKey, payload, {
       contentType: "application/json",
       persistent: true,
     });
@@ -6,6 +6,9 @@ export const notificationStatusSchema = z.enum([
   "delivered",
   "pending",
   "failed",
+  "scheduled",
+  "superseded",
+  "expired",
 ]);
 
 export const userDataSchema = z.object({
@@ -0,0 +1,58 @@
+"""
+Microbenchmark of the per-message decode stage.
+
+Compares the old unvalidated `json.loads(body.decode())`, a plain orjson
+parse, and the validated `decode_push_message` used by the consumer,
+reporting microseconds per message.
+
+Run with: python -m src.benchmarks.bench_decode --messages 100000
+"""
+
+import argparse
+import json
+import timeit
+
+from pydantic import ValidationError
+
+from src.benchmarks.bench_push_pipeline import synthetic_message
+from src.schemas import decode_push_message
+from src.utils import codec
+
+
+def main(args):
+    bodies = [
+        json.dumps(synthetic_message(i, args)).encode() for i in range(args.distinct)
+    ]
+    invalid = json.dumps({"notification_id": "n1", "push_token": None}).encode()
+
+    def rejected(body):
+        try:
+            decode_push_message(body)
+        except ValidationError:
+            pass
+
+    cases = [
+        ("json.loads (unvalidated)", lambda body: json.loads(body.decode())),
+        ("decode_push_message", decode_push_message),
+    ]
+    if codec.orjson is not None:
+        cases.insert(1, ("orjson.loads (unvalidated)", codec.orjson.loads))
+
+    for name, decode in cases:
+        seconds = timeit.timeit(
+            lambda: [decode(body) for body in bodies], number=args.messages // args.distinct
+        )
+        print(f"{name:>28}: {seconds / args.messages * 1e6:.2f} us/msg")
+
+    seconds = timeit.timeit(lambda: rejected(invalid), number=args.messages)
+    print(f"{'decode_push_message (reject)':>28}: {seconds / args.messages * 1e6:.2f} us/msg")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--distinct", type=int, default=100, help="distinct message bodies")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--high-share", type=float, default=0.1)
+    parser.add_argument("--low-share", type=float, default=0.2)
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""
+Benchmark FCM sends against a local fake endpoint.
+
+Compares a fresh httpx client per message (the old behaviour) with the
+shared pooled client, reporting handshakes per message and p50/p99 latency.
+
+The fake server only speaks HTTP/1.1, so the pooled mode runs with
+http2=False and measures connection reuse (keep-alive) only. The HTTP/2
+multiplexing the service uses against FCM is not covered here.
+
+Run with: python -m src.benchmarks.bench_fcm_client --messages 2000 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from src.benchmarks.fake_fcm import FakeFCMServer
+from src.services import build_fcm_message, create_http_client
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mode(server: FakeFCMServer, mode: str, messages: int, concurrency: int):
+    server.reset()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    # HTTP/1.1 keep-alive: the fake server cannot negotiate HTTP/2
+    shared_client = create_http_client(http2=False) if mode == "pooled" else None
+    headers = {"Authorization": "Bearer bench", "Content-Type": "application/json"}
+
+    async def send_one(i: int):
+        message = build_fcm_message(f"token_{i}", "Bench", "Benchmark message")
+        async with semaphore:
+            start = time.perf_counter()
+            if shared_client:
+                response = await shared_client.post(
+                    server.url, json=message, headers=headers
+                )
+            else:
+                async with httpx.AsyncClient(timeout=10.0) as client:
+                    response = await client.post(
+                        server.url, json=message, headers=headers
+                    )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send_one(i) for i in range(messages)))
+    elapsed = time.perf_counter() - started
+
+    if shared_client:
+        await shared_client.aclose()
+
+    return {
+        "mode": mode,
+        "messages": messages,
+        "handshakes_per_message": server.connections / messages,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "messages_per_sec": messages / elapsed,
+    }
+
+
+async def main(args):
+    server = FakeFCMServer(latency=args.latency / 1000)
+    await server.start()
+    try:
+        for mode in ("per-message", "pooled"):
+            result = await run_mode(server, mode, args.messages, args.concurrency)
+            print(
+                f"{result['mode']:>12}: "
+                f"handshakes/msg={result['handshakes_per_message']:.3f} "
+                f"p50={result['p50_ms']:.2f}ms "
+                f"p99={result['p99_ms']:.2f}ms "
+                f"throughput={result['messages_per_sec']:.0f} msg/s"
+            )
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument(
+        "--latency", type=float, default=5.0, help="fake FCM latency in ms"
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,297 @@
+"""
+Benchmark the push pipeline end to end without external services.
+
+Drives the real `consume_push_queue` with synthetic PushNotification
+messages. RabbitMQ and Redis are replaced by in-memory stand-ins, and FCM by
+a local fake that can inject latency, transient errors and 429s. Reports
+throughput, enqueue-to-final-status latency percentiles, per-stage latency
+and, with --trace-allocations, memory allocated per message.
+
+Run with: python -m src.benchmarks.bench_push_pipeline --messages 5000 --concurrency 50
+
+Save a run with --output and compare a later run against it with --baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from src import main
+from src.benchmarks.bench_fcm_client import percentile
+from src.benchmarks.fake_fcm import FakeFCMServer
+from src.benchmarks.in_memory import InMemoryBroker, InMemoryRedis
+from src.services import (
+    AdaptiveRateLimiter,
+    create_http_client,
+    IdempotencyStore,
+    InvalidTokenCache,
+    priority_lane,
+    RetryScheduler,
+    StatusBatcher,
+    TokenManager,
+)
+
+TERMINAL_STATUSES = {"delivered", "failed"}
+COMPARED = ("messages_per_sec", "p50_ms", "p99_ms", "allocated_bytes_per_msg")
+
+
+class BenchCredentials:
+    """Service-account credentials stand-in that never leaves the process"""
+
+    token = None
+    expiry = None
+
+    @property
+    def valid(self) -> bool:
+        return self.token is not None
+
+    def refresh(self, request):
+        self.token = "bench"
+        self.expiry = datetime(2100, 1, 1)
+
+
+def synthetic_message(index: int, args) -> dict:
+    roll = random.random()
+    if roll < args.high_share:
+        priority = 2
+    elif roll < args.high_share + args.low_share:
+        priority = 0
+    else:
+        priority = 1
+    return {
+        "notification_id": f"bench_{index}",
+        "notification_type": "push",
+        "user_id": f"user_{index % args.tokens}",
+        "push_token": f"token_{index % args.tokens}",
+        "title": "Benchmark",
+        "body": f"Benchmark message {index}",
+        "image": None,
+        "link": None,
+        "priority": priority,
+        "metadata": {},
+        "request_id": str(uuid.uuid4()),
+        "template_code": "bench",
+        "language": "en",
+        "variables": {"name": "bench"},
+        "user_email": f"user_{index}@example.com",
+        "created_at": datetime.utcnow().isoformat(),
+        "retry_count": 0,
+    }
+
+
+async def run(args) -> dict:
+    random.seed(args.seed)
+    server = FakeFCMServer(
+        latency=args.latency / 1000,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    await server.start()
+
+    broker = InMemoryBroker(latency=args.broker_latency / 1000)
+    redis = InMemoryRedis(latency=args.redis_latency / 1000)
+    state = main.state
+
+    lanes = {
+        lane: broker.queue(queue_name)
+        for lane, (queue_name, _) in main.PRIORITY_QUEUES.items()
+    }
+    state.push_queues = lanes
+    state.push_queue = lanes["normal"]
+    state.publisher = broker
+    broker.bind(main.FAILED_QUEUE, broker.queue(main.FAILED_QUEUE))
+
+    state.retry_scheduler = RetryScheduler(
+        broker,
+        delays=main.PUSH_RETRY_DELAYS,
+        lanes={lane: queue.name for lane, queue in lanes.items()},
+    )
+    for lane, queue in lanes.items():
+        for delay in main.PUSH_RETRY_DELAYS:
+            broker.bind(
+                RetryScheduler.queue_name(delay, lane),
+                queue,
+                delay=delay * args.retry_delay_scale,
+            )
+
+    state.status_batcher = StatusBatcher(
+        broker, flush_interval=args.status_flush_ms / 1000
+    )
+    state.idempotency = IdempotencyStore(redis)
+    state.invalid_tokens = InvalidTokenCache(redis)
+    state.rate_limiter = AdaptiveRateLimiter(
+        initial_rate=args.rate, min_rate=1, max_rate=args.rate
+    )
+    state.token_manager = TokenManager(BenchCredentials)
+    state.http_client = create_http_client(
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency,
+        http2=False,
+    )
+    main.FCM_V1_URL = server.url
+    main.PUSH_CONCURRENCY = args.concurrency
+
+    enqueued_at: Dict[str, float] = {}
+    latencies: List[float] = []
+    outcomes: Dict[str, int] = {}
+    done = asyncio.Event()
+
+    def on_status(status_message: dict):
+        status = status_message["status"]
+        if status not in TERMINAL_STATUSES:
+            return
+        started = enqueued_at.pop(status_message["notification_id"], None)
+        if started is None:
+            return
+        latencies.append(time.perf_counter() - started)
+        outcomes[status] = outcomes.get(status, 0) + 1
+        if not enqueued_at:
+            done.set()
+
+    broker.subscribe("status.queue", on_status)
+
+    messages = [synthetic_message(i, args) for i in range(args.messages)]
+    await state.token_manager.get_token()
+    state.status_batcher.start()
+
+    if args.trace_allocations:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+
+    started = time.perf_counter()
+    for message in messages:
+        enqueued_at[message["notification_id"]] = time.perf_counter()
+        lane = priority_lane(
+            message["priority"], main.PUSH_HIGH_PRIORITY_MIN, main.PUSH_LOW_PRIORITY_MAX
+        )
+        lanes[lane].put(json.dumps(message).encode())
+
+    state.is_processing = True
+    consumer = asyncio.create_task(main.consume_push_queue())
+    await done.wait()
+    elapsed = time.perf_counter() - started
+
+    allocation = {}
+    if args.trace_allocations:
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated = sum(
+            stat.size_diff for stat in after.compare_to(before, "filename")
+            if stat.size_diff > 0
+        )
+        allocation = {
+            "allocated_bytes_per_msg": allocated / args.messages,
+            "peak_traced_kib": peak / 1024,
+        }
+
+    for queue in lanes.values():
+        queue.close()
+    await consumer
+    await state.status_batcher.stop()
+    await state.http_client.aclose()
+    await server.stop()
+
+    stages = main.STAGE_SECONDS.snapshot()
+    return {
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": elapsed,
+        "messages_per_sec": args.messages / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "outcomes": outcomes,
+        "fcm_requests": server.requests,
+        "fcm_responses": dict(server.responses),
+        "fcm_connections": server.connections,
+        "redis_round_trips": redis.round_trips,
+        "broker_publishes": broker.published,
+        "dead_lettered": len(broker.queue(main.FAILED_QUEUE)._messages),
+        "stages": stages,
+        **allocation,
+    }
+
+
+def report(result: dict, baseline: Optional[dict] = None):
+    print(
+        f"{result['messages']} messages, concurrency {result['concurrency']}: "
+        f"{result['messages_per_sec']:.0f} msg/s "
+        f"p50={result['p50_ms']:.2f}ms p90={result['p90_ms']:.2f}ms "
+        f"p99={result['p99_ms']:.2f}ms max={result['max_ms']:.2f}ms"
+    )
+    print(
+        f"outcomes={result['outcomes']} fcm={result['fcm_responses']} "
+        f"connections={result['fcm_connections']} "
+        f"redis_round_trips={result['redis_round_trips']} "
+        f"dead_lettered={result['dead_lettered']}"
+    )
+    if "allocated_bytes_per_msg" in result:
+        print(
+            f"allocated={result['allocated_bytes_per_msg']:.0f} B/msg "
+            f"peak={result['peak_traced_kib']:.0f} KiB"
+        )
+    for stage, stats in sorted(result["stages"].items()):
+        print(
+            f"{stage:>8}: n={stats['count']} avg={stats['avg_ms']:.3f}ms "
+            f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms"
+        )
+
+    if baseline:
+        for key in COMPARED:
+            if key in result and key in baseline and baseline[key]:
+                change = (result[key] - baseline[key]) / baseline[key] * 100
+                print(f"{key:>24}: {baseline[key]:.2f} -> {result[key]:.2f} ({change:+.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=1000, help="distinct push tokens")
+    parser.add_argument("--high-share", type=float, default=0.1)
+    parser.add_argument("--low-share", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=5.0, help="fake FCM latency in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of FCM 500s")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of FCM 429s")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="429 Retry-After seconds")
+    parser.add_argument("--rate", type=float, default=100000, help="FCM send rate limit")
+    parser.add_argument("--redis-latency", type=float, default=0.2, help="ms per round trip")
+    parser.add_argument("--broker-latency", type=float, default=0.2, help="ms per publish")
+    parser.add_argument("--status-flush-ms", type=float, default=main.STATUS_FLUSH_INTERVAL_MS)
+    parser.add_argument(
+        "--retry-delay-scale",
+        type=float,
+        default=0.01,
+        help="multiplier applied to PUSH_RETRY_DELAYS",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-allocations", action="store_true")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", help="write the result as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a result written by --output")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
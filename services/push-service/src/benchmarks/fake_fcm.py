@@ -0,0 +1,132 @@
+"""
+Minimal local stand-in for the FCM v1 send endpoint.
+
+Speaks plain HTTP/1.1 with keep-alive and counts accepted TCP connections,
+so benchmarks can report how many handshakes each message costs. A share
+of requests can be answered with a transient `500` or a `429` carrying
+`Retry-After`, the way FCM does under load.
+"""
+
+import asyncio
+import json
+import random
+from collections import Counter
+from typing import Optional
+
+THROTTLED = {
+    "error": {
+        "code": 429,
+        "message": "Quota exceeded",
+        "status": "RESOURCE_EXHAUSTED",
+        "details": [
+            {
+                "@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+                "errorCode": "QUOTA_EXCEEDED",
+            }
+        ],
+    }
+}
+INTERNAL = {
+    "error": {
+        "code": 500,
+        "message": "Internal error",
+        "status": "INTERNAL",
+        "details": [
+            {
+                "@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+                "errorCode": "INTERNAL",
+            }
+        ],
+    }
+}
+REASONS = {200: b"OK", 429: b"Too Many Requests", 500: b"Internal Server Error"}
+
+
+class FakeFCMServer:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.connections = 0
+        self.requests = 0
+        self.responses: Counter = Counter()
+        self._random = random.Random(seed)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1/projects/bench/messages:send"
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def reset(self):
+        self.connections = 0
+        self.requests = 0
+        self.responses.clear()
+
+    def _response(self) -> bytes:
+        roll = self._random.random()
+        headers = b""
+        if roll < self.throttle_rate:
+            status, payload = 429, THROTTLED
+            headers = f"Retry-After: {self.retry_after:g}\r\n".encode()
+        elif roll < self.throttle_rate + self.error_rate:
+            status, payload = 500, INTERNAL
+        else:
+            status = 200
+            payload = {"name": f"projects/bench/messages/{self.requests}"}
+        self.responses[status] += 1
+
+        body = json.dumps(payload).encode()
+        return (
+            f"HTTP/1.1 {status} ".encode()
+            + REASONS[status]
+            + b"\r\nContent-Type: application/json\r\n"
+            + headers
+            + f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                content_length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        content_length = int(line.split(b":", 1)[1])
+                if content_length:
+                    await reader.readexactly(content_length)
+
+                self.requests += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                writer.write(self._response())
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
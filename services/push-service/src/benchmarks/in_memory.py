@@ -0,0 +1,230 @@
+"""
+In-memory stand-ins for RabbitMQ and Redis used by the pipeline benchmark.
+
+They implement only the calls push-service makes: queue iteration with
+ack/nack, declare for depth, confirmed publishing by routing key, and the
+Redis get/set/delete/pipeline calls used by the idempotency and invalid
+token stores. Optional per-call latency approximates a network round trip.
+"""
+
+import asyncio
+import json
+from collections import deque
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+
+class InMemoryMessage:
+    def __init__(self, queue: "InMemoryQueue", body: bytes, headers: Optional[dict]):
+        self.queue = queue
+        self.body = body
+        self.headers = headers or {}
+        self.redelivered = False
+
+    @asynccontextmanager
+    async def process(self, requeue: bool = False):
+        try:
+            yield self
+        except Exception:
+            await self.nack(requeue=requeue)
+            raise
+        else:
+            self.queue.acked += 1
+
+    async def nack(self, requeue: bool = True):
+        if requeue:
+            self.redelivered = True
+            self.queue.requeue(self)
+        else:
+            self.queue.rejected += 1
+
+
+class InMemoryQueue:
+    """A queue with aio_pika's iterator/declare surface and no prefetch buffer"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._messages: Deque[InMemoryMessage] = deque()
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.acked = 0
+        self.rejected = 0
+
+    def put(self, body: bytes, headers: Optional[dict] = None):
+        self._messages.append(InMemoryMessage(self, body, headers))
+        self._ready.set()
+
+    def requeue(self, message: InMemoryMessage):
+        self._messages.appendleft(message)
+        self._ready.set()
+
+    def close(self):
+        """End every iterator once the queue is empty"""
+        self.closed = True
+        self._ready.set()
+
+    async def declare(self):
+        return SimpleNamespace(message_count=len(self._messages))
+
+    def iterator(self) -> "InMemoryQueueIterator":
+        return InMemoryQueueIterator(self)
+
+    async def get(self) -> Optional[InMemoryMessage]:
+        while not self._messages:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._messages.popleft()
+
+
+class InMemoryQueueIterator:
+    def __init__(self, queue: InMemoryQueue):
+        self.queue = queue
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> InMemoryMessage:
+        message = await self.queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+
+class InMemoryBroker:
+    """Route published messages to in-memory queues or callbacks.
+
+    Mirrors `Publisher.publish`, so it can stand in for the confirmed
+    publisher. A binding with a delay models a TTL delay queue that
+    dead-letters into its target.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queues: Dict[str, InMemoryQueue] = {}
+        self._bindings: Dict[str, Tuple[InMemoryQueue, float]] = {}
+        self._subscribers: Dict[str, List[Callable[[dict], None]]] = {}
+        self.published = 0
+        self.unrouted = 0
+
+    def queue(self, name: str) -> InMemoryQueue:
+        if name not in self.queues:
+            self.queues[name] = InMemoryQueue(name)
+        return self.queues[name]
+
+    def bind(self, routing_key: str, queue: InMemoryQueue, delay: float = 0.0):
+        self._bindings[routing_key] = (queue, delay)
+
+    def subscribe(self, routing_key: str, callback: Callable[[dict], None]):
+        self._subscribers.setdefault(routing_key, []).append(callback)
+
+    async def publish(
+        self, body: dict, routing_key: str, headers: Optional[dict] = None
+    ):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.published += 1
+        payload = json.dumps(body).encode()
+
+        for callback in self._subscribers.get(routing_key, []):
+            callback(body)
+
+        if routing_key in self._bindings:
+            queue, delay = self._bindings[routing_key]
+            if delay:
+                asyncio.get_running_loop().call_later(
+                    delay, queue.put, payload, headers
+                )
+            else:
+                queue.put(payload, headers)
+        elif routing_key not in self._subscribers:
+            self.unrouted += 1
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class InMemoryPipeline:
+    def __init__(self, redis: "InMemoryRedis"):
+        self.redis = redis
+        self._commands: List[Tuple[str, tuple, dict]] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def get(self, *args, **kwargs):
+        self._commands.append(("get", args, kwargs))
+
+    def set(self, *args, **kwargs):
+        self._commands.append(("set", args, kwargs))
+
+    def delete(self, *args, **kwargs):
+        self._commands.append(("delete", args, kwargs))
+
+    async def execute(self):
+        await self.redis._round_trip()
+        return [
+            getattr(self.redis, f"_{name}")(*args, **kwargs)
+            for name, args, kwargs in self._commands
+        ]
+
+
+class InMemoryRedis:
+    """The subset of redis.asyncio.Redis used by the push stores; TTLs are ignored"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.data: Dict[str, str] = {}
+        self.round_trips = 0
+
+    async def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _get(self, key: str) -> Optional[str]:
+        return self.data.get(key)
+
+    def _set(self, key: str, value, nx: bool = False, ex: Optional[int] = None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def _delete(self, *keys: str) -> int:
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def get(self, key: str) -> Optional[str]:
+        await self._round_trip()
+        return self._get(key)
+
+    async def set(self, key: str, value, nx: bool = False, ex: Optional[int] = None):
+        await self._round_trip()
+        return self._set(key, value, nx=nx, ex=ex)
+
+    async def delete(self, *keys: str) -> int:
+        await self._round_trip()
+        return self._delete(*keys)
+
+    def pipeline(self, transaction: bool = True) -> InMemoryPipeline:
+        return InMemoryPipeline(self)
+
+    async def ping(self):
+        return True
+
+    async def close(self):
+        pass
@@ -1,22 +1,64 @@
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 import aio_pika
-import json
 import asyncio
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import logging
 from datetime import datetime
 import uuid
 from redis import asyncio as aioredis
 import httpx
-from circuitbreaker import circuit
 import os
-from src.schemas import HealthResponse
+from src.schemas import decode_push_message, HealthResponse, ReplayRequest
+from src.services import (
+    AdaptiveRateLimiter,
+    AsyncCircuitBreaker,
+    CircuitOpenError,
+    build_fcm_message,
+    ClaimStatus,
+    coalesce_key,
+    create_http_client,
+    deadline_of,
+    FailedQueueReplayer,
+    FCMError,
+    FlowController,
+    get_retry_count,
+    IdempotencyStore,
+    InvalidTokenCache,
+    parse_ttls,
+    parse_weights,
+    priority_lane,
+    Publisher,
+    PushCoalescer,
+    QueueDepthSampler,
+    ReplayFilter,
+    RetryScheduler,
+    send_at_of,
+    SendScheduler,
+    StatusBatcher,
+    summarize,
+    TemplateClient,
+    TemplateNotFoundError,
+    TokenManager,
+    WeightedLaneScheduler,
+    WorkerRegistry,
+    WorkerSupervisor,
+)
+from src.utils import (
+    AdjustableSemaphore,
+    JsonFileExporter,
+    json_loads,
+    KeyedLock,
+    MetricsRegistry,
+    OTLPExporter,
+    Tracer,
+)
+from pydantic import ValidationError
 import time
 from google.oauth2 import service_account
-from google.auth.transport.requests import Request
 from datetime import datetime, timezone
 import base64
 
@@ -45,69 +87,353 @@ SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 FCM_V1_URL = f"https://fcm.googleapis.com/v1/projects/{PROJECT_ID}/messages:send"
 
+PUSH_PREFETCH_COUNT = int(os.getenv("PUSH_PREFETCH_COUNT", "10"))
+PUSH_CONCURRENCY = min(
+    int(os.getenv("PUSH_CONCURRENCY", str(PUSH_PREFETCH_COUNT))), PUSH_PREFETCH_COUNT
+)
+PUSH_FLOW_CONTROL = os.getenv("PUSH_FLOW_CONTROL", "true").lower() == "true"
+PUSH_FLOW_INTERVAL = float(os.getenv("PUSH_FLOW_INTERVAL", "5"))
+PUSH_CONCURRENCY_MIN = int(os.getenv("PUSH_CONCURRENCY_MIN", "1"))
+PUSH_CONCURRENCY_MAX = int(os.getenv("PUSH_CONCURRENCY_MAX", "100"))
+PUSH_PREFETCH_MIN = int(os.getenv("PUSH_PREFETCH_MIN", "1"))
+PUSH_PREFETCH_MAX = int(os.getenv("PUSH_PREFETCH_MAX", "200"))
+PUSH_FLOW_ERROR_THRESHOLD = float(os.getenv("PUSH_FLOW_ERROR_THRESHOLD", "0.05"))
+PUSH_ORDERING_KEY = os.getenv("PUSH_ORDERING_KEY", "push_token")
+PUSH_COALESCE_WINDOW = float(os.getenv("PUSH_COALESCE_WINDOW", "0"))
+PUSH_COALESCE_MAX = int(os.getenv("PUSH_COALESCE_MAX", "50"))
+PUSH_COALESCE_MODE = os.getenv("PUSH_COALESCE_MODE", "latest")
+PUSH_PRIORITY_WEIGHTS = parse_weights(
+    os.getenv("PUSH_PRIORITY_WEIGHTS", "high:6,normal:3,low:1")
+)
+PUSH_PRIORITY_MAX_WAIT = float(os.getenv("PUSH_PRIORITY_MAX_WAIT", "5"))
+PUSH_HIGH_PRIORITY_MIN = int(os.getenv("PUSH_HIGH_PRIORITY_MIN", "2"))
+PUSH_LOW_PRIORITY_MAX = int(os.getenv("PUSH_LOW_PRIORITY_MAX", "0"))
+
+# lane -> (queue name, publisher routing key)
+PRIORITY_QUEUES = {
+    "high": ("push.queue.high", "push.high"),
+    "normal": ("push.queue", "push"),
+    "low": ("push.queue.low", "push.low"),
+}
+LANE_QUEUES = {lane: queue_name for lane, (queue_name, _) in PRIORITY_QUEUES.items()}
+
+PUSH_MAX_RETRIES = int(os.getenv("PUSH_MAX_RETRIES", "3"))
+PUSH_RETRY_DELAYS = [
+    int(delay) for delay in os.getenv("PUSH_RETRY_DELAYS", "1,2,4").split(",")
+]
+
+PUSH_INFLIGHT_TTL = int(os.getenv("PUSH_INFLIGHT_TTL", "300"))
+PUSH_PROCESSED_TTL = int(os.getenv("PUSH_PROCESSED_TTL", "3600"))
+PUSH_LOCAL_DEDUP_SIZE = int(os.getenv("PUSH_LOCAL_DEDUP_SIZE", "10000"))
+INVALID_TOKEN_TTL = int(os.getenv("INVALID_TOKEN_TTL", str(30 * 24 * 3600)))
+INVALID_TOKEN_LOCAL_SIZE = int(os.getenv("INVALID_TOKEN_LOCAL_SIZE", "50000"))
+INVALID_TOKEN_VALID_TTL = float(os.getenv("INVALID_TOKEN_VALID_TTL", "60"))
+
+STATUS_FLUSH_INTERVAL_MS = int(os.getenv("STATUS_FLUSH_INTERVAL_MS", "50"))
+STATUS_PENDING_WINDOW_MS = int(os.getenv("STATUS_PENDING_WINDOW_MS", "1000"))
+STATUS_BATCH_MAX_SIZE = int(os.getenv("STATUS_BATCH_MAX_SIZE", "100"))
+STATUS_SUPPRESS_PENDING = os.getenv("STATUS_SUPPRESS_PENDING", "true").lower() == "true"
+
+FCM_HTTP2 = os.getenv("FCM_HTTP2", "true").lower() == "true"
+FCM_MAX_CONNECTIONS = int(os.getenv("FCM_MAX_CONNECTIONS", "100"))
+FCM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("FCM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+FCM_KEEPALIVE_EXPIRY = float(os.getenv("FCM_KEEPALIVE_EXPIRY", "30"))
+FCM_TIMEOUT = float(os.getenv("FCM_TIMEOUT", "10"))
+
+FCM_RATE_LIMIT = float(os.getenv("FCM_RATE_LIMIT", "500"))
+FCM_RATE_LIMIT_MIN = float(os.getenv("FCM_RATE_LIMIT_MIN", "10"))
+FCM_RATE_LIMIT_MAX = float(os.getenv("FCM_RATE_LIMIT_MAX", "5000"))
+FCM_RATE_LIMIT_INCREASE = float(os.getenv("FCM_RATE_LIMIT_INCREASE", "5"))
+FCM_THROTTLE_RETRIES = int(os.getenv("FCM_THROTTLE_RETRIES", "5"))
+FCM_THROTTLE_STATUS_CODES = {429, 503}
+
+FCM_CIRCUIT_WINDOW = float(os.getenv("FCM_CIRCUIT_WINDOW", "30"))
+FCM_CIRCUIT_MIN_CALLS = int(os.getenv("FCM_CIRCUIT_MIN_CALLS", "10"))
+FCM_CIRCUIT_FAILURE_RATE = float(os.getenv("FCM_CIRCUIT_FAILURE_RATE", "0.5"))
+FCM_CIRCUIT_OPEN_TIMEOUT = float(os.getenv("FCM_CIRCUIT_OPEN_TIMEOUT", "30"))
+FCM_CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("FCM_CIRCUIT_HALF_OPEN_CALLS", "3"))
+
+FCM_TOKEN_REFRESH_MARGIN = float(os.getenv("FCM_TOKEN_REFRESH_MARGIN", "300"))
+
+FAILED_QUEUE = "failed.queue"
+TOKEN_INVALID_QUEUE = "token.invalid"
+PUSH_REPLAY_RATE = float(os.getenv("PUSH_REPLAY_RATE", "50"))
+PUSH_ADMIN_TOKEN = os.getenv("PUSH_ADMIN_TOKEN", "")
+
+TEMPLATE_SERVICE_URL = os.getenv("TEMPLATE_SERVICE_URL", "http://localhost:3004")
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "1024"))
+TEMPLATE_CACHE_TTL = float(os.getenv("TEMPLATE_CACHE_TTL", "300"))
+TEMPLATE_SERVICE_TIMEOUT = float(os.getenv("TEMPLATE_SERVICE_TIMEOUT", "5"))
+TEMPLATE_SERVICE_MAX_CONNECTIONS = int(os.getenv("TEMPLATE_SERVICE_MAX_CONNECTIONS", "20"))
+
+PUSH_SCHEDULING = os.getenv("PUSH_SCHEDULING", "true").lower() == "true"
+PUSH_SCHEDULE_MIN_DELAY = float(os.getenv("PUSH_SCHEDULE_MIN_DELAY", "1"))
+PUSH_SCHEDULE_RELEASE_RATE = float(os.getenv("PUSH_SCHEDULE_RELEASE_RATE", "200"))
+PUSH_SCHEDULE_BATCH_SIZE = int(os.getenv("PUSH_SCHEDULE_BATCH_SIZE", "100"))
+PUSH_SCHEDULE_SPREAD = float(os.getenv("PUSH_SCHEDULE_SPREAD", "0"))
+PUSH_SCHEDULE_INTERVAL = float(os.getenv("PUSH_SCHEDULE_INTERVAL", "1"))
+
+PUSH_NOTIFICATION_TTLS = parse_ttls(os.getenv("PUSH_NOTIFICATION_TTLS", ""))
+PUSH_DEFAULT_TTL = float(os.getenv("PUSH_DEFAULT_TTL", "0"))
+
+PUSH_DRAIN_TIMEOUT = float(os.getenv("PUSH_DRAIN_TIMEOUT", "25"))
+
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", "0"))
+PUSH_WORKER_HEARTBEAT_INTERVAL = float(os.getenv("PUSH_WORKER_HEARTBEAT_INTERVAL", "5"))
+PUSH_WORKER_SHUTDOWN_TIMEOUT = float(os.getenv("PUSH_WORKER_SHUTDOWN_TIMEOUT", "30"))
+QUEUE_SAMPLE_INTERVAL = float(os.getenv("QUEUE_SAMPLE_INTERVAL", "5"))
+QUEUE_SAMPLE_HISTORY = int(os.getenv("QUEUE_SAMPLE_HISTORY", "120"))
+QUEUE_RATE_WINDOW = float(os.getenv("QUEUE_RATE_WINDOW", "60"))
+
+PUSH_TRACE_EXPORTER = os.getenv("PUSH_TRACE_EXPORTER", "")
+PUSH_TRACE_SAMPLE_RATE = float(os.getenv("PUSH_TRACE_SAMPLE_RATE", "0.1"))
+PUSH_TRACE_OTLP_ENDPOINT = os.getenv(
+    "PUSH_TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces"
+)
+PUSH_TRACE_FILE = os.getenv("PUSH_TRACE_FILE", "push-traces.jsonl")
+
 SCOPES = ["https://www.googleapis.com/auth/firebase.messaging"]
-credentials = service_account.Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=SCOPES
+
+
+def load_credentials():
+    """Load the FCM service account credentials"""
+    return service_account.Credentials.from_service_account_file(
+        SERVICE_ACCOUNT_FILE, scopes=SCOPES
+    )
+
+
+def create_trace_exporter():
+    """Span exporter chosen by PUSH_TRACE_EXPORTER, or None to disable tracing"""
+    if PUSH_TRACE_EXPORTER == "otlp":
+        return OTLPExporter(PUSH_TRACE_OTLP_ENDPOINT, service_name="push-service")
+    if PUSH_TRACE_EXPORTER == "file":
+        return JsonFileExporter(PUSH_TRACE_FILE)
+    return None
+
+
+def is_transient_failure(exc: BaseException) -> bool:
+    """Permanent token errors and quota throttling say nothing about FCM health"""
+    if isinstance(exc, FCMError):
+        return not (
+            exc.is_permanent or exc.status_code in FCM_THROTTLE_STATUS_CODES
+        )
+    return True
+
+
+fcm_circuit_breaker = AsyncCircuitBreaker(
+    window=FCM_CIRCUIT_WINDOW,
+    min_calls=FCM_CIRCUIT_MIN_CALLS,
+    failure_rate=FCM_CIRCUIT_FAILURE_RATE,
+    open_timeout=FCM_CIRCUIT_OPEN_TIMEOUT,
+    half_open_max_calls=FCM_CIRCUIT_HALF_OPEN_CALLS,
+    half_open_successes=FCM_CIRCUIT_HALF_OPEN_CALLS,
+    is_failure=is_transient_failure,
 )
 
 
 class ServiceState:
     rabbitmq_connection: Optional[aio_pika.Connection] = None
     rabbitmq_channel: Optional[aio_pika.Channel] = None
+    publisher: Optional[Publisher] = None
+    status_batcher: Optional[StatusBatcher] = None
     redis_client: Optional[aioredis.Redis] = None
+    idempotency: Optional[IdempotencyStore] = None
+    invalid_tokens: Optional[InvalidTokenCache] = None
     push_queue: Optional[aio_pika.Queue] = None
+    push_queues: Dict[str, aio_pika.Queue] = {}
+    failed_queue: Optional[aio_pika.Queue] = None
+    lane_scheduler: Optional[WeightedLaneScheduler] = None
+    lane_wait: Dict[str, float] = {}
+    lane_received: Dict[str, int] = {}
+    queue_sampler: QueueDepthSampler = QueueDepthSampler(
+        interval=QUEUE_SAMPLE_INTERVAL,
+        history=QUEUE_SAMPLE_HISTORY,
+        rate_window=QUEUE_RATE_WINDOW,
+    )
+    http_client: Optional[httpx.AsyncClient] = None
+    templates: Optional[TemplateClient] = None
+    retry_scheduler: Optional[RetryScheduler] = None
+    send_scheduler: Optional[SendScheduler] = None
+    rate_limiter: AdaptiveRateLimiter = AdaptiveRateLimiter(
+        initial_rate=FCM_RATE_LIMIT,
+        min_rate=FCM_RATE_LIMIT_MIN,
+        max_rate=FCM_RATE_LIMIT_MAX,
+        increase=FCM_RATE_LIMIT_INCREASE,
+    )
+    token_manager: TokenManager = TokenManager(
+        load_credentials, refresh_margin=FCM_TOKEN_REFRESH_MARGIN
+    )
+    flow_controller: FlowController = FlowController(
+        rate=lambda: state.rate_limiter.local_rate,
+        concurrency=PUSH_CONCURRENCY,
+        prefetch=PUSH_PREFETCH_COUNT,
+        min_concurrency=PUSH_CONCURRENCY_MIN,
+        max_concurrency=PUSH_CONCURRENCY_MAX,
+        min_prefetch=PUSH_PREFETCH_MIN,
+        max_prefetch=PUSH_PREFETCH_MAX,
+        error_threshold=PUSH_FLOW_ERROR_THRESHOLD,
+        interval=PUSH_FLOW_INTERVAL,
+    )
     is_processing: bool = False
-    retry_count: dict = {}
-    circuit_breaker_open: bool = False
+    in_flight: int = 0
+    handler_tasks: set = set()
+    draining: bool = False
+    drain_cancelled: int = 0
+    ordering_locks: KeyedLock = KeyedLock()
+    coalescer: Optional[PushCoalescer] = None
+    circuit_breaker: AsyncCircuitBreaker = fcm_circuit_breaker
+    role: str = "all"
+    consumer_task: Optional[asyncio.Task] = None
+    worker_registry: Optional[WorkerRegistry] = None
+    supervisor: Optional[WorkerSupervisor] = None
+    replayer: Optional[FailedQueueReplayer] = None
+    replay_task: Optional[asyncio.Task] = None
+    tracer: Tracer = Tracer(create_trace_exporter(), sample_rate=PUSH_TRACE_SAMPLE_RATE)
+
+    @property
+    def circuit_breaker_open(self) -> bool:
+        return self.circuit_breaker.state == "open"
 
 
 state = ServiceState()
 
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.histogram(
+    "push_stage_duration_seconds",
+    "Time spent in each stage of handling a push message",
+    ["stage"],
+)
+PUSH_OUTCOMES = metrics.counter(
+    "push_notifications_total",
+    "Push notifications handled, by outcome and FCM error code",
+    ["outcome", "error_code"],
+)
+metrics.gauge(
+    "push_in_flight", "Push handlers currently running", function=lambda: state.in_flight
+)
+metrics.gauge(
+    "push_circuit_open",
+    "1 while the FCM circuit breaker is open",
+    function=lambda: float(state.circuit_breaker_open),
+    aggregate="max",
+)
+metrics.gauge(
+    "push_fcm_rate_limit",
+    "Adaptive FCM send rate per second allotted to this process",
+    function=lambda: state.rate_limiter.local_rate,
+)
+metrics.gauge(
+    "push_concurrency_limit",
+    "Push handlers allowed to run at once",
+    function=lambda: state.flow_controller.concurrency,
+)
+metrics.gauge(
+    "push_prefetch_count",
+    "Unacked deliveries each queue consumer may hold",
+    function=lambda: state.flow_controller.prefetch,
+)
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Time a stage in STAGE_SECONDS and, for a sampled message, as a span"""
+    with STAGE_SECONDS.time(stage=stage), state.tracer.span(f"push.{stage}"):
+        yield
+
+
+def record_outcome(outcome: str, **labels):
+    """Count a message's outcome and note it on its trace"""
+    PUSH_OUTCOMES.inc(outcome=outcome, **labels)
+    state.tracer.annotate(outcome=outcome, **labels)
+
+
+def error_code_of(exc: BaseException) -> str:
+    """Label for an exception: the FCM error code where there is one"""
+    if isinstance(exc, FCMError):
+        return exc.error_code or str(exc.status_code)
+    return type(exc).__name__
+
 
 async def get_access_token():
-    """Generate OAuth2 access token for FCM v1 API"""
-    if not credentials.valid or credentials.expired:
-        credentials.refresh(Request())
-    return credentials.token
+    """Get a valid OAuth2 access token for FCM v1 API"""
+    return await state.token_manager.get_token()
 
 
-@circuit(failure_threshold=5, recovery_timeout=60, expected_exception=Exception)
+@fcm_circuit_breaker
 async def send_fcm_notification(
     push_token: str,
     title: str,
     body: str,
     image: Optional[str] = None,
     link: Optional[str] = None,
+    ttl: Optional[float] = None,
 ):
     """Send push notification via FCM with circuit breaker"""
-    access_token = await get_access_token()
+    with timed_stage("token"):
+        access_token = await get_access_token()
 
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json",
     }
 
-    message = {
-        "message": {
-            "token": push_token,
-            "notification": {"title": title, "body": body},
-            "data": {"link": link or ""},
-        }
-    }
-
-    if image:
-        message["message"]["notification"]["image"] = image
+    message = build_fcm_message(push_token, title, body, image, link, ttl=ttl)
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(FCM_V1_URL, json=message, headers=headers)
+    with timed_stage("fcm"):
+        response = await state.http_client.post(
+            FCM_V1_URL, json=message, headers=headers
+        )
+    try:
         response.raise_for_status()
-        return response.json()
+    except httpx.HTTPStatusError:
+        raise FCMError.from_response(response)
+    return response.json()
+
+
+async def deliver_push(
+    push_token: str,
+    title: str,
+    body: str,
+    image: Optional[str] = None,
+    link: Optional[str] = None,
+    ttl: Optional[float] = None,
+):
+    """Send through the adaptive rate limiter, waiting out FCM throttling"""
+    for attempt in range(FCM_THROTTLE_RETRIES + 1):
+        await state.rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            result = await send_fcm_notification(
+                push_token, title, body, image, link, ttl=ttl
+            )
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            state.flow_controller.observe(
+                time.perf_counter() - started, failed=is_transient_failure(e)
+            )
+            if not isinstance(e, FCMError):
+                raise
+            if (
+                e.status_code in FCM_THROTTLE_STATUS_CODES
+                and attempt < FCM_THROTTLE_RETRIES
+            ):
+                state.rate_limiter.on_throttle(e.retry_after)
+                logger.warning(
+                    f"FCM throttled ({e.status_code}), slowing to "
+                    f"{state.rate_limiter.rate:.0f}/s"
+                )
+                continue
+            raise
+        state.flow_controller.observe(time.perf_counter() - started)
+        state.rate_limiter.on_success()
+        return result
 
 
 async def send_status_update(
     notification_id: str, status: str, error: Optional[str] = None
 ):
-    """Send notification status update to status queue"""
+    """Queue a notification status update for the status queue"""
     try:
         status_message = {
             "notification_id": notification_id,
@@ -116,147 +442,758 @@ async def send_status_update(
             "error": error,
         }
 
-        exchange = await state.rabbitmq_channel.declare_exchange(
-            "notifications.direct", aio_pika.ExchangeType.DIRECT, durable=True
-        )
+        with timed_stage("status"):
+            await state.status_batcher.add(status_message)
 
-        await exchange.publish(
-            aio_pika.Message(
-                body=json.dumps(status_message).encode(),
-                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-            ),
-            routing_key="status.queue",
+        logger.info(f"Status update queued: {notification_id} - {status}")
+    except Exception as e:
+        logger.error(f"Failed to send status update: {e}")
+
+
+async def render_notification(message_body: dict) -> Tuple[str, str]:
+    """Title and body to send: given in the message or rendered from its template"""
+    title = message_body.get("title")
+    body = message_body.get("body")
+    template_code = message_body.get("template_code")
+    if (title is not None or body is not None) or not template_code:
+        return title, body
+
+    with timed_stage("render"):
+        return await state.templates.render(
+            template_code,
+            message_body.get("variables"),
+            language=message_body.get("language") or "en",
+            version=message_body.get("template_version"),
         )
 
-        logger.info(f"Status update sent: {notification_id} - {status}")
+
+def message_lane(message_body: dict) -> str:
+    """Priority lane a message belongs to"""
+    return priority_lane(
+        message_body.get("priority"), PUSH_HIGH_PRIORITY_MIN, PUSH_LOW_PRIORITY_MAX
+    )
+
+
+def queued_at_of(message_body: dict, now: float) -> Optional[float]:
+    """When a message started waiting for a handler, as a Unix timestamp"""
+    try:
+        created_at = datetime.fromisoformat(message_body["created_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    queued_at = created_at.timestamp()
+    send_at = send_at_of(message_body)
+    if send_at is not None and queued_at < send_at <= now:
+        # A released scheduled push has been waiting since its send time
+        queued_at = send_at
+    return queued_at if queued_at <= now else None
+
+
+def observe_queue_wait(lane: str, message_body: dict):
+    """Track a moving average of enqueue-to-dispatch time per lane"""
+    now = time.time()
+    queued_at = queued_at_of(message_body, now)
+    if queued_at is None:
+        return
+    wait = now - queued_at
+    previous = state.lane_wait.get(lane)
+    state.lane_wait[lane] = wait if previous is None else 0.8 * previous + 0.2 * wait
+
+
+async def publish_invalid_token(message_body: dict, error_code: str):
+    """Tell other services (user-service) that a push token is dead"""
+    try:
+        await state.publisher.publish(
+            {
+                "user_id": message_body.get("user_id"),
+                "push_token": message_body.get("push_token"),
+                "notification_id": message_body.get("notification_id"),
+                "error_code": error_code,
+                "timestamp": datetime.utcnow().isoformat(),
+            },
+            routing_key=TOKEN_INVALID_QUEUE,
+        )
     except Exception as e:
-        logger.error(f"Failed to send status update: {e}")
+        logger.error(f"Failed to publish invalid token event: {e}")
+
+
+def dead_letter_body(
+    message_body: dict, retry_count: int, exc: BaseException, error_code: str
+) -> dict:
+    """A failed message as published to failed.queue, with what went wrong"""
+    return {
+        **message_body,
+        "retry_count": retry_count,
+        "error": str(exc),
+        "error_code": error_code,
+        "failed_at": datetime.utcnow().isoformat(),
+    }
+
+
+def message_deadline(message_body: dict) -> Optional[float]:
+    """Unix time after which a message is dropped instead of sent"""
+    return deadline_of(message_body, PUSH_NOTIFICATION_TTLS, PUSH_DEFAULT_TTL)
+
+
+async def expire_message(message_body: dict, reason: str):
+    """Drop a message that would reach the device too late, without retrying it"""
+    notification_id = message_body.get("notification_id")
+    await send_status_update(notification_id, "expired", reason)
+    record_outcome("expired")
+    logger.info(f"Push notification {notification_id} dropped: {reason}")
 
 
-async def process_push_notification(message_body: dict):
+async def process_push_notification(
+    message_body: dict, retry_count: Optional[int] = None
+):
     """Process a single push notification"""
     notification_id = message_body.get("notification_id")
     request_id = message_body.get("request_id")
+    if retry_count is None:
+        retry_count = get_retry_count(message_body)
+
+    claimed = False
+    started = time.perf_counter()
+    deadline = message_deadline(message_body)
 
     try:
 
-        cache_key = f"push:processed:{request_id}"
-        if await state.redis_client.exists(cache_key):
+        # Checked before any Redis or FCM work, so a stale backlog drains fast
+        if deadline is not None and deadline <= time.time():
+            await expire_message(
+                message_body, f"expired {time.time() - deadline:.0f}s ago"
+            )
+            return
+
+        send_at = send_at_of(message_body) if state.send_scheduler else None
+        if send_at is not None and send_at > time.time() + PUSH_SCHEDULE_MIN_DELAY:
+            await state.send_scheduler.park(
+                {**message_body, "retry_count": retry_count},
+                send_at,
+                lane=message_lane(message_body),
+            )
+            await send_status_update(notification_id, "scheduled")
+            record_outcome("scheduled")
+            logger.info(f"Push notification {notification_id} scheduled for {send_at}")
+            return
+
+        with timed_stage("dedup"):
+            claim = await state.idempotency.claim(request_id)
+        if claim == ClaimStatus.DONE:
             logger.info(f"Duplicate notification detected: {request_id}")
+            record_outcome("duplicate")
+            return
+        if claim == ClaimStatus.IN_FLIGHT:
+            logger.info(f"Notification already in flight, deferring: {request_id}")
+            await state.retry_scheduler.schedule(
+                message_body,
+                retry_count,
+                headers=state.tracer.inject(),
+                lane=message_lane(message_body),
+            )
+            record_outcome("deferred")
             return
+        claimed = True
 
         push_token = message_body.get("push_token")
-        title = message_body.get("title")
-        body = message_body.get("body")
+        if await state.invalid_tokens.is_invalid(push_token):
+            logger.info(f"Skipping known invalid push token: {notification_id}")
+            await send_status_update(notification_id, "failed", "invalid_token")
+            await state.idempotency.complete(request_id)
+            record_outcome("invalid_token", error_code="cached")
+            return
+
+        title, body = await render_notification(message_body)
         image = message_body.get("image")
         link = message_body.get("link")
 
         logger.info(f"Processing push notification: {notification_id}")
 
         await send_status_update(notification_id, "pending")
-        result = await send_fcm_notification(push_token, title, body, image, link)
+        # FCM may hold the message for an offline device only until the deadline
+        ttl = deadline - time.time() if deadline is not None else None
+        result = await deliver_push(push_token, title, body, image, link, ttl=ttl)
 
         await send_status_update(notification_id, "delivered")
-        await state.redis_client.setex(cache_key, 3600, "1")
+        await state.idempotency.complete(request_id)
+        record_outcome("delivered")
 
         logger.info(f"Push notification delivered: {notification_id}")
 
+    except asyncio.CancelledError:
+        # Cut off by the drain deadline: free the claim for the redelivered copy
+        if claimed:
+            await state.idempotency.release(request_id)
+        raise
+
     except Exception as e:
         logger.error(f"Failed to process push notification {notification_id}: {e}")
+        error_code = error_code_of(e)
 
-        retry_key = f"push:retry:{notification_id}"
-        retry_count = state.retry_count.get(notification_id, 0)
-
-        if retry_count < 3:
+        if isinstance(e, TemplateNotFoundError):
+            # Retrying cannot make the template appear; the claim is released
+            # so the message can be replayed once it exists
+            record_outcome("rejected", error_code="template_not_found")
+            await send_status_update(notification_id, "failed", str(e))
+            await state.publisher.publish(
+                dead_letter_body(message_body, retry_count, e, "template_not_found"),
+                routing_key=FAILED_QUEUE,
+                headers=state.tracer.inject(),
+            )
+            await state.idempotency.release(request_id)
+            return
 
-            state.retry_count[notification_id] = retry_count + 1
-            delay = 2**retry_count
+        if isinstance(e, FCMError) and e.is_permanent and not e.is_invalid_token:
+            # FCM rejected the payload, not the token: retrying cannot help,
+            # and the token stays valid for other messages
+            record_outcome("rejected", error_code=error_code)
+            await send_status_update(notification_id, "failed", str(e))
+            await state.publisher.publish(
+                dead_letter_body(message_body, retry_count, e, error_code),
+                routing_key=FAILED_QUEUE,
+                headers=state.tracer.inject(),
+            )
+            await state.idempotency.release(request_id)
+            return
 
-            await asyncio.sleep(delay)
-            logger.info(
-                f"Retrying notification {notification_id} (attempt {retry_count + 1})"
+        if isinstance(e, FCMError) and e.is_permanent:
+            record_outcome("invalid_token", error_code=error_code)
+            await state.invalid_tokens.mark_invalid(
+                message_body.get("push_token"), e.error_code
+            )
+            await publish_invalid_token(message_body, e.error_code)
+            await send_status_update(
+                notification_id, "failed", f"invalid_token: {e.error_code}"
             )
+            await state.idempotency.complete(request_id)
+            return
+
+        if claimed:
+            await state.idempotency.release(request_id)
 
-            exchange = await state.rabbitmq_channel.declare_exchange(
-                "notifications.direct", aio_pika.ExchangeType.DIRECT, durable=True
+        if isinstance(e, CircuitOpenError):
+            # FCM is known to be down: park the message without using an attempt
+            await state.retry_scheduler.schedule(
+                message_body,
+                retry_count,
+                headers=state.tracer.inject(),
+                lane=message_lane(message_body),
             )
+            record_outcome("parked", error_code=error_code)
+            return
 
-            await exchange.publish(
-                aio_pika.Message(
-                    body=json.dumps(message_body).encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                ),
-                routing_key="push.queue",
+        if retry_count < PUSH_MAX_RETRIES and deadline is not None and (
+            deadline <= time.time() + state.retry_scheduler.delay_for(retry_count + 1)
+        ):
+            await expire_message(message_body, "expires before the next attempt")
+            return
+
+        if retry_count < PUSH_MAX_RETRIES:
+            record_outcome("retried", error_code=error_code)
+
+            delay = await state.retry_scheduler.schedule(
+                message_body,
+                retry_count + 1,
+                headers=state.tracer.inject(),
+                lane=message_lane(message_body),
+            )
+            logger.info(
+                f"Retrying notification {notification_id} in {delay}s (attempt {retry_count + 1})"
             )
         else:
+            record_outcome("failed", error_code=error_code)
 
             await send_status_update(notification_id, "failed", str(e))
 
-            exchange = await state.rabbitmq_channel.declare_exchange(
-                "notifications.direct", aio_pika.ExchangeType.DIRECT, durable=True
-            )
-
-            await exchange.publish(
-                aio_pika.Message(
-                    body=json.dumps(message_body).encode(),
-                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
-                ),
-                routing_key="failed.queue",
+            await state.publisher.publish(
+                dead_letter_body(message_body, retry_count, e, error_code),
+                routing_key=FAILED_QUEUE,
+                headers=state.tracer.inject(),
             )
 
             logger.error(f"Notification moved to DLQ: {notification_id}")
 
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
 
-async def consume_push_queue():
-    """Consume messages from push queue"""
-    async with state.push_queue.iterator() as queue_iter:
-        async for message in queue_iter:
-            async with message.process():
+
+def describe_invalid_message(exc: ValidationError) -> str:
+    """One-line summary of why a delivery failed validation"""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in error['loc']) or 'body'}: {error['msg']}"
+        for error in exc.errors(include_url=False)
+    )
+
+
+async def reject_malformed_message(body: bytes, reason: str):
+    """Send a message that can never be processed straight to the DLQ"""
+    try:
+        message_body = json_loads(body)
+    except ValueError:
+        message_body = None
+    if not isinstance(message_body, dict):
+        message_body = {"raw_body": body.decode(errors="replace")}
+
+    notification_id = message_body.get("notification_id")
+    if notification_id:
+        await send_status_update(notification_id, "failed", f"invalid_message: {reason}")
+    await state.publisher.publish(
+        {
+            **message_body,
+            "error": reason,
+            "error_code": "invalid_message",
+            "failed_at": datetime.utcnow().isoformat(),
+        },
+        routing_key=FAILED_QUEUE,
+    )
+    record_outcome("rejected", error_code="invalid_message")
+    logger.error(f"Malformed push message moved to DLQ: {reason}")
+
+
+async def handle_malformed_message(
+    message: aio_pika.abc.AbstractIncomingMessage,
+    reason: str,
+    semaphore: AdjustableSemaphore,
+):
+    """Dead-letter one malformed delivery and ack it"""
+    try:
+        async with message.process():
+            try:
+                await reject_malformed_message(message.body, reason)
+            except Exception as e:
+                logger.error(f"Failed to dead-letter malformed message: {e}")
+    finally:
+        semaphore.release()
+
+
+async def handle_push_message(
+    message: aio_pika.abc.AbstractIncomingMessage,
+    message_body: dict,
+    semaphore: AdjustableSemaphore,
+):
+    """Process one delivery and ack it once its own handler finishes"""
+    state.in_flight += 1
+    try:
+        ordering_key = message_body.get(PUSH_ORDERING_KEY) if PUSH_ORDERING_KEY else None
+        ordering_lock = (
+            state.ordering_locks.hold(str(ordering_key)) if ordering_key else nullcontext()
+        )
+
+        headers = message.headers or {}
+        retry_count = get_retry_count(message_body, headers)
+
+        # The trace starts when the message was queued, so its first span
+        # is the time spent waiting for a handler
+        dispatched_ns = time.time_ns()
+        queued_at = queued_at_of(message_body, dispatched_ns / 1e9)
+        queued_ns = int(queued_at * 1e9) if queued_at is not None else dispatched_ns
+        trace = state.tracer.trace(
+            "push.message",
+            traceparent=headers.get("traceparent"),
+            start_ns=queued_ns,
+            notification_id=message_body.get("notification_id"),
+            request_id=message_body.get("request_id"),
+            notification_type=message_body.get("notification_type"),
+            retry_count=retry_count,
+        )
+
+        # requeue only applies when a drain deadline cancels the handler
+        async with message.process(requeue=True), ordering_lock:
+            with trace:
+                state.tracer.add_span("push.queue_wait", queued_ns, dispatched_ns)
                 try:
-                    message_body = json.loads(message.body.decode())
-                    await process_push_notification(message_body)
+                    await process_push_notification(message_body, retry_count)
                 except Exception as e:
                     logger.error(f"Error processing message: {e}")
+    finally:
+        state.in_flight -= 1
+        semaphore.release()
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Startup and shutdown events"""
+async def supersede_message(
+    message: aio_pika.abc.AbstractIncomingMessage, message_body: dict, winner_body: dict
+):
+    """Ack a coalesced delivery that will not be sent and report it superseded"""
+    notification_id = message_body.get("notification_id")
+    request_id = message_body.get("request_id")
+    async with message.process():
+        try:
+            if await state.idempotency.is_processed(request_id):
+                record_outcome("duplicate")
+                return
+            await send_status_update(
+                notification_id,
+                "superseded",
+                f"superseded by {winner_body.get('notification_id')}",
+            )
+            await state.idempotency.complete(request_id)
+            record_outcome("superseded")
+        except Exception as e:
+            logger.error(f"Failed to supersede notification {notification_id}: {e}")
+
+
+async def handle_coalesced(deliveries: list, semaphore: AdjustableSemaphore):
+    """Send the newest delivery of a coalesced group and supersede the rest"""
+    *superseded, (message, message_body) = deliveries
+    for old_message, old_body in superseded:
+        await supersede_message(old_message, old_body, message_body)
+    if superseded:
+        logger.info(
+            f"Coalesced {len(deliveries)} notifications into "
+            f"{message_body.get('notification_id')}"
+        )
+        if PUSH_COALESCE_MODE == "summary":
+            message_body = summarize(message_body, len(deliveries))
 
     try:
+        await semaphore.acquire()
+    except asyncio.CancelledError:
+        await message.nack(requeue=True)
+        raise
+    await handle_push_message(message, message_body, semaphore)
 
-        state.rabbitmq_connection = await aio_pika.connect_robust(RABBITMQ_URL)
-        state.rabbitmq_channel = await state.rabbitmq_connection.channel()
-        await state.rabbitmq_channel.set_qos(prefetch_count=10)
 
-        exchange = await state.rabbitmq_channel.declare_exchange(
-            "notifications.direct", aio_pika.ExchangeType.DIRECT, durable=True
-        )
+async def feed_lane(
+    lane: str, queue: aio_pika.abc.AbstractQueue, scheduler: WeightedLaneScheduler
+):
+    """Buffer deliveries from one priority queue for the lane scheduler"""
+    try:
+        async with queue.iterator() as queue_iter:
+            async for message in queue_iter:
+                state.lane_received[lane] = state.lane_received.get(lane, 0) + 1
+                scheduler.put(lane, message)
+    finally:
+        scheduler.close_lane(lane)
 
-        state.push_queue = await state.rabbitmq_channel.declare_queue(
-            "push.queue", durable=True
-        )
 
-        await state.push_queue.bind(exchange, routing_key="push.queue")
+async def consume_push_queue():
+    """Consume the priority queues with up to PUSH_CONCURRENCY handlers.
+
+    While the FCM circuit breaker is open, consumption is paused: the queue
+    consumers are cancelled and buffered deliveries are requeued, so other
+    messages are not burned through the retry path into failed.queue.
+
+    The flow controller resizes the handler limit in place. A new prefetch
+    only applies to new consumers, so the queues are resubscribed the same
+    way to apply it.
+
+    With PUSH_COALESCE_WINDOW set, deliveries with a collapse key are held
+    without a handler slot until their group closes.
+    """
+    semaphore = AdjustableSemaphore(PUSH_CONCURRENCY)
+    tasks = state.handler_tasks
+    prefetch = PUSH_PREFETCH_COUNT
+
+    def dispatch_coalesced(key: str, deliveries: list):
+        task = asyncio.create_task(handle_coalesced(deliveries, semaphore))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    coalescer = state.coalescer = PushCoalescer(
+        dispatch_coalesced, window=PUSH_COALESCE_WINDOW, max_size=PUSH_COALESCE_MAX
+    )
 
-        state.redis_client = await aioredis.from_url(REDIS_URL, decode_responses=True)
+    def pause_on_open(old_state: str, new_state: str):
+        if new_state == "open" and state.lane_scheduler:
+            state.lane_scheduler.interrupt()
 
-        logger.info("Push Service started successfully")
+    def resize(concurrency: int, new_prefetch: int):
+        semaphore.limit = concurrency
+        if new_prefetch != prefetch and state.lane_scheduler:
+            state.lane_scheduler.interrupt()
 
+    state.circuit_breaker.listeners.append(pause_on_open)
+    state.flow_controller.listeners.append(resize)
+
+    try:
+        while not state.draining:
+            await state.circuit_breaker.wait_until_available()
+
+            if state.flow_controller.prefetch != prefetch and state.rabbitmq_channel:
+                prefetch = state.flow_controller.prefetch
+                await state.rabbitmq_channel.set_qos(prefetch_count=prefetch)
+
+            scheduler = WeightedLaneScheduler(
+                {lane: PUSH_PRIORITY_WEIGHTS.get(lane, 1) for lane in state.push_queues},
+                max_wait=PUSH_PRIORITY_MAX_WAIT,
+            )
+            state.lane_scheduler = scheduler
+            feeders = [
+                asyncio.create_task(feed_lane(lane, queue, scheduler))
+                for lane, queue in state.push_queues.items()
+            ]
+
+            try:
+                while True:
+                    # Pick the next lane only once a handler slot is free
+                    await semaphore.acquire()
+                    next_delivery = await scheduler.get()
+                    if next_delivery is None:
+                        semaphore.release()
+                        break
+                    lane, message = next_delivery
+
+                    try:
+                        with timed_stage("decode"):
+                            message_body = decode_push_message(message.body)
+                    except ValidationError as e:
+                        task = asyncio.create_task(
+                            handle_malformed_message(
+                                message, describe_invalid_message(e), semaphore
+                            )
+                        )
+                    else:
+                        observe_queue_wait(lane, message_body)
+                        key = PUSH_COALESCE_WINDOW > 0 and coalesce_key(message_body)
+                        if key:
+                            coalescer.add(key, (message, message_body))
+                            semaphore.release()
+                            continue
+                        task = asyncio.create_task(
+                            handle_push_message(message, message_body, semaphore)
+                        )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            finally:
+                for feeder in feeders:
+                    feeder.cancel()
+                await asyncio.gather(*feeders, return_exceptions=True)
+                for message in scheduler.drain():
+                    await message.nack(requeue=True)
+                for message, _ in coalescer.drain():
+                    await message.nack(requeue=True)
+
+            if state.draining or not scheduler.interrupted:
+                break
+            if state.circuit_breaker_open:
+                logger.warning("FCM circuit open, pausing push consumption")
+            else:
+                logger.info(
+                    f"Resubscribing push queues with prefetch {state.flow_controller.prefetch}"
+                )
+    finally:
+        state.circuit_breaker.listeners.remove(pause_on_open)
+        state.flow_controller.listeners.remove(resize)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def start_service(role: str = "all"):
+    """Connect to RabbitMQ, Redis and FCM and start the background tasks.
+
+    `role` is "all" for a single process that serves the API and consumes,
+    "api" for the API process in multi-process mode, which samples queues
+    and aggregates worker reports without consuming, and "worker" for a
+    consumer process started by the supervisor.
+    """
+    state.role = role
+    consume = role != "api"
+
+    state.rabbitmq_connection = await aio_pika.connect_robust(RABBITMQ_URL)
+    state.rabbitmq_channel = await state.rabbitmq_connection.channel()
+    await state.rabbitmq_channel.set_qos(prefetch_count=PUSH_PREFETCH_COUNT)
+
+    exchange = await state.rabbitmq_channel.declare_exchange(
+        "notifications.direct", aio_pika.ExchangeType.DIRECT, durable=True
+    )
+
+    for lane, (queue_name, routing_key) in PRIORITY_QUEUES.items():
+        queue = await state.rabbitmq_channel.declare_queue(queue_name, durable=True)
+        await queue.bind(exchange, routing_key=queue_name)
+        await queue.bind(exchange, routing_key=routing_key)
+        state.push_queues[lane] = queue
+    state.push_queue = state.push_queues["normal"]
+
+    state.publisher = Publisher(state.rabbitmq_connection, "notifications.direct")
+    await state.publisher.start()
+
+    state.status_batcher = StatusBatcher(
+        state.publisher,
+        routing_key="status.queue",
+        flush_interval=STATUS_FLUSH_INTERVAL_MS / 1000,
+        pending_window=STATUS_PENDING_WINDOW_MS / 1000,
+        max_batch=STATUS_BATCH_MAX_SIZE,
+        suppress_pending=STATUS_SUPPRESS_PENDING,
+    )
+    state.status_batcher.start()
+
+    state.retry_scheduler = RetryScheduler(
+        state.publisher,
+        delays=PUSH_RETRY_DELAYS,
+        lanes=LANE_QUEUES,
+    )
+    await state.retry_scheduler.declare(state.rabbitmq_channel)
+
+    failed_queue = await state.rabbitmq_channel.declare_queue(FAILED_QUEUE, durable=True)
+    await failed_queue.bind(exchange, routing_key=FAILED_QUEUE)
+    state.failed_queue = failed_queue
+
+    # Invalid token events wait here for User Service instead of being dropped
+    token_invalid_queue = await state.rabbitmq_channel.declare_queue(
+        TOKEN_INVALID_QUEUE, durable=True
+    )
+    await token_invalid_queue.bind(exchange, routing_key=TOKEN_INVALID_QUEUE)
+
+    if role != "worker":
+        for lane, (queue_name, _) in PRIORITY_QUEUES.items():
+            # Only a process that consumes knows its egress; the API process
+            # in multi-process mode reports depth and net rate alone
+            consumed = (
+                (lambda lane=lane: state.lane_received.get(lane, 0))
+                if role == "all"
+                else None
+            )
+            state.queue_sampler.track(
+                queue_name, [state.push_queues[lane]], consumed=consumed
+            )
+        state.queue_sampler.track("retry", state.retry_scheduler.queues)
+        state.queue_sampler.track(FAILED_QUEUE, [failed_queue])
+        state.queue_sampler.start()
+
+    state.redis_client = await aioredis.from_url(REDIS_URL, decode_responses=True)
+    state.idempotency = IdempotencyStore(
+        state.redis_client,
+        inflight_ttl=PUSH_INFLIGHT_TTL,
+        done_ttl=PUSH_PROCESSED_TTL,
+        local_size=PUSH_LOCAL_DEDUP_SIZE,
+    )
+    state.invalid_tokens = InvalidTokenCache(
+        state.redis_client,
+        ttl=INVALID_TOKEN_TTL,
+        local_size=INVALID_TOKEN_LOCAL_SIZE,
+        valid_ttl=INVALID_TOKEN_VALID_TTL,
+    )
+    if PUSH_SCHEDULING:
+        state.send_scheduler = SendScheduler(
+            state.redis_client,
+            state.publisher,
+            lanes=LANE_QUEUES,
+            batch_size=PUSH_SCHEDULE_BATCH_SIZE,
+            release_rate=PUSH_SCHEDULE_RELEASE_RATE,
+            spread=PUSH_SCHEDULE_SPREAD,
+            interval=PUSH_SCHEDULE_INTERVAL,
+        )
+        state.send_scheduler.start(release=consume)
+    state.worker_registry = WorkerRegistry(
+        state.redis_client, stale_after=PUSH_WORKER_HEARTBEAT_INTERVAL * 3
+    )
+
+    state.http_client = create_http_client(
+        max_connections=FCM_MAX_CONNECTIONS,
+        max_keepalive_connections=FCM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=FCM_KEEPALIVE_EXPIRY,
+        timeout=FCM_TIMEOUT,
+        http2=FCM_HTTP2,
+    )
+
+    if consume:
+        state.templates = TemplateClient(
+            TEMPLATE_SERVICE_URL,
+            cache_size=TEMPLATE_CACHE_SIZE,
+            ttl=TEMPLATE_CACHE_TTL,
+            timeout=TEMPLATE_SERVICE_TIMEOUT,
+            max_connections=TEMPLATE_SERVICE_MAX_CONNECTIONS,
+        )
+        state.rate_limiter.redis_client = state.redis_client
+        state.rate_limiter.start()
+        state.token_manager.start()
+        if PUSH_FLOW_CONTROL:
+            state.flow_controller.start()
+        state.tracer.start()
         state.is_processing = True
-        asyncio.create_task(consume_push_queue())
+        state.consumer_task = asyncio.create_task(consume_push_queue())
 
-    except Exception as e:
-        logger.error(f"Failed to start Push Service: {e}")
-        raise
 
-    yield
+async def drain(timeout: float):
+    """Stop taking deliveries and wait up to `timeout` for in-flight handlers.
 
+    Buffered deliveries are requeued at once. Handlers still running at the
+    deadline are cancelled: their claims are released and their messages
+    requeued, so the copy another consumer receives is processed normally.
+    """
+    state.draining = True
     state.is_processing = False
+    if state.lane_scheduler:
+        state.lane_scheduler.interrupt()
+    if not state.consumer_task:
+        return
+
+    logger.info(f"Draining push consumer, {state.in_flight} handlers in flight")
+    done, _ = await asyncio.wait({state.consumer_task}, timeout=timeout)
+    if not done:
+        state.drain_cancelled = len(state.handler_tasks)
+        logger.warning(
+            f"Drain deadline reached, requeueing {state.drain_cancelled} in-flight messages"
+        )
+        for task in list(state.handler_tasks):
+            task.cancel()
+        state.consumer_task.cancel()
+    try:
+        await state.consumer_task
+    except asyncio.CancelledError:
+        pass
+    state.consumer_task = None
+    logger.info("Push consumer drained")
+
+
+async def stop_service():
+    """Drain the consumer, flush buffered status updates and close connections"""
+    await drain(PUSH_DRAIN_TIMEOUT)
+    if state.replay_task:
+        state.replay_task.cancel()
+        await asyncio.gather(state.replay_task, return_exceptions=True)
+    await state.queue_sampler.stop()
+    await state.token_manager.stop()
+    await state.rate_limiter.stop()
+    await state.flow_controller.stop()
+    await state.tracer.stop()
+    if state.send_scheduler:
+        await state.send_scheduler.stop()
+    if state.status_batcher:
+        await state.status_batcher.stop()
+    if state.publisher:
+        await state.publisher.close()
     if state.rabbitmq_connection:
         await state.rabbitmq_connection.close()
     if state.redis_client:
         await state.redis_client.close()
+    if state.http_client:
+        await state.http_client.aclose()
+    if state.templates:
+        await state.templates.close()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown events"""
+
+    try:
+
+        await start_service("api" if PUSH_WORKERS else "all")
+
+        if PUSH_WORKERS:
+            # Imported here because src.worker imports this module
+            from src.worker import run_worker
+
+            state.supervisor = WorkerSupervisor(
+                run_worker, PUSH_WORKERS, shutdown_timeout=PUSH_WORKER_SHUTDOWN_TIMEOUT
+            )
+            state.supervisor.start()
+            state.supervisor.watch(PUSH_WORKER_HEARTBEAT_INTERVAL)
+
+        logger.info("Push Service started successfully")
+
+    except Exception as e:
+        logger.error(f"Failed to start Push Service: {e}")
+        raise
+
+    yield
+
+    if state.supervisor:
+        state.draining = True
+        await state.supervisor.stop()
+    await stop_service()
     logger.info("Push Service shut down")
 
 
@@ -276,16 +1213,70 @@ app.add_middleware(
 )
 
 
+def local_metrics() -> dict:
+    """Metrics kept by this process; workers report these to the API process"""
+    scheduler = state.lane_scheduler
+    priorities = {}
+    for lane in PRIORITY_QUEUES:
+        priorities[lane] = {
+            "buffered": scheduler.depth(lane) if scheduler else 0,
+            "dispatched": scheduler.dispatched.get(lane, 0) if scheduler else 0,
+            "oldest_buffered_wait_seconds": (
+                scheduler.oldest_wait(lane) if scheduler else 0.0
+            ),
+            "avg_queue_wait_seconds": state.lane_wait.get(lane),
+        }
+    return {
+        "is_processing": state.is_processing,
+        "draining": state.draining,
+        "in_flight": state.in_flight,
+        "drain_cancelled": state.drain_cancelled,
+        "concurrency": state.flow_controller.concurrency,
+        "flow_control": state.flow_controller.metrics(),
+        "coalescing": state.coalescer.metrics() if state.coalescer else None,
+        "priorities": priorities,
+        "circuit_breaker_open": state.circuit_breaker_open,
+        "circuit_breaker": state.circuit_breaker.metrics(),
+        "fcm_token": state.token_manager.metrics(),
+        "fcm_rate_limit": state.rate_limiter.metrics(),
+        "messages_published": state.publisher.published if state.publisher else 0,
+        "idempotency": state.idempotency.metrics() if state.idempotency else None,
+        "invalid_tokens": (
+            state.invalid_tokens.metrics() if state.invalid_tokens else None
+        ),
+        "status_updates": (
+            state.status_batcher.metrics() if state.status_batcher else None
+        ),
+        "templates": state.templates.metrics() if state.templates else None,
+        "tracing": state.tracer.metrics(),
+    }
+
+
+async def worker_metrics() -> Tuple[Dict[str, dict], MetricsRegistry]:
+    """Live worker reports and their metrics summed into one registry"""
+    reports = await state.worker_registry.reports()
+    registry = metrics.merged(report["metrics"] for report in reports.values())
+    return reports, registry
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint"""
+    status = "draining" if state.draining else "healthy"
+    workers_alive = None
+    if state.supervisor:
+        workers_alive = state.supervisor.alive()
+        if workers_alive < state.supervisor.workers and not state.draining:
+            status = "degraded"
     return HealthResponse(
-        status="healthy",
+        status=status,
         service="push-service",
         timestamp=datetime.now(timezone.utc).isoformat(),
         queue_connected=state.rabbitmq_connection is not None
         and not state.rabbitmq_connection.is_closed,
         redis_connected=state.redis_client is not None,
+        in_flight=state.in_flight if state.role != "api" else None,
+        workers_alive=workers_alive,
     )
 
 
@@ -294,19 +1285,149 @@ async def get_metrics():
     """Get service metrics"""
     try:
 
-        declare_ok = await state.push_queue.declare()
-
+        if state.role == "api":
+            reports, registry = await worker_metrics()
+            workers = {
+                worker_id: {
+                    "pid": report["pid"],
+                    "heartbeat_age_seconds": report["heartbeat_age_seconds"],
+                    **report["local"],
+                }
+                for worker_id, report in reports.items()
+            }
+            data = {
+                "is_processing": any(w["is_processing"] for w in workers.values()),
+                "in_flight": sum(w["in_flight"] for w in workers.values()),
+                "concurrency": sum(w["concurrency"] for w in workers.values()),
+                "priorities": {lane: {} for lane in PRIORITY_QUEUES},
+                "circuit_breaker_open": any(
+                    w["circuit_breaker_open"] for w in workers.values()
+                ),
+                "supervisor": state.supervisor.metrics() if state.supervisor else None,
+                "workers": workers,
+            }
+        else:
+            registry = metrics
+            data = local_metrics()
+
+        sampler = state.queue_sampler
+        for lane, (queue_name, _) in PRIORITY_QUEUES.items():
+            data["priorities"][lane]["queue_length"] = sampler.depth(queue_name)
+        data.update(
+            {
+                "queue_length": sampler.depth(PRIORITY_QUEUES["normal"][0]),
+                "active_retries": sampler.depth("retry"),
+                "failed_queue_length": sampler.depth(FAILED_QUEUE),
+                "queues": sampler.metrics(),
+                "scheduled": (
+                    state.send_scheduler.metrics() if state.send_scheduler else None
+                ),
+                "stages": registry.get(STAGE_SECONDS.name).snapshot(),
+                "outcomes": registry.get(PUSH_OUTCOMES.name).snapshot(),
+            }
+        )
         return {
             "success": True,
-            "data": {
-                "queue_length": declare_ok.message_count,
-                "is_processing": state.is_processing,
-                "active_retries": len(state.retry_count),
-                "circuit_breaker_open": state.circuit_breaker_open,
-            },
+            "data": data,
             "message": "Metrics retrieved successfully",
             "meta": None,
         }
     except Exception as e:
         logger.error(f"Failed to get metrics: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/metrics/prometheus", response_class=PlainTextResponse)
+async def get_prometheus_metrics():
+    """Get service metrics in Prometheus text exposition format"""
+    registry = metrics
+    if state.role == "api":
+        _, registry = await worker_metrics()
+    return PlainTextResponse(
+        registry.render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
+def require_admin(authorization: Optional[str] = Header(None)):
+    """Admin endpoints need `Authorization: Bearer $PUSH_ADMIN_TOKEN`"""
+    if not PUSH_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if authorization != f"Bearer {PUSH_ADMIN_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def create_replayer(rate: float) -> FailedQueueReplayer:
+    return FailedQueueReplayer(
+        state.failed_queue,
+        state.publisher,
+        state.idempotency,
+        state.redis_client,
+        lanes=LANE_QUEUES,
+        lane_of=message_lane,
+        rate=rate,
+    )
+
+
+@app.post("/admin/replay", dependencies=[Depends(require_admin)])
+async def start_replay(request: ReplayRequest):
+    """Start replaying failed.queue in the background, or resume a run"""
+    if state.replay_task and not state.replay_task.done():
+        raise HTTPException(
+            status_code=409, detail=f"Replay {state.replayer.run_id} is already running"
+        )
+    replayer = create_replayer(request.rate or PUSH_REPLAY_RATE)
+    if request.resume and await replayer.load(request.resume) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown replay run {request.resume}")
+
+    run_id = request.resume or uuid.uuid4().hex
+    state.replayer = replayer
+    state.replay_task = asyncio.create_task(
+        state.replayer.run(
+            ReplayFilter(
+                since=request.since,
+                until=request.until,
+                error_codes=request.error_codes,
+                notification_types=request.notification_types,
+            ),
+            limit=request.limit,
+            run_id=run_id,
+        )
+    )
+    return {
+        "success": True,
+        "data": {"run_id": run_id},
+        "message": "Replay started",
+        "meta": None,
+    }
+
+
+@app.get("/admin/replay/{run_id}", dependencies=[Depends(require_admin)])
+async def get_replay(run_id: str):
+    """Progress of a replay run, from any replica"""
+    progress = await create_replayer(PUSH_REPLAY_RATE).load(run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail=f"Unknown replay run {run_id}")
+    return {
+        "success": True,
+        "data": progress,
+        "message": "Replay progress retrieved successfully",
+        "meta": None,
+    }
+
+
+@app.delete("/admin/replay/{run_id}", dependencies=[Depends(require_admin)])
+async def stop_replay(run_id: str):
+    """Stop a replay running on this replica; it can be resumed later"""
+    if (
+        not state.replay_task
+        or state.replay_task.done()
+        or state.replayer.run_id != run_id
+    ):
+        raise HTTPException(status_code=404, detail=f"Replay {run_id} is not running here")
+    state.replayer.stop()
+    return {
+        "success": True,
+        "data": {"run_id": run_id},
+        "message": "Replay stopping",
+        "meta": None,
+    }
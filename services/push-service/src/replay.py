@@ -0,0 +1,87 @@
+"""
+Replay dead-lettered push messages from failed.queue.
+
+Matching messages are republished to their priority lane at --rate per
+second. Messages whose request id is already processed are dropped, and
+the rest stay in failed.queue. Progress is kept in Redis, and an
+interrupted run continues with --resume:
+
+    python -m src.replay --error-code UNAVAILABLE --since 2026-10-17T08:00 --rate 100
+    python -m src.replay --resume <run id>
+
+The same replay can be started through `POST /admin/replay`.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import signal
+
+import aio_pika
+from redis import asyncio as aioredis
+
+from src import main
+from src.services import FailedQueueReplayer, IdempotencyStore, Publisher, ReplayFilter
+
+logger = logging.getLogger(__name__)
+
+
+async def replay(args) -> dict:
+    connection = await aio_pika.connect_robust(main.RABBITMQ_URL)
+    redis_client = await aioredis.from_url(main.REDIS_URL, decode_responses=True)
+    try:
+        channel = await connection.channel()
+        failed_queue = await channel.declare_queue(main.FAILED_QUEUE, durable=True)
+        publisher = Publisher(connection, "notifications.direct")
+        await publisher.start()
+
+        replayer = FailedQueueReplayer(
+            failed_queue,
+            publisher,
+            IdempotencyStore(
+                redis_client,
+                inflight_ttl=main.PUSH_INFLIGHT_TTL,
+                done_ttl=main.PUSH_PROCESSED_TTL,
+            ),
+            redis_client,
+            lanes=main.LANE_QUEUES,
+            lane_of=main.message_lane,
+            rate=args.rate,
+        )
+        if args.resume and await replayer.load(args.resume) is None:
+            raise SystemExit(f"Unknown replay run {args.resume}")
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, replayer.stop)
+
+        return await replayer.run(
+            ReplayFilter(
+                since=args.since,
+                until=args.until,
+                error_codes=args.error_code,
+                notification_types=args.notification_type,
+            ),
+            limit=args.limit,
+            run_id=args.resume,
+        )
+    finally:
+        await connection.close()
+        await redis_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--since", help="replay messages that failed at or after this time")
+    parser.add_argument("--until", help="replay messages that failed before this time")
+    parser.add_argument(
+        "--error-code", action="append", help="FCM error code or exception type; repeatable"
+    )
+    parser.add_argument("--notification-type", action="append", help="repeatable")
+    parser.add_argument("--rate", type=float, default=main.PUSH_REPLAY_RATE)
+    parser.add_argument("--limit", type=int, help="stop after replaying this many")
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue an earlier run")
+    print(json.dumps(asyncio.run(replay(parser.parse_args())), indent=2))
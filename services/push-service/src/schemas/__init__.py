@@ -1,4 +1,18 @@
-from .push import HealthResponse, NotificationStatus, PushNotification
+from .push import (
+    decode_push_message,
+    HealthResponse,
+    NotificationStatus,
+    PushMessage,
+    PushNotification,
+    ReplayRequest,
+)
 
 
-__all__ = ["HealthResponse", "NotificationStatus", "PushNotification"]
+__all__ = [
+    "decode_push_message",
+    "HealthResponse",
+    "NotificationStatus",
+    "PushMessage",
+    "PushNotification",
+    "ReplayRequest",
+]
@@ -1,7 +1,18 @@
-from pydantic import BaseModel, Field
-from typing import Optional, Any, Dict
+from pydantic import (
+    BaseModel,
+    BeforeValidator,
+    ConfigDict,
+    Field,
+    StringConstraints,
+    TypeAdapter,
+    with_config,
+)
+from typing import Optional, Any, Dict, List
+from typing_extensions import Annotated, NotRequired, TypedDict
 from datetime import datetime
 
+from src.utils import json_loads
+
 
 class PushNotification(BaseModel):
     notification_id: str
@@ -23,6 +34,57 @@ class PushNotification(BaseModel):
     retry_count: int = 0
 
 
+def _decode_json_string(value: Any) -> Any:
+    """Parse a JSON-encoded string; other values pass through unchanged"""
+    if not isinstance(value, str):
+        return value
+    if not value.strip():
+        return None
+    try:
+        return json_loads(value)
+    except ValueError:
+        raise ValueError("metadata is not valid JSON")
+
+
+@with_config(ConfigDict(extra="allow"))
+class PushMessage(TypedDict):
+    """A push.queue message as published by the API gateway.
+
+    Validated straight from the delivery bytes into a plain dict, so the
+    consumer parses and checks each message in one pass. Fields the
+    service does not read are kept as they are, for retries and the DLQ.
+    """
+
+    notification_id: Annotated[str, StringConstraints(min_length=1)]
+    request_id: Annotated[str, StringConstraints(min_length=1)]
+    push_token: Annotated[str, StringConstraints(min_length=1)]
+    notification_type: NotRequired[str]
+    user_id: NotRequired[Optional[str]]
+    title: NotRequired[Optional[str]]
+    body: NotRequired[Optional[str]]
+    image: NotRequired[Optional[str]]
+    link: NotRequired[Optional[str]]
+    template_code: NotRequired[Optional[str]]
+    template_version: NotRequired[Optional[int]]
+    language: NotRequired[Optional[str]]
+    priority: NotRequired[Optional[int]]
+    # The gateway stores metadata as a string column and publishes it as is
+    metadata: NotRequired[
+        Annotated[Optional[Dict[str, Any]], BeforeValidator(_decode_json_string)]
+    ]
+    variables: NotRequired[Optional[Dict[str, Any]]]
+    created_at: NotRequired[Optional[str]]
+    retry_count: NotRequired[Optional[int]]
+
+
+_push_message_adapter = TypeAdapter(PushMessage)
+
+
+def decode_push_message(body: bytes) -> PushMessage:
+    """Parse and validate a delivery body, raising pydantic.ValidationError"""
+    return _push_message_adapter.validate_json(body)
+
+
 class NotificationStatus(BaseModel):
     notification_id: str
     status: str
@@ -36,3 +98,17 @@ class HealthResponse(BaseModel):
     timestamp: str
     queue_connected: bool
     redis_connected: bool
+    in_flight: Optional[int] = None
+    workers_alive: Optional[int] = None
+
+
+class ReplayRequest(BaseModel):
+    """Filter and pace of a failed.queue replay; `resume` continues an earlier run"""
+
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    error_codes: Optional[List[str]] = None
+    notification_types: Optional[List[str]] = None
+    rate: Optional[float] = Field(None, gt=0)
+    limit: Optional[int] = Field(None, gt=0)
+    resume: Optional[str] = None
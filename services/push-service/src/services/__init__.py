@@ -0,0 +1,56 @@
+from .circuit_breaker import AsyncCircuitBreaker, CircuitOpenError
+from .coalescer import coalesce_key, PushCoalescer, summarize
+from .expiry import deadline_of, parse_ttls
+from .fcm import build_fcm_message, create_http_client, FCMError
+from .flow_control import FlowController
+from .idempotency import ClaimStatus, IdempotencyStore
+from .invalid_tokens import InvalidTokenCache
+from .priority import parse_weights, priority_lane, WeightedLaneScheduler
+from .publisher import Publisher
+from .queue_sampler import QueueDepthSampler
+from .rate_limiter import AdaptiveRateLimiter
+from .replay import FailedQueueReplayer, ReplayFilter
+from .retry import RETRY_COUNT_HEADER, RetryScheduler, get_retry_count
+from .send_scheduler import send_at_of, SendScheduler
+from .status_batcher import StatusBatcher
+from .supervisor import WorkerSupervisor
+from .templates import TemplateClient, TemplateNotFoundError
+from .token_manager import TokenManager
+from .worker_registry import WorkerRegistry
+
+
+__all__ = [
+    "AdaptiveRateLimiter",
+    "AsyncCircuitBreaker",
+    "build_fcm_message",
+    "CircuitOpenError",
+    "ClaimStatus",
+    "coalesce_key",
+    "create_http_client",
+    "deadline_of",
+    "FailedQueueReplayer",
+    "FCMError",
+    "FlowController",
+    "get_retry_count",
+    "IdempotencyStore",
+    "InvalidTokenCache",
+    "parse_ttls",
+    "parse_weights",
+    "priority_lane",
+    "Publisher",
+    "PushCoalescer",
+    "QueueDepthSampler",
+    "ReplayFilter",
+    "RETRY_COUNT_HEADER",
+    "RetryScheduler",
+    "send_at_of",
+    "SendScheduler",
+    "StatusBatcher",
+    "summarize",
+    "TemplateClient",
+    "TemplateNotFoundError",
+    "TokenManager",
+    "WeightedLaneScheduler",
+    "WorkerRegistry",
+    "WorkerSupervisor",
+]
@@ -0,0 +1,151 @@
+from collections import deque
+from functools import wraps
+from typing import Callable, Deque, List, Tuple
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling through while the circuit is open"""
+
+
+class AsyncCircuitBreaker:
+    """Circuit breaker for coroutines, driven by a sliding-window failure rate.
+
+    The circuit opens when at least `min_calls` calls in the last `window`
+    seconds failed at `failure_rate` or more. After `open_timeout` it goes
+    half-open and lets at most `half_open_max_calls` probes through at once;
+    `half_open_successes` successful probes close it, any failure reopens it.
+    """
+
+    def __init__(
+        self,
+        window: float = 30.0,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        open_timeout: float = 30.0,
+        half_open_max_calls: int = 3,
+        half_open_successes: int = 3,
+        is_failure: Callable[[BaseException], bool] = lambda exc: True,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_timeout = open_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.half_open_successes = half_open_successes
+        self.is_failure = is_failure
+        self._state = CLOSED
+        self._calls: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.transitions: Deque[Tuple[float, str, str]] = deque(maxlen=20)
+        self.listeners: List[Callable[[str, str], None]] = []
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_timeout:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, new_state: str):
+        old_state, self._state = self._state, new_state
+        if new_state == OPEN:
+            self._opened_at = time.monotonic()
+        if new_state == HALF_OPEN:
+            self._probes = 0
+            self._probe_successes = 0
+        if new_state == CLOSED:
+            self._calls.clear()
+        self.transitions.append((time.time(), old_state, new_state))
+        logger.warning(f"Circuit breaker {old_state} -> {new_state}")
+        for listener in self.listeners:
+            listener(old_state, new_state)
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def failure_ratio(self) -> float:
+        self._prune(time.monotonic())
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, failed in self._calls if failed) / len(self._calls)
+
+    def _before_call(self):
+        state = self.state
+        if state == OPEN or (
+            state == HALF_OPEN and self._probes >= self.half_open_max_calls
+        ):
+            self.rejected += 1
+            raise CircuitOpenError("FCM circuit breaker is open")
+        if state == HALF_OPEN:
+            self._probes += 1
+
+    def _record(self, failed: bool, probe: bool):
+        if probe:
+            self._probes -= 1
+            if self._state != HALF_OPEN:
+                return
+            if failed:
+                self._transition(OPEN)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_successes:
+                    self._transition(CLOSED)
+            return
+
+        now = time.monotonic()
+        self._calls.append((now, failed))
+        self._prune(now)
+        if (
+            self._state == CLOSED
+            and len(self._calls) >= self.min_calls
+            and self.failure_ratio() >= self.failure_rate
+        ):
+            self._transition(OPEN)
+
+    async def call(self, func, *args, **kwargs):
+        self._before_call()
+        probe = self._state == HALF_OPEN
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self._record(self.is_failure(e), probe)
+            raise
+        self._record(False, probe)
+        return result
+
+    def __call__(self, func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await self.call(func, *args, **kwargs)
+
+        return wrapper
+
+    async def wait_until_available(self):
+        """Sleep while the circuit is open"""
+        while self.state == OPEN:
+            remaining = self.open_timeout - (time.monotonic() - self._opened_at)
+            await asyncio.sleep(max(remaining, 0.01))
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failure_ratio(), 3),
+            "calls_in_window": len(self._calls),
+            "rejected": self.rejected,
+            "transitions": [
+                {"at": at, "from": old_state, "to": new_state}
+                for at, old_state, new_state in self.transitions
+            ],
+        }
@@ -0,0 +1,98 @@
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import logging
+
+from .templates import CompiledTemplate
+
+logger = logging.getLogger(__name__)
+
+
+def coalesce_key(message_body: dict) -> Optional[str]:
+    """Group key for a message: its push token plus `metadata.collapse_key`"""
+    metadata = message_body.get("metadata") or {}
+    collapse_key = metadata.get("collapse_key")
+    if collapse_key is None or collapse_key == "":
+        return None
+    return f"{message_body.get('push_token')}:{collapse_key}"
+
+
+def summarize(message_body: dict, count: int) -> dict:
+    """The newest message of a group, rewritten to stand for all `count` of them.
+
+    `coalesced_count` is added to the template variables, and
+    `metadata.summary_title` / `metadata.summary_body`, when given, replace
+    the title and body, rendered with those variables.
+    """
+    metadata = message_body.get("metadata") or {}
+    variables = {**(message_body.get("variables") or {}), "coalesced_count": count}
+    summary = {**message_body, "variables": variables}
+    for field in ("title", "body"):
+        text = metadata.get(f"summary_{field}")
+        if text:
+            summary[field] = CompiledTemplate(text).render(variables)
+    return summary
+
+
+class PushCoalescer:
+    """Hold deliveries that share a key for a short window.
+
+    The first delivery for a key opens a group that closes `window` seconds
+    later, or as soon as it holds `max_size` deliveries. A closed group is
+    passed to `on_close` in arrival order; the caller sends the newest and
+    supersedes the rest.
+    """
+
+    def __init__(
+        self,
+        on_close: Callable[[str, List[Any]], None],
+        window: float = 2.0,
+        max_size: int = 50,
+    ):
+        self.on_close = on_close
+        self.window = window
+        self.max_size = max_size
+        self._groups: Dict[str, List[Any]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self.groups_closed = 0
+        self.superseded = 0
+
+    def add(self, key: str, item: Any):
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = []
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.window, self._close, key
+            )
+        group.append(item)
+        if len(group) >= self.max_size:
+            self._close(key)
+
+    def _close(self, key: str):
+        self._timers.pop(key).cancel()
+        group = self._groups.pop(key)
+        self.groups_closed += 1
+        self.superseded += len(group) - 1
+        try:
+            self.on_close(key, group)
+        except Exception as e:
+            logger.error(f"Failed to dispatch coalesced group {key}: {e}")
+
+    def drain(self) -> List[Any]:
+        """Remove and return every held item without closing its group"""
+        for timer in self._timers.values():
+            timer.cancel()
+        items = [item for group in self._groups.values() for item in group]
+        self._groups.clear()
+        self._timers.clear()
+        return items
+
+    def __len__(self) -> int:
+        return sum(len(group) for group in self._groups.values())
+
+    def metrics(self) -> dict:
+        return {
+            "open_groups": len(self._groups),
+            "held": len(self),
+            "groups_closed": self.groups_closed,
+            "superseded": self.superseded,
+        }
@@ -0,0 +1,51 @@
+from typing import Dict, Optional
+import logging
+
+from .send_scheduler import send_at_of, timestamp_of
+
+logger = logging.getLogger(__name__)
+
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    """Parse "otp:300,ride_arrival:120" into a TTL in seconds per notification type"""
+    ttls = {}
+    for part in spec.split(","):
+        notification_type, _, ttl = part.partition(":")
+        if notification_type.strip() and ttl.strip():
+            ttls[notification_type.strip()] = float(ttl)
+    return ttls
+
+
+def deadline_of(
+    message_body: dict, ttls: Dict[str, float], default_ttl: float = 0.0
+) -> Optional[float]:
+    """Unix time after which a message is no longer worth sending, or None.
+
+    The TTL for the message's `notification_type` (or `default_ttl`; 0 means
+    none) counts from `created_at`, or from `metadata.send_at` for a push
+    scheduled later than that. `metadata.ttl` overrides that TTL for one
+    message, and `metadata.expires_at` sets an absolute deadline; when
+    both a TTL and `expires_at` apply, the earlier one wins.
+    """
+    metadata = message_body.get("metadata") or {}
+    ttl = metadata.get("ttl")
+    if ttl is None or isinstance(ttl, bool):
+        ttl = ttls.get(message_body.get("notification_type"), default_ttl)
+    try:
+        ttl = float(ttl)
+    except (TypeError, ValueError):
+        logger.warning(f"Ignoring unreadable ttl: {ttl!r}")
+        ttl = 0.0
+
+    deadlines = []
+    expires_at = timestamp_of(metadata.get("expires_at"), "expires_at")
+    if expires_at is not None:
+        deadlines.append(expires_at)
+    if ttl > 0:
+        created_at = timestamp_of(message_body.get("created_at"), "created_at")
+        send_at = send_at_of(message_body)
+        if created_at is not None and send_at is not None:
+            created_at = max(created_at, send_at)
+        if created_at is not None:
+            deadlines.append(created_at + ttl)
+    return min(deadlines) if deadlines else None
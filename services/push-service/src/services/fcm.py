@@ -0,0 +1,119 @@
+from typing import Optional, Sequence
+import math
+import time
+
+import httpx
+
+PERMANENT_ERROR_CODES = {"UNREGISTERED", "INVALID_ARGUMENT", "SENDER_ID_MISMATCH"}
+# INVALID_ARGUMENT blames the token only when a field violation points at it
+TOKEN_ERROR_CODES = {"UNREGISTERED", "SENDER_ID_MISMATCH"}
+TOKEN_FIELD = "message.token"
+
+
+class FCMError(Exception):
+    """An error response from the FCM v1 API"""
+
+    def __init__(
+        self,
+        status_code: int,
+        error_code: Optional[str] = None,
+        message: str = "",
+        retry_after: Optional[float] = None,
+        fields: Sequence[str] = (),
+    ):
+        super().__init__(f"FCM error {status_code} {error_code or ''}: {message}".strip())
+        self.status_code = status_code
+        self.error_code = error_code
+        self.retry_after = retry_after
+        self.fields = tuple(fields)
+
+    @property
+    def is_permanent(self) -> bool:
+        """Whether sending this message again can never succeed"""
+        return self.error_code in PERMANENT_ERROR_CODES
+
+    @property
+    def is_invalid_token(self) -> bool:
+        """Whether the token itself is at fault, rather than the payload"""
+        if self.error_code in TOKEN_ERROR_CODES:
+            return True
+        return self.error_code == "INVALID_ARGUMENT" and TOKEN_FIELD in self.fields
+
+    @classmethod
+    def from_response(cls, response: httpx.Response) -> "FCMError":
+        error_code = None
+        message = response.text
+        fields = []
+        try:
+            error = response.json().get("error", {})
+            message = error.get("message", message)
+            error_code = error.get("status")
+            for detail in error.get("details", []):
+                if detail.get("errorCode"):
+                    error_code = detail["errorCode"]
+                for violation in detail.get("fieldViolations", []):
+                    fields.append(violation.get("field"))
+        except (ValueError, AttributeError):
+            pass
+
+        retry_after = None
+        try:
+            retry_after = float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            pass
+
+        return cls(response.status_code, error_code, message, retry_after, fields)
+
+
+def create_http_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 30.0,
+    timeout: float = 10.0,
+    http2: bool = True,
+) -> httpx.AsyncClient:
+    """Create the long-lived HTTP client used for all FCM sends.
+
+    HTTP/2 lets concurrent sends share a single TLS connection to
+    fcm.googleapis.com instead of paying a handshake per message.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+
+def build_fcm_message(
+    push_token: str,
+    title: str,
+    body: str,
+    image: Optional[str] = None,
+    link: Optional[str] = None,
+    ttl: Optional[float] = None,
+) -> dict:
+    """Build an FCM v1 message payload.
+
+    `ttl` is how many seconds FCM and APNs may hold the message for an
+    offline device before dropping it; without it their defaults apply.
+    """
+    message = {
+        "message": {
+            "token": push_token,
+            "notification": {"title": title, "body": body},
+            "data": {"link": link or ""},
+        }
+    }
+
+    if image:
+        message["message"]["notification"]["image"] = image
+
+    if ttl is not None:
+        seconds = max(math.ceil(ttl), 0)
+        message["message"]["android"] = {"ttl": f"{seconds}s"}
+        message["message"]["apns"] = {
+            "headers": {"apns-expiration": str(int(time.time()) + seconds)}
+        }
+
+    return message
@@ -0,0 +1,153 @@
+from typing import Callable, List, Optional
+import asyncio
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+
+class FlowController:
+    """Size handler concurrency and prefetch from observed FCM latency.
+
+    By Little's law, sustaining a send rate takes that rate times the FCM
+    latency in concurrent sends. Every `interval` seconds the concurrency
+    target is `headroom` times the rate limiter's local rate times the
+    smoothed latency; while the smoothed error rate is above
+    `error_threshold` it is instead cut below the current value. Prefetch
+    is the concurrency plus a `prefetch_buffer` share, so when FCM slows
+    down the extra deliveries stay in the broker for other consumers rather
+    than piling up unacked here. Prefetch only changes when it moves by
+    more than `prefetch_tolerance`, since applying it means resubscribing.
+    """
+
+    def __init__(
+        self,
+        rate: Callable[[], float],
+        concurrency: int = 10,
+        prefetch: int = 10,
+        min_concurrency: int = 1,
+        max_concurrency: int = 100,
+        min_prefetch: int = 1,
+        max_prefetch: int = 200,
+        headroom: float = 1.2,
+        prefetch_buffer: float = 0.5,
+        prefetch_tolerance: float = 0.25,
+        error_threshold: float = 0.05,
+        smoothing: float = 0.3,
+        interval: float = 5.0,
+    ):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_prefetch = min_prefetch
+        self.max_prefetch = max_prefetch
+        self.headroom = headroom
+        self.prefetch_buffer = prefetch_buffer
+        self.prefetch_tolerance = prefetch_tolerance
+        self.error_threshold = error_threshold
+        self.smoothing = smoothing
+        self.interval = interval
+        self.listeners: List[Callable[[int, int], None]] = []
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.target_rate = 0.0
+        self.adjustments = 0
+        self.prefetch_changes = 0
+        self._calls = 0
+        self._errors = 0
+        self._latency_sum = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(self, seconds: float, failed: bool = False):
+        """Record one FCM send"""
+        self._calls += 1
+        self._latency_sum += seconds
+        if failed:
+            self._errors += 1
+
+    def _smooth(self, current: float, sample: float) -> float:
+        return current + self.smoothing * (sample - current)
+
+    def update(self) -> bool:
+        """Fold in the sends since the last update and pick new limits.
+
+        Returns True when the concurrency or prefetch changed.
+        """
+        if self._calls:
+            latency = self._latency_sum / self._calls
+            errors = self._errors / self._calls
+            self.latency = (
+                latency if self.latency is None else self._smooth(self.latency, latency)
+            )
+            self.error_rate = self._smooth(self.error_rate, errors)
+            self._calls = self._errors = 0
+            self._latency_sum = 0.0
+        if self.latency is None:
+            return False
+
+        self.target_rate = self.rate()
+        target = self.headroom * self.target_rate * self.latency
+        if self.error_rate > self.error_threshold:
+            target = min(target, self.concurrency * (1 - min(self.error_rate, 0.5)))
+        concurrency = min(max(math.ceil(target), self.min_concurrency), self.max_concurrency)
+        prefetch = min(
+            max(math.ceil(concurrency * (1 + self.prefetch_buffer)), self.min_prefetch),
+            self.max_prefetch,
+        )
+
+        changed = concurrency != self.concurrency
+        self.concurrency = concurrency
+        if abs(prefetch - self.prefetch) > self.prefetch_tolerance * self.prefetch:
+            self.prefetch = prefetch
+            self.prefetch_changes += 1
+            changed = True
+        if not changed:
+            return False
+
+        self.adjustments += 1
+        logger.info(
+            f"Push flow control: concurrency {self.concurrency}, prefetch {self.prefetch} "
+            f"(latency {self.latency * 1000:.0f}ms, error rate {self.error_rate:.1%}, "
+            f"rate {self.target_rate:.0f}/s)"
+        )
+        for listener in self.listeners:
+            listener(self.concurrency, self.prefetch)
+        return True
+
+    async def _update_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f"Push flow control update failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._update_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "prefetch": self.prefetch,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "target_rate": round(self.target_rate, 2),
+            "adjustments": self.adjustments,
+            "prefetch_changes": self.prefetch_changes,
+            "bounds": {
+                "concurrency": [self.min_concurrency, self.max_concurrency],
+                "prefetch": [self.min_prefetch, self.max_prefetch],
+            },
+        }
@@ -0,0 +1,142 @@
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple
+import asyncio
+import logging
+
+from redis import asyncio as aioredis
+
+from src.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+INFLIGHT = "inflight"
+DONE = "done"
+
+
+class ClaimStatus(str, Enum):
+    CLAIMED = "claimed"
+    IN_FLIGHT = "in_flight"
+    DONE = "done"
+
+
+class IdempotencyStore:
+    """Atomic per-request claims in Redis, fronted by a local LRU.
+
+    A claim is a `SET NX` of an in-flight marker with a short TTL, promoted
+    to a long-lived "done" marker on success and deleted on failure. Claims
+    made in the same event loop tick are sent to Redis in one pipeline.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        key_prefix: str = "push:processed:",
+        inflight_ttl: int = 300,
+        done_ttl: int = 3600,
+        local_size: int = 10000,
+    ):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.inflight_ttl = inflight_ttl
+        self.done_ttl = done_ttl
+        self.recent = LRUCache(maxsize=local_size, ttl=done_ttl)
+        self._batch: List[Tuple[str, asyncio.Future]] = []
+        self.local_hits = 0
+
+    def _key(self, request_id: str) -> str:
+        return f"{self.key_prefix}{request_id}"
+
+    async def claim(self, request_id: str) -> ClaimStatus:
+        """Claim a request, batching with other claims made this tick"""
+        if request_id in self.recent:
+            self.local_hits += 1
+            return ClaimStatus.DONE
+
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((request_id, future))
+        if len(self._batch) == 1:
+            asyncio.get_running_loop().call_soon(
+                lambda: asyncio.ensure_future(self._flush_claims())
+            )
+        return await future
+
+    async def _flush_claims(self):
+        batch, self._batch = self._batch, []
+        try:
+            results = await self.claim_many(request_id for request_id, _ in batch)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Copies of one request claimed in the same tick share a single
+        # Redis claim: the first waiter gets it, the others see it in flight
+        claimed = set()
+        for request_id, future in batch:
+            if future.done():
+                continue
+            result = results[request_id]
+            if result == ClaimStatus.CLAIMED:
+                if request_id in claimed:
+                    result = ClaimStatus.IN_FLIGHT
+                claimed.add(request_id)
+            future.set_result(result)
+
+    async def claim_many(self, request_ids: Iterable[str]) -> Dict[str, ClaimStatus]:
+        """Claim several requests with a single pipelined round trip"""
+        results: Dict[str, ClaimStatus] = {}
+        pending: List[str] = []
+        for request_id in request_ids:
+            if request_id in self.recent:
+                self.local_hits += 1
+                results[request_id] = ClaimStatus.DONE
+            elif request_id not in results:
+                pending.append(request_id)
+                results[request_id] = ClaimStatus.IN_FLIGHT
+
+        if not pending:
+            return results
+
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for request_id in pending:
+                key = self._key(request_id)
+                pipe.set(key, INFLIGHT, nx=True, ex=self.inflight_ttl)
+                pipe.get(key)
+            replies = await pipe.execute()
+
+        for index, request_id in enumerate(pending):
+            claimed, value = replies[2 * index], replies[2 * index + 1]
+            if claimed:
+                results[request_id] = ClaimStatus.CLAIMED
+            elif value == INFLIGHT:
+                results[request_id] = ClaimStatus.IN_FLIGHT
+            else:
+                results[request_id] = ClaimStatus.DONE
+                self.recent.set(request_id)
+
+        return results
+
+    async def complete(self, request_id: str):
+        """Promote a claim to "done" so later duplicates are skipped"""
+        self.recent.set(request_id)
+        try:
+            await self.redis_client.set(self._key(request_id), DONE, ex=self.done_ttl)
+        except Exception as e:
+            logger.error(f"Failed to mark {request_id} as processed: {e}")
+
+    async def release(self, request_id: str):
+        """Drop an in-flight claim so the request can be processed again"""
+        try:
+            await self.redis_client.delete(self._key(request_id))
+        except Exception as e:
+            logger.error(f"Failed to release claim for {request_id}: {e}")
+
+    async def is_processed(self, request_id: str) -> bool:
+        if request_id in self.recent:
+            return True
+        value = await self.redis_client.get(self._key(request_id))
+        return value is not None and value != INFLIGHT
+
+    def metrics(self) -> dict:
+        return {"local_entries": len(self.recent), "local_hits": self.local_hits}
@@ -0,0 +1,76 @@
+from typing import Optional
+import logging
+
+from redis import asyncio as aioredis
+
+from src.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidTokenCache:
+    """Remember push tokens FCM has permanently rejected.
+
+    Tokens are stored in Redis with a TTL so every replica sees them, and
+    recent hits are kept in a local LRU so repeat sends to a dead device
+    never leave the process. Tokens Redis reports as valid are also
+    remembered locally for `valid_ttl` seconds, so sends to a live device
+    skip the lookup too. A token invalidated by another replica within that
+    time is sent once more and fails at FCM again, which is harmless.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        key_prefix: str = "push:invalid_token:",
+        ttl: int = 30 * 24 * 3600,
+        local_size: int = 50000,
+        valid_ttl: float = 60.0,
+    ):
+        self.redis_client = redis_client
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.local = LRUCache(maxsize=local_size, ttl=ttl)
+        self.valid = LRUCache(maxsize=local_size, ttl=valid_ttl) if valid_ttl > 0 else None
+        self.short_circuited = 0
+        self.valid_hits = 0
+
+    def _key(self, push_token: str) -> str:
+        return f"{self.key_prefix}{push_token}"
+
+    async def is_invalid(self, push_token: Optional[str]) -> bool:
+        if not push_token:
+            return False
+        if push_token in self.local:
+            self.short_circuited += 1
+            return True
+        if self.valid is not None and push_token in self.valid:
+            self.valid_hits += 1
+            return False
+
+        reason = await self.redis_client.get(self._key(push_token))
+        if reason is None:
+            if self.valid is not None:
+                self.valid.set(push_token)
+            return False
+
+        self.local.set(push_token, reason)
+        self.short_circuited += 1
+        return True
+
+    async def mark_invalid(self, push_token: str, reason: str):
+        self.local.set(push_token, reason)
+        if self.valid is not None:
+            self.valid.pop(push_token)
+        try:
+            await self.redis_client.set(self._key(push_token), reason, ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Failed to record invalid push token: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "local_entries": len(self.local),
+            "short_circuited": self.short_circuited,
+            "valid_entries": len(self.valid) if self.valid is not None else 0,
+            "valid_hits": self.valid_hits,
+        }
@@ -0,0 +1,122 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+import asyncio
+import time
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+
+def priority_lane(priority: Any, high_min: int = 2, low_max: int = 0) -> str:
+    """Map a PushNotification.priority value to a consumption lane"""
+    try:
+        value = int(priority)
+    except (TypeError, ValueError):
+        return NORMAL
+    if value >= high_min:
+        return HIGH
+    if value <= low_max:
+        return LOW
+    return NORMAL
+
+
+def parse_weights(spec: str) -> Dict[str, int]:
+    """Parse "high:6,normal:3,low:1" into a weight per lane"""
+    weights = {}
+    for part in spec.split(","):
+        lane, _, weight = part.partition(":")
+        if lane.strip():
+            weights[lane.strip()] = max(int(weight or 1), 1)
+    return weights
+
+
+class WeightedLaneScheduler:
+    """Pick buffered deliveries across priority lanes by weight.
+
+    Lanes are served with smooth weighted round robin, so under a backlog
+    a lane with weight 6 gets six turns for every turn of a lane with
+    weight 1. A delivery that has waited longer than `max_wait` seconds is
+    served first regardless of weight, so no lane is starved.
+    """
+
+    def __init__(self, weights: Dict[str, int], max_wait: float = 5.0):
+        self.weights = dict(weights)
+        self.max_wait = max_wait
+        self._buffers: Dict[str, Deque[Tuple[float, Any]]] = {
+            lane: deque() for lane in self.weights
+        }
+        self._current: Dict[str, int] = {lane: 0 for lane in self.weights}
+        self._open = set(self.weights)
+        self._interrupted = False
+        self._available = asyncio.Event()
+        self.dispatched: Dict[str, int] = {lane: 0 for lane in self.weights}
+        self.promoted = 0
+
+    def put(self, lane: str, item: Any):
+        self._buffers[lane].append((time.monotonic(), item))
+        self._available.set()
+
+    def close_lane(self, lane: str):
+        """Mark a lane as finished; get() returns None once all are drained"""
+        self._open.discard(lane)
+        self._available.set()
+
+    def interrupt(self):
+        """Make get() return None without dispatching what is buffered"""
+        self._interrupted = True
+        self._available.set()
+
+    @property
+    def interrupted(self) -> bool:
+        return self._interrupted
+
+    def drain(self) -> List[Any]:
+        """Remove and return every buffered delivery"""
+        items = [item for buffer in self._buffers.values() for _, item in buffer]
+        for buffer in self._buffers.values():
+            buffer.clear()
+        return items
+
+    def depth(self, lane: str) -> int:
+        return len(self._buffers[lane])
+
+    def oldest_wait(self, lane: str) -> float:
+        buffer = self._buffers[lane]
+        return time.monotonic() - buffer[0][0] if buffer else 0.0
+
+    def _pick(self) -> Optional[str]:
+        if self._interrupted:
+            return None
+        ready = [lane for lane, buffer in self._buffers.items() if buffer]
+        if not ready:
+            return None
+
+        now = time.monotonic()
+        starved = [
+            lane for lane in ready if now - self._buffers[lane][0][0] >= self.max_wait
+        ]
+        if starved:
+            self.promoted += 1
+            return min(starved, key=lambda lane: self._buffers[lane][0][0])
+
+        total = 0
+        for lane in ready:
+            self._current[lane] += self.weights[lane]
+            total += self.weights[lane]
+        chosen = max(ready, key=lambda lane: self._current[lane])
+        self._current[chosen] -= total
+        return chosen
+
+    async def get(self) -> Optional[Tuple[str, Any]]:
+        """Wait for the next delivery to dispatch, or None when all lanes closed"""
+        while True:
+            lane = self._pick()
+            if lane is not None:
+                _, item = self._buffers[lane].popleft()
+                self.dispatched[lane] += 1
+                return lane, item
+            if not self._open or self._interrupted:
+                return None
+            self._available.clear()
+            await self._available.wait()
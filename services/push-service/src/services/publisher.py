@@ -0,0 +1,49 @@
+from typing import Optional
+import aio_pika
+
+from src.utils import json_dumps
+
+
+class Publisher:
+    """Publish JSON messages on a dedicated channel with publisher confirms.
+
+    The exchange is declared once when the publisher starts and reused for
+    every publish. Keeping publishes off the consuming channel lets several
+    handlers have confirms outstanding at the same time.
+    """
+
+    def __init__(
+        self,
+        connection: aio_pika.abc.AbstractConnection,
+        exchange_name: str = "notifications.direct",
+    ):
+        self.connection = connection
+        self.exchange_name = exchange_name
+        self.channel: Optional[aio_pika.abc.AbstractChannel] = None
+        self.exchange: Optional[aio_pika.abc.AbstractExchange] = None
+        self.published = 0
+
+    async def start(self):
+        self.channel = await self.connection.channel(publisher_confirms=True)
+        self.exchange = await self.channel.declare_exchange(
+            self.exchange_name, aio_pika.ExchangeType.DIRECT, durable=True
+        )
+
+    async def publish(
+        self, body: dict, routing_key: str, headers: Optional[dict] = None
+    ):
+        """Publish a persistent message and wait for the broker to confirm it"""
+        await self.exchange.publish(
+            aio_pika.Message(
+                body=json_dumps(body),
+                headers=headers,
+                content_type="application/json",
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+            ),
+            routing_key=routing_key,
+        )
+        self.published += 1
+
+    async def close(self):
+        if self.channel and not self.channel.is_closed:
+            await self.channel.close()
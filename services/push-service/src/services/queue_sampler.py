@@ -0,0 +1,136 @@
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+import aio_pika
+
+logger = logging.getLogger(__name__)
+
+Sample = Tuple[float, int, Optional[int]]
+
+
+class QueueDepthSampler:
+    """Poll queue depths in the background and keep recent samples in memory.
+
+    Each tracked name covers one or more broker queues whose message counts
+    are summed. Samples go into a ring buffer of `history` entries so
+    readers never touch the broker. When a `consumed` counter is given for a
+    name, egress is measured from it and ingress is derived as the change in
+    depth plus what was consumed; otherwise only the net rate is known.
+    """
+
+    def __init__(
+        self,
+        interval: float = 5.0,
+        history: int = 120,
+        rate_window: float = 60.0,
+    ):
+        self.interval = interval
+        self.rate_window = rate_window
+        self._queues: Dict[str, List[aio_pika.abc.AbstractQueue]] = {}
+        self._consumed: Dict[str, Callable[[], int]] = {}
+        self._samples: Dict[str, Deque[Sample]] = {}
+        self._history = history
+        self._task: Optional[asyncio.Task] = None
+        self.errors = 0
+
+    def track(
+        self,
+        name: str,
+        queues: List[aio_pika.abc.AbstractQueue],
+        consumed: Optional[Callable[[], int]] = None,
+    ):
+        self._queues[name] = list(queues)
+        self._samples[name] = deque(maxlen=self._history)
+        if consumed is not None:
+            self._consumed[name] = consumed
+
+    async def _depth(self, queues: List[aio_pika.abc.AbstractQueue]) -> int:
+        results = await asyncio.gather(*(queue.declare() for queue in queues))
+        return sum(declare_ok.message_count for declare_ok in results)
+
+    async def sample(self):
+        """Take one sample of every tracked queue"""
+        names = list(self._queues)
+        results = await asyncio.gather(
+            *(self._depth(self._queues[name]) for name in names),
+            return_exceptions=True,
+        )
+        now = time.monotonic()
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                self.errors += 1
+                logger.warning(f"Failed to sample queue depth for {name}: {result}")
+                continue
+            consumed = self._consumed.get(name)
+            self._samples[name].append(
+                (now, result, consumed() if consumed else None)
+            )
+
+    async def _sample_periodically(self):
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.error(f"Failed to sample queue depths: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sample_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def depth(self, name: str) -> Optional[int]:
+        """Most recent sampled depth, or None before the first sample"""
+        samples = self._samples.get(name)
+        return samples[-1][1] if samples else None
+
+    def stats(self, name: str) -> dict:
+        """Depth, age of the sample, rates and estimated drain time for a name"""
+        samples = self._samples.get(name)
+        if not samples:
+            return {"depth": None}
+
+        newest = samples[-1]
+        oldest = newest
+        for sample in samples:
+            if sample[0] >= newest[0] - self.rate_window:
+                oldest = sample
+                break
+
+        stats = {
+            "depth": newest[1],
+            "sample_age_seconds": time.monotonic() - newest[0],
+            "net_rate": None,
+            "ingress_rate": None,
+            "egress_rate": None,
+            "drain_seconds": None,
+        }
+        elapsed = newest[0] - oldest[0]
+        if elapsed <= 0:
+            return stats
+
+        net_rate = (newest[1] - oldest[1]) / elapsed
+        stats["net_rate"] = net_rate
+        if newest[2] is not None and oldest[2] is not None:
+            egress_rate = (newest[2] - oldest[2]) / elapsed
+            stats["egress_rate"] = egress_rate
+            stats["ingress_rate"] = max(net_rate + egress_rate, 0.0)
+        if net_rate < 0:
+            stats["drain_seconds"] = newest[1] / -net_rate
+        elif newest[1] == 0:
+            stats["drain_seconds"] = 0.0
+        return stats
+
+    def metrics(self) -> dict:
+        return {name: self.stats(name) for name in self._samples}
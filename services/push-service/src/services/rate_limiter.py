@@ -0,0 +1,195 @@
+from typing import Optional
+import asyncio
+import logging
+import time
+import uuid
+
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+# Multiplicative decrease applied at most once per cooldown, shared by all replicas
+DECREASE_SCRIPT = """
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate') or ARGV[1])
+local last = tonumber(redis.call('HGET', KEYS[1], 'decreased_at') or '0')
+local now = tonumber(ARGV[4])
+if now - last >= tonumber(ARGV[5]) then
+    rate = math.max(tonumber(ARGV[3]), rate * tonumber(ARGV[2]))
+    redis.call('HSET', KEYS[1], 'rate', rate, 'decreased_at', now)
+end
+local pause = tonumber(redis.call('HGET', KEYS[1], 'pause_until') or '0')
+if tonumber(ARGV[6]) > pause then
+    redis.call('HSET', KEYS[1], 'pause_until', ARGV[6])
+end
+return tostring(rate)
+"""
+
+
+class AdaptiveRateLimiter:
+    """Token bucket in front of FCM whose rate adapts with AIMD.
+
+    Every success adds a little to the rate (about `increase` per second at
+    full speed); a 429/503 halves it, at most once per `cooldown`, and
+    pauses sends for the server's Retry-After. With Redis the rate and the
+    pause are shared, and each replica takes an equal share of the rate.
+    """
+
+    def __init__(
+        self,
+        redis_client: Optional[aioredis.Redis] = None,
+        initial_rate: float = 500.0,
+        min_rate: float = 10.0,
+        max_rate: float = 5000.0,
+        increase: float = 5.0,
+        decrease_factor: float = 0.5,
+        cooldown: float = 1.0,
+        key: str = "push:fcm:ratelimit",
+        sync_interval: float = 1.0,
+        replica_ttl: float = 15.0,
+    ):
+        self.redis_client = redis_client
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.key = key
+        self.replicas_key = f"{key}:replicas"
+        self.sync_interval = sync_interval
+        self.replica_ttl = replica_ttl
+        self.replica_id = uuid.uuid4().hex
+        self.replicas = 1
+        self.tokens = 1.0
+        self.pause_until = 0.0
+        self._refilled_at = time.monotonic()
+        self._decreased_at = 0.0
+        self._pending_increase = 0.0
+        self._pending_decrease: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._sync_task: Optional[asyncio.Task] = None
+        self.throttled = 0
+        self.waited = 0
+
+    @property
+    def local_rate(self) -> float:
+        return self.rate / max(self.replicas, 1)
+
+    def _refill(self, now: float):
+        capacity = max(1.0, self.local_rate / 10)
+        elapsed = now - self._refilled_at
+        self.tokens = min(capacity, self.tokens + elapsed * self.local_rate)
+        self._refilled_at = now
+
+    async def acquire(self):
+        """Wait until a send is allowed"""
+        async with self._lock:
+            waited = False
+            while True:
+                now = time.monotonic()
+                if now < self.pause_until:
+                    waited = True
+                    await asyncio.sleep(self.pause_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    if waited:
+                        self.waited += 1
+                    return
+                waited = True
+                await asyncio.sleep((1 - self.tokens) / self.local_rate)
+
+    def on_success(self):
+        step = self.increase / max(self.rate, 1.0)
+        self.rate = min(self.max_rate, self.rate + step)
+        self._pending_increase += step
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Back off after FCM signalled overload"""
+        self.throttled += 1
+        now = time.monotonic()
+        if retry_after:
+            self.pause_until = max(self.pause_until, now + retry_after)
+        if now - self._decreased_at >= self.cooldown:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._decreased_at = now
+        self._pending_increase = 0.0
+        self._pending_decrease = max(self._pending_decrease or 0.0, retry_after or 0.0)
+
+    async def sync(self):
+        """Exchange rate, pause and replica count with the other replicas"""
+        now = time.time()
+        monotonic_now = time.monotonic()
+
+        if self._pending_decrease is not None:
+            retry_after, self._pending_decrease = self._pending_decrease, None
+            await self.redis_client.eval(
+                DECREASE_SCRIPT,
+                1,
+                self.key,
+                self.rate,
+                self.decrease_factor,
+                self.min_rate,
+                now,
+                self.cooldown,
+                now + retry_after,
+            )
+
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.replicas_key, {self.replica_id: now})
+            pipe.zremrangebyscore(self.replicas_key, "-inf", now - self.replica_ttl)
+            pipe.zcard(self.replicas_key)
+            pipe.hsetnx(self.key, "rate", self.rate)
+            if self._pending_increase:
+                pipe.hincrbyfloat(self.key, "rate", self._pending_increase)
+            pipe.hgetall(self.key)
+            replies = await pipe.execute()
+        self._pending_increase = 0.0
+
+        self.replicas = max(int(replies[2]), 1)
+        shared = replies[-1] or {}
+        shared_rate = float(shared.get("rate", self.rate))
+        if shared_rate > self.max_rate:
+            await self.redis_client.hset(self.key, "rate", self.max_rate)
+        self.rate = min(max(shared_rate, self.min_rate), self.max_rate)
+
+        pause_until = float(shared.get("pause_until", 0))
+        if pause_until > now:
+            self.pause_until = max(self.pause_until, monotonic_now + pause_until - now)
+
+    async def _sync_periodically(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"Failed to sync FCM rate limit: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+    def start(self):
+        if self.redis_client is not None and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_periodically())
+
+    async def stop(self):
+        if self._sync_task:
+            self._sync_task.cancel()
+            try:
+                await self._sync_task
+            except asyncio.CancelledError:
+                pass
+            self._sync_task = None
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.zrem(self.replicas_key, self.replica_id)
+            except Exception as e:
+                logger.error(f"Failed to deregister from FCM rate limit: {e}")
+
+    def metrics(self) -> dict:
+        return {
+            "rate": round(self.rate, 2),
+            "local_rate": round(self.local_rate, 2),
+            "replicas": self.replicas,
+            "paused_for_seconds": max(self.pause_until - time.monotonic(), 0.0),
+            "throttled": self.throttled,
+            "waited": self.waited,
+        }
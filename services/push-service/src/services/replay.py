@@ -0,0 +1,286 @@
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+import asyncio
+import logging
+import time
+import uuid
+
+import aio_pika
+from redis import asyncio as aioredis
+
+from src.utils import json_dumps, json_loads
+
+from .idempotency import IdempotencyStore
+from .publisher import Publisher
+
+logger = logging.getLogger(__name__)
+
+# Fields the failure path adds, dropped before a message is sent again
+FAILURE_FIELDS = ("error", "error_code", "failed_at", "retry_count")
+
+
+def parse_time(value) -> Optional[datetime]:
+    """An aware datetime from an ISO 8601 string or datetime; naive means UTC"""
+    if value is None or value == "":
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class ReplayFilter:
+    """Which dead-lettered messages a replay sends again.
+
+    The time range applies to `failed_at`, or `created_at` for messages
+    dead-lettered before `failed_at` was recorded. An error code matches
+    the message's `error_code`, or appears in its `error` text when there
+    is no code.
+    """
+
+    def __init__(
+        self,
+        since=None,
+        until=None,
+        error_codes: Optional[Iterable[str]] = None,
+        notification_types: Optional[Iterable[str]] = None,
+    ):
+        self.since = parse_time(since)
+        self.until = parse_time(until)
+        self.error_codes = set(error_codes or ())
+        self.notification_types = set(notification_types or ())
+
+    def matches(self, message_body: dict) -> bool:
+        if (
+            self.notification_types
+            and message_body.get("notification_type") not in self.notification_types
+        ):
+            return False
+
+        if self.error_codes:
+            error_code = message_body.get("error_code")
+            if error_code is not None:
+                if error_code not in self.error_codes:
+                    return False
+            elif not any(code in str(message_body.get("error")) for code in self.error_codes):
+                return False
+
+        if self.since or self.until:
+            try:
+                failed_at = parse_time(
+                    message_body.get("failed_at") or message_body.get("created_at")
+                )
+            except ValueError:
+                return False
+            if failed_at is None:
+                return False
+            if self.since and failed_at < self.since:
+                return False
+            if self.until and failed_at >= self.until:
+                return False
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "since": self.since.isoformat() if self.since else None,
+            "until": self.until.isoformat() if self.until else None,
+            "error_codes": sorted(self.error_codes),
+            "notification_types": sorted(self.notification_types),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReplayFilter":
+        return cls(**data)
+
+
+class FailedQueueReplayer:
+    """Send dead-lettered push messages from failed.queue back to their lanes.
+
+    Messages are pulled one at a time and published at no more than `rate`
+    per second. A message is acked only after its replay is confirmed, so
+    failed.queue itself is the cursor: a stopped run loses nothing and a
+    run resumed under the same id continues where it left off with its
+    counters intact. Each run examines at most the messages queued when it
+    starts. Messages that do not match the filter are moved to the back of
+    the queue. Messages whose request id is already processed, or that
+    were already replayed in this run, are dropped. Progress is stored in
+    Redis so any replica can report it.
+    """
+
+    COUNTERS = ("scanned", "replayed", "skipped", "duplicates")
+
+    def __init__(
+        self,
+        queue: aio_pika.abc.AbstractQueue,
+        publisher: Publisher,
+        idempotency: IdempotencyStore,
+        redis_client: aioredis.Redis,
+        lanes: Dict[str, str],
+        lane_of: Callable[[dict], str],
+        rate: float = 50.0,
+        key_prefix: str = "push:replay",
+        progress_interval: int = 1000,
+        progress_ttl: int = 7 * 24 * 3600,
+    ):
+        self.queue = queue
+        self.publisher = publisher
+        self.idempotency = idempotency
+        self.redis_client = redis_client
+        self.lanes = lanes
+        self.lane_of = lane_of
+        self.rate = rate
+        self.key_prefix = key_prefix
+        self.progress_interval = progress_interval
+        self.progress_ttl = progress_ttl
+        self.run_id: Optional[str] = None
+        self.progress: dict = {}
+        self._stopping = False
+        self._next_send_at = 0.0
+
+    def _key(self, run_id: str) -> str:
+        return f"{self.key_prefix}:{run_id}"
+
+    async def load(self, run_id: str) -> Optional[dict]:
+        """Stored progress of a run, or None if it is unknown or expired"""
+        raw = await self.redis_client.get(self._key(run_id))
+        return json_loads(raw) if raw else None
+
+    async def _save(self):
+        self.progress["updated_at"] = datetime.now(timezone.utc).isoformat()
+        await self.redis_client.set(
+            self._key(self.run_id), json_dumps(self.progress), ex=self.progress_ttl
+        )
+
+    async def _pace(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._next_send_at = max(self._next_send_at, now)
+        if self._next_send_at > now:
+            await asyncio.sleep(self._next_send_at - now)
+        self._next_send_at += 1 / self.rate
+
+    def stop(self):
+        """Stop after the current message; the run can be resumed later"""
+        self._stopping = True
+
+    async def run(
+        self,
+        replay_filter: Optional[ReplayFilter] = None,
+        limit: Optional[int] = None,
+        run_id: Optional[str] = None,
+    ) -> dict:
+        """Replay matching messages and return the run's final progress.
+
+        A `run_id` with stored progress resumes that run: its filter and
+        counters are loaded and `replay_filter` is ignored. `limit` caps how
+        many messages this call replays.
+        """
+        self.run_id = run_id or uuid.uuid4().hex
+        previous = await self.load(self.run_id) if run_id else None
+        if previous is not None:
+            self.progress = previous
+            replay_filter = ReplayFilter.from_dict(previous["filter"])
+            logger.info(f"Resuming replay {self.run_id}")
+        else:
+            replay_filter = replay_filter or ReplayFilter()
+            self.progress = {
+                "run_id": self.run_id,
+                "filter": replay_filter.to_dict(),
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                **{counter: 0 for counter in self.COUNTERS},
+            }
+
+        declare_ok = await self.queue.declare()
+        remaining = declare_ok.message_count
+        self.progress.update(
+            {"status": "running", "rate": self.rate, "queued_at_start": remaining}
+        )
+        await self._save()
+        logger.info(f"Replay {self.run_id} running, {remaining} messages in {self.queue.name}")
+
+        self._stopping = False
+        seen = set()
+        replayed = 0
+        started = time.monotonic()
+        exhausted = remaining <= 0
+        try:
+            while not exhausted and not self._stopping:
+                if limit is not None and replayed >= limit:
+                    break
+                message = await self.queue.get(no_ack=False, fail=False)
+                if message is None:
+                    exhausted = True
+                    break
+                remaining -= 1
+                exhausted = remaining <= 0
+                self.progress["scanned"] += 1
+                replayed += await self._replay_one(message, replay_filter, seen)
+
+                if self.progress["scanned"] % self.progress_interval == 0:
+                    await self._report(started)
+        except asyncio.CancelledError:
+            self.progress["status"] = "stopped"
+            await self._save()
+            raise
+        except Exception:
+            self.progress["status"] = "failed"
+            await self._save()
+            raise
+
+        self.progress["status"] = "done" if exhausted else "stopped"
+        await self._report(started)
+        return self.progress
+
+    async def _replay_one(
+        self,
+        message: aio_pika.abc.AbstractIncomingMessage,
+        replay_filter: ReplayFilter,
+        seen: set,
+    ) -> int:
+        try:
+            message_body = json_loads(message.body)
+        except ValueError:
+            message_body = None
+        if not isinstance(message_body, dict):
+            message_body = {"raw_body": message.body.decode(errors="replace")}
+
+        if "raw_body" in message_body or not replay_filter.matches(message_body):
+            # Keep it in failed.queue, behind the messages still to be examined
+            await self.publisher.publish(message_body, routing_key=self.queue.name)
+            await message.ack()
+            self.progress["skipped"] += 1
+            return 0
+
+        request_id = message_body.get("request_id")
+        if request_id and (
+            request_id in seen or await self.idempotency.is_processed(request_id)
+        ):
+            await message.ack()
+            self.progress["duplicates"] += 1
+            return 0
+        seen.add(request_id)
+
+        replay_body = {
+            field: value
+            for field, value in message_body.items()
+            if field not in FAILURE_FIELDS
+        }
+        replay_body["replay_count"] = message_body.get("replay_count", 0) + 1
+
+        await self._pace()
+        await self.publisher.publish(
+            replay_body, routing_key=self.lanes[self.lane_of(replay_body)]
+        )
+        await message.ack()
+        self.progress["replayed"] += 1
+        return 1
+
+    async def _report(self, started: float):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        self.progress["elapsed_seconds"] = round(elapsed, 1)
+        await self._save()
+        logger.info(
+            f"Replay {self.run_id} {self.progress['status']}: "
+            + ", ".join(f"{counter} {self.progress[counter]}" for counter in self.COUNTERS)
+        )
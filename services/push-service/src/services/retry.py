@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Sequence
+import aio_pika
+import logging
+
+from .publisher import Publisher
+
+logger = logging.getLogger(__name__)
+
+RETRY_COUNT_HEADER = "x-retry-count"
+
+
+def get_retry_count(message_body: dict, headers: Optional[dict] = None) -> int:
+    """Attempts already made for a message, from its header or body"""
+    value = (headers or {}).get(RETRY_COUNT_HEADER)
+    if value is None:
+        value = message_body.get("retry_count") or 0
+    return int(value)
+
+
+class RetryScheduler:
+    """Schedule retries through per-delay TTL queues.
+
+    Each delay gets a durable `push.retry.<n>s` queue with no consumers.
+    Messages expire there after the delay and are dead-lettered back into
+    the push queue, so the consumer never sleeps while holding a delivery.
+    Priority lanes other than "normal" get their own `push.retry.<n>s.<lane>`
+    queues so a retried message returns to the lane it came from.
+    """
+
+    def __init__(
+        self,
+        publisher: Publisher,
+        delays: Sequence[int] = (1, 2, 4),
+        target_routing_key: str = "push.queue",
+        lanes: Optional[Dict[str, str]] = None,
+    ):
+        self.publisher = publisher
+        self.delays = list(delays)
+        self.lanes = lanes or {"normal": target_routing_key}
+        self.queues: List[aio_pika.abc.AbstractQueue] = []
+
+    @staticmethod
+    def queue_name(delay: int, lane: str = "normal") -> str:
+        if lane == "normal":
+            return f"push.retry.{delay}s"
+        return f"push.retry.{delay}s.{lane}"
+
+    async def declare(self, channel: aio_pika.abc.AbstractChannel):
+        """Declare and bind one TTL queue per delay and lane"""
+        for lane, target_routing_key in self.lanes.items():
+            for delay in self.delays:
+                name = self.queue_name(delay, lane)
+                queue = await channel.declare_queue(
+                    name,
+                    durable=True,
+                    arguments={
+                        "x-message-ttl": delay * 1000,
+                        "x-dead-letter-exchange": self.publisher.exchange_name,
+                        "x-dead-letter-routing-key": target_routing_key,
+                    },
+                )
+                await queue.bind(self.publisher.exchange_name, routing_key=name)
+                self.queues.append(queue)
+
+    async def pending_count(self) -> int:
+        """Number of messages currently parked across all delay queues"""
+        total = 0
+        for queue in self.queues:
+            declare_ok = await queue.declare()
+            total += declare_ok.message_count
+        return total
+
+    def delay_for(self, attempt: int) -> int:
+        """Delay in seconds before the given (1-based) attempt"""
+        return self.delays[min(max(attempt, 1), len(self.delays)) - 1]
+
+    async def schedule(
+        self,
+        message_body: dict,
+        attempt: int,
+        headers: Optional[dict] = None,
+        lane: str = "normal",
+    ) -> int:
+        """Park a message until its next attempt is due and return the delay.
+
+        The attempt is written to both the message header and the body's
+        `retry_count`, so no consumer has to remember it.
+        """
+        delay = self.delay_for(attempt)
+        if lane not in self.lanes:
+            lane = "normal"
+        message_headers = dict(headers or {})
+        message_headers[RETRY_COUNT_HEADER] = attempt
+
+        await self.publisher.publish(
+            {**message_body, "retry_count": attempt},
+            routing_key=self.queue_name(delay, lane),
+            headers=message_headers,
+        )
+        return delay
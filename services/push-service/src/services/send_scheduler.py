@@ -0,0 +1,214 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import random
+import time
+
+from redis import asyncio as aioredis
+
+from src.utils import json_dumps, json_loads
+
+from .publisher import Publisher
+
+logger = logging.getLogger(__name__)
+
+# Claim up to ARGV[2] members due by ARGV[1] by moving them to ARGV[3]
+CLAIM_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due == 0 then
+    return {}
+end
+local result = {}
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+local messages = redis.call('HMGET', KEYS[2], unpack(due))
+for index, member in ipairs(due) do
+    result[#result + 1] = member
+    result[#result + 1] = messages[index] or ''
+end
+return result
+"""
+
+
+def timestamp_of(value, field: str = "timestamp") -> Optional[float]:
+    """A Unix timestamp from a number or an ISO 8601 string, or None.
+
+    A string without a timezone is taken as UTC. Unreadable values are
+    logged under `field` and ignored.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning(f"Ignoring unreadable {field}: {value!r}")
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def send_at_of(message_body: dict) -> Optional[float]:
+    """`metadata.send_at` as a Unix timestamp, or None if missing or unreadable"""
+    return timestamp_of((message_body.get("metadata") or {}).get("send_at"), "send_at")
+
+
+class SendScheduler:
+    """Hold pushes with a future `send_at` in a Redis sorted set until due.
+
+    Parked messages are scored by their send time plus up to `spread`
+    seconds of random jitter, so a campaign aimed at one instant goes out
+    over a window, and stored in a hash by request id, so a redelivered
+    message is parked once. Every `interval` seconds due messages are
+    claimed in batches of `batch_size`, at most `release_rate` per second,
+    and published back to their lane's queue. Claiming moves a message
+    `lease` seconds ahead and it is only removed once its publish is
+    confirmed, so a replica dying mid-release delays the message rather
+    than losing it.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        publisher: Publisher,
+        lanes: Dict[str, str],
+        key: str = "push:scheduled",
+        batch_size: int = 100,
+        release_rate: float = 200.0,
+        spread: float = 0.0,
+        lease: float = 60.0,
+        interval: float = 1.0,
+    ):
+        self.redis_client = redis_client
+        self.publisher = publisher
+        self.lanes = lanes
+        self.key = key
+        self.messages_key = f"{key}:messages"
+        self.batch_size = batch_size
+        self.release_rate = release_rate
+        self.spread = spread
+        self.lease = lease
+        self.interval = interval
+        self.parked = 0
+        self.released = 0
+        self.backlog: Optional[int] = None
+        self.due: Optional[int] = None
+        self.oldest_due_seconds: Optional[float] = None
+        self.next_due_seconds: Optional[float] = None
+        self._claim_due = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def park(self, message_body: dict, send_at: float, lane: str = "normal") -> float:
+        """Hold a message until `send_at` and return its release time"""
+        member = message_body.get("request_id") or message_body.get("notification_id")
+        release_at = send_at + random.uniform(0, self.spread) if self.spread else send_at
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.zadd(self.key, {member: release_at}, nx=True)
+            pipe.hsetnx(
+                self.messages_key, member, json_dumps({"lane": lane, "body": message_body})
+            )
+            added, _ = await pipe.execute()
+        self.parked += added
+        return release_at
+
+    async def release_due(self, limit: int) -> int:
+        """Publish up to `limit` due messages and return how many went out"""
+        if self._claim_due is None:
+            self._claim_due = self.redis_client.register_script(CLAIM_DUE_SCRIPT)
+        now = time.time()
+        reply = await self._claim_due(
+            keys=[self.key, self.messages_key], args=[now, limit, now + self.lease]
+        )
+        if not reply:
+            return 0
+
+        claimed = list(zip(reply[::2], reply[1::2]))
+        results = await asyncio.gather(
+            *(self._publish(raw) for _, raw in claimed), return_exceptions=True
+        )
+        done: List[str] = []
+        for (member, _), result in zip(claimed, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to release scheduled push {member}: {result}")
+            else:
+                done.append(member)
+        if done:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.zrem(self.key, *done)
+                pipe.hdel(self.messages_key, *done)
+                await pipe.execute()
+        self.released += len(done)
+        return len(done)
+
+    async def _publish(self, raw: str):
+        if not raw:
+            # The body is gone; removing the member is all that is left to do
+            return
+        entry = json_loads(raw)
+        lane = entry.get("lane")
+        routing_key = self.lanes.get(lane) or self.lanes["normal"]
+        await self.publisher.publish(entry["body"], routing_key=routing_key)
+
+    async def release(self) -> int:
+        """Release what is due, in batches, within one interval's share of the rate"""
+        budget = max(int(self.release_rate * self.interval), 1)
+        released = 0
+        while released < budget:
+            count = await self.release_due(min(self.batch_size, budget - released))
+            if not count:
+                break
+            released += count
+        return released
+
+    async def sample(self):
+        """Refresh the backlog figures reported in metrics"""
+        now = time.time()
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zcard(self.key)
+            pipe.zcount(self.key, "-inf", now)
+            pipe.zrange(self.key, 0, 0, withscores=True)
+            self.backlog, self.due, first = await pipe.execute()
+        if first:
+            first_score = first[0][1]
+            self.oldest_due_seconds = max(now - first_score, 0.0)
+            self.next_due_seconds = max(first_score - now, 0.0)
+        else:
+            self.oldest_due_seconds = self.next_due_seconds = None
+
+    async def _run(self, release: bool):
+        while True:
+            try:
+                if release:
+                    await self.release()
+                await self.sample()
+            except Exception as e:
+                logger.error(f"Scheduled push release failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self, release: bool = True):
+        """Sample the backlog and, with `release`, publish due messages"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(release))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> dict:
+        return {
+            "backlog": self.backlog,
+            "due": self.due,
+            "oldest_due_seconds": self.oldest_due_seconds,
+            "next_due_seconds": self.next_due_seconds,
+            "parked": self.parked,
+            "released": self.released,
+        }
@@ -0,0 +1,119 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from .publisher import Publisher
+
+logger = logging.getLogger(__name__)
+
+
+class StatusBatcher:
+    """Buffer status updates and publish them in batches.
+
+    Updates are flushed every `flush_interval` seconds or as soon as
+    `max_batch` are ready. A "pending" update is held back for up to
+    `pending_window` seconds; if a later status for the same notification
+    arrives in that window the "pending" update is dropped. Held updates do
+    not count toward `max_batch`, so a busy consumer does not publish them
+    early; only `stop()` flushes them before their window ends.
+    """
+
+    def __init__(
+        self,
+        publisher: Publisher,
+        routing_key: str = "status.queue",
+        flush_interval: float = 0.05,
+        pending_window: float = 1.0,
+        max_batch: int = 100,
+        suppress_pending: bool = True,
+    ):
+        self.publisher = publisher
+        self.routing_key = routing_key
+        self.flush_interval = flush_interval
+        self.pending_window = pending_window
+        self.max_batch = max_batch
+        self.suppress_pending = suppress_pending
+        self._ready: List[dict] = []
+        self._pending: Dict[str, Tuple[dict, float]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.published = 0
+        self.suppressed = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._ready) + len(self._pending)
+
+    async def add(self, status_message: dict):
+        """Buffer a status update, flushing immediately if the batch is full"""
+        notification_id = status_message.get("notification_id")
+
+        if self.suppress_pending and status_message.get("status") == "pending":
+            self._pending[notification_id] = (status_message, time.monotonic())
+        else:
+            if self._pending.pop(notification_id, None) is not None:
+                self.suppressed += 1
+            self._ready.append(status_message)
+
+        if len(self._ready) >= self.max_batch:
+            await self.flush()
+
+    async def flush(self, force: bool = False):
+        """Publish buffered updates and wait for the broker to confirm them"""
+        now = time.monotonic()
+        batch = []
+        for notification_id, (message, added_at) in list(self._pending.items()):
+            if force or now - added_at >= self.pending_window:
+                batch.append(message)
+                del self._pending[notification_id]
+        batch.extend(self._ready)
+        self._ready = []
+
+        if not batch:
+            return
+
+        results = await asyncio.gather(
+            *(
+                self.publisher.publish(message, routing_key=self.routing_key)
+                for message in batch
+            ),
+            return_exceptions=True,
+        )
+        failures = [result for result in results if isinstance(result, Exception)]
+        self.published += len(batch) - len(failures)
+        self.failed += len(failures)
+        if failures:
+            logger.error(
+                f"Failed to send {len(failures)} of {len(batch)} status updates: {failures[0]}"
+            )
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush status updates: {e}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Stop the flush loop and publish everything still buffered"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush(force=True)
+
+    def metrics(self) -> dict:
+        return {
+            "buffered": len(self),
+            "published": self.published,
+            "suppressed": self.suppressed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,105 @@
+from typing import Callable, Dict, Optional
+import asyncio
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSupervisor:
+    """Run `workers` copies of `target` in separate processes.
+
+    Each process is started with the "spawn" method and receives its worker
+    id, so it builds its own connections instead of inheriting the parent's
+    sockets. `watch` restarts processes that exit while the supervisor is
+    running. `stop` sends SIGTERM to every worker, waits up to
+    `shutdown_timeout` seconds for them to drain and exit, and then kills
+    the rest.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[str], None],
+        workers: int,
+        shutdown_timeout: float = 30.0,
+    ):
+        self.target = target
+        self.workers = workers
+        self.shutdown_timeout = shutdown_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._stopping = False
+        self._watch_task: Optional[asyncio.Task] = None
+        self.restarts = 0
+
+    def _spawn(self, worker_id: str):
+        process = self._context.Process(
+            target=self.target, args=(worker_id,), name=f"push-worker-{worker_id}"
+        )
+        process.start()
+        self._processes[worker_id] = process
+        logger.info(f"Started push worker {worker_id} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(str(index))
+
+    def alive(self) -> int:
+        return sum(process.is_alive() for process in self._processes.values())
+
+    def pids(self) -> Dict[str, Optional[int]]:
+        return {worker_id: process.pid for worker_id, process in self._processes.items()}
+
+    def restart_exited(self):
+        """Replace workers that have exited"""
+        for worker_id, process in list(self._processes.items()):
+            if self._stopping or process.is_alive():
+                continue
+            logger.error(
+                f"Push worker {worker_id} exited with code {process.exitcode}, restarting"
+            )
+            process.close()
+            self.restarts += 1
+            self._spawn(worker_id)
+
+    async def _watch(self, interval: float):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            self.restart_exited()
+
+    def watch(self, interval: float = 5.0):
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch(interval))
+
+    async def stop(self):
+        """Ask every worker to drain and exit, killing any that overrun the timeout"""
+        self._stopping = True
+        if self._watch_task:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.shutdown_timeout
+        for worker_id, process in self._processes.items():
+            await asyncio.to_thread(process.join, max(deadline - loop.time(), 0))
+            if process.is_alive():
+                logger.error(f"Push worker {worker_id} did not stop in time, killing it")
+                process.kill()
+                await asyncio.to_thread(process.join)
+        self._processes.clear()
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": self.alive(),
+            "restarts": self.restarts,
+            "pids": self.pids(),
+        }
@@ -0,0 +1,169 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import re
+
+import httpx
+
+from src.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+VARIABLE_PATTERN = re.compile(r"\{\{([^}]+)\}\}")
+
+TemplateKey = Tuple[str, str, Optional[int]]
+
+
+class TemplateNotFoundError(Exception):
+    """The template (or the requested version of it) does not exist"""
+
+    def __init__(self, template_code: str, language: str, version: Optional[int]):
+        self.template_code = template_code
+        self.language = language
+        self.version = version
+        suffix = f" version {version}" if version is not None else ""
+        super().__init__(f"Template {template_code} ({language}){suffix} not found")
+
+
+class CompiledTemplate:
+    """A template split once into literal text and variable names.
+
+    Rendering follows template-service: `{{name}}` is replaced by the
+    variable's value and unknown variables are left in place.
+    """
+
+    __slots__ = ("_parts",)
+
+    def __init__(self, text: Optional[str]):
+        # Even positions are literal text, odd positions variable names
+        self._parts: List[str] = VARIABLE_PATTERN.split(text or "")
+        for index in range(1, len(self._parts), 2):
+            self._parts[index] = self._parts[index].strip()
+
+    def render(self, variables: Dict[str, object]) -> str:
+        parts = self._parts
+        if len(parts) == 1:
+            return parts[0]
+        rendered = []
+        for index, part in enumerate(parts):
+            if index % 2 == 0:
+                rendered.append(part)
+            elif part in variables:
+                rendered.append(str(variables[part]))
+            else:
+                rendered.append(f"{{{{{part}}}}}")
+        return "".join(rendered)
+
+
+class PushTemplate:
+    __slots__ = ("title", "body", "version")
+
+    def __init__(self, title: Optional[str], body: Optional[str], version: Optional[int]):
+        self.title = CompiledTemplate(title)
+        self.body = CompiledTemplate(body)
+        self.version = version
+
+    def render(self, variables: Optional[Dict[str, object]]) -> Tuple[str, str]:
+        variables = variables or {}
+        return self.title.render(variables), self.body.render(variables)
+
+
+class TemplateClient:
+    """Fetch push templates from template-service and render them locally.
+
+    Compiled templates are kept in an LRU keyed by code, language and
+    version. Version None means the active version, which expires after
+    `ttl` seconds so template updates are picked up. Concurrent misses for
+    the same key share one request on a pooled HTTP client.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        http_client: Optional[httpx.AsyncClient] = None,
+        cache_size: int = 1024,
+        ttl: float = 300.0,
+        timeout: float = 5.0,
+        max_connections: int = 20,
+    ):
+        self.http_client = http_client or httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self._cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        self._inflight: Dict[TemplateKey, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+
+    async def get(
+        self, template_code: str, language: str = "en", version: Optional[int] = None
+    ) -> PushTemplate:
+        """Return the compiled template, fetching it on a cache miss"""
+        key: TemplateKey = (template_code, language, version)
+        template = self._cache.get(key)
+        if template is not None:
+            self.hits += 1
+            return template
+
+        self.misses += 1
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(self._fetch(key))
+            future.add_done_callback(lambda done: self._clear_inflight(key, done))
+        return await asyncio.shield(future)
+
+    def _clear_inflight(self, key: TemplateKey, future: asyncio.Future):
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            future.exception()
+
+    async def render(
+        self,
+        template_code: str,
+        variables: Optional[Dict[str, object]],
+        language: str = "en",
+        version: Optional[int] = None,
+    ) -> Tuple[str, str]:
+        """Render a push template's title and body"""
+        template = await self.get(template_code, language, version)
+        return template.render(variables)
+
+    async def _fetch(self, key: TemplateKey) -> PushTemplate:
+        template_code, language, version = key
+        path = f"/api/v1/templates/{template_code}"
+        if version is not None:
+            path += f"/versions/{version}"
+
+        self.fetches += 1
+        response = await self.http_client.get(path, params={"language": language})
+        if response.status_code == 404:
+            raise TemplateNotFoundError(template_code, language, version)
+        response.raise_for_status()
+
+        data = response.json().get("data") or {}
+        template = PushTemplate(
+            data.get("title") or data.get("subject"),
+            data.get("body"),
+            data.get("version", version),
+        )
+        self._cache.set(key, template)
+        if version is None and template.version is not None:
+            self._cache.set((template_code, language, template.version), template)
+        logger.info(f"Template {template_code} ({language}) loaded")
+        return template
+
+    async def close(self):
+        await self.http_client.aclose()
+
+    def metrics(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+        }
@@ -0,0 +1,120 @@
+from datetime import datetime, timezone
+from typing import Callable, Optional
+import asyncio
+import logging
+import time
+
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """Keep an FCM OAuth2 access token fresh without blocking the event loop.
+
+    Refreshes run in a worker thread. Only one refresh is in flight at a
+    time and every caller waiting on it shares its result. A background
+    task refreshes ahead of expiry so senders rarely wait at all.
+    """
+
+    def __init__(
+        self,
+        credentials_factory: Callable[[], Credentials],
+        refresh_margin: float = 300.0,
+        retry_interval: float = 10.0,
+    ):
+        self.credentials_factory = credentials_factory
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._credentials: Optional[Credentials] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._background_task: Optional[asyncio.Task] = None
+        self.refreshed_at: Optional[float] = None
+        self.last_refresh_latency: Optional[float] = None
+        self.refresh_count = 0
+        self.refresh_failures = 0
+
+    async def get_token(self) -> str:
+        """Return a valid access token, refreshing only if it has expired"""
+        if self._credentials is None or not self._credentials.valid:
+            await self.refresh()
+        return self._credentials.token
+
+    async def refresh(self):
+        """Refresh the token, joining a refresh that is already running"""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+            self._inflight.add_done_callback(self._clear_inflight)
+        await asyncio.shield(self._inflight)
+
+    def _clear_inflight(self, future: asyncio.Future):
+        self._inflight = None
+        if not future.cancelled():
+            future.exception()
+
+    async def _refresh(self):
+        started = time.perf_counter()
+        try:
+            if self._credentials is None:
+                self._credentials = await asyncio.to_thread(self.credentials_factory)
+            await asyncio.to_thread(self._credentials.refresh, Request())
+        except Exception:
+            self.refresh_failures += 1
+            raise
+        finally:
+            self.last_refresh_latency = time.perf_counter() - started
+
+        self.refreshed_at = time.time()
+        self.refresh_count += 1
+        logger.info(
+            f"FCM access token refreshed in {self.last_refresh_latency * 1000:.0f}ms"
+        )
+
+    def seconds_until_expiry(self) -> Optional[float]:
+        if self._credentials is None or self._credentials.expiry is None:
+            return None
+        expiry = self._credentials.expiry.replace(tzinfo=timezone.utc)
+        return (expiry - datetime.now(timezone.utc)).total_seconds()
+
+    async def _refresh_ahead(self):
+        while True:
+            remaining = self.seconds_until_expiry()
+            if remaining is not None:
+                await asyncio.sleep(max(remaining - self.refresh_margin, 0))
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to refresh FCM access token: {e}")
+                await asyncio.sleep(self.retry_interval)
+
+    def start(self):
+        """Start refreshing ahead of expiry in the background"""
+        if self._background_task is None:
+            self._background_task = asyncio.create_task(self._refresh_ahead())
+
+    async def stop(self):
+        if self._background_task:
+            self._background_task.cancel()
+            try:
+                await self._background_task
+            except asyncio.CancelledError:
+                pass
+            self._background_task = None
+
+    def metrics(self) -> dict:
+        return {
+            "token_age_seconds": (
+                time.time() - self.refreshed_at if self.refreshed_at else None
+            ),
+            "token_expires_in_seconds": self.seconds_until_expiry(),
+            "last_refresh_latency_ms": (
+                self.last_refresh_latency * 1000
+                if self.last_refresh_latency is not None
+                else None
+            ),
+            "refresh_count": self.refresh_count,
+            "refresh_failures": self.refresh_failures,
+        }
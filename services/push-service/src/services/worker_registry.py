@@ -0,0 +1,55 @@
+from typing import Dict
+import json
+import logging
+import time
+
+from redis import asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerRegistry:
+    """Heartbeats and metrics of consumer worker processes, shared through Redis.
+
+    Each worker writes its latest report to one field of a Redis hash. The
+    API process reads the hash to aggregate health and metrics, and drops
+    reports that have not been refreshed within `stale_after` seconds.
+    """
+
+    def __init__(
+        self,
+        redis_client: aioredis.Redis,
+        key: str = "push:workers",
+        stale_after: float = 15.0,
+    ):
+        self.redis_client = redis_client
+        self.key = key
+        self.stale_after = stale_after
+
+    async def publish(self, worker_id: str, report: dict):
+        report = {**report, "heartbeat_at": time.time()}
+        await self.redis_client.hset(self.key, worker_id, json.dumps(report))
+
+    async def remove(self, worker_id: str):
+        await self.redis_client.hdel(self.key, worker_id)
+
+    async def reports(self) -> Dict[str, dict]:
+        """Live worker reports by worker id; stale ones are removed"""
+        raw = await self.redis_client.hgetall(self.key)
+        now = time.time()
+        live, stale = {}, []
+        for worker_id, value in raw.items():
+            try:
+                report = json.loads(value)
+            except ValueError:
+                stale.append(worker_id)
+                continue
+            if now - report.get("heartbeat_at", 0) > self.stale_after:
+                stale.append(worker_id)
+            else:
+                report["heartbeat_age_seconds"] = now - report["heartbeat_at"]
+                live[worker_id] = report
+        if stale:
+            logger.warning(f"Dropping stale worker reports: {', '.join(stale)}")
+            await self.redis_client.hdel(self.key, *stale)
+        return live
@@ -6,8 +6,11 @@ import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, patch, MagicMock
 import json
+import time
 from datetime import datetime
 
+from src.services import ClaimStatus
+
 
 # Mock dependencies before importing main
 @pytest.fixture(autouse=True)
@@ -18,6 +21,39 @@ def mock_dependencies():
         yield
 
 
+@pytest.fixture(autouse=True)
+def no_invalid_tokens():
+    import sys
+    import os
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+    from main import state
+
+    original = state.invalid_tokens
+    state.invalid_tokens = MagicMock()
+    state.invalid_tokens.is_invalid = AsyncMock(return_value=False)
+    state.invalid_tokens.mark_invalid = AsyncMock()
+    yield
+    state.invalid_tokens = original
+
+
+@pytest.fixture(autouse=True)
+def unthrottled_rate_limiter():
+    import sys
+    import os
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+    from main import state
+
+    original = state.rate_limiter
+    state.rate_limiter = MagicMock()
+    state.rate_limiter.acquire = AsyncMock()
+    yield
+    state.rate_limiter = original
+
+
 @pytest.fixture
 def client():
     # Import after mocking
@@ -58,22 +94,36 @@ def test_metrics_endpoint(client):
 @pytest.mark.asyncio
 async def test_send_fcm_notification():
     """Test FCM notification sending"""
-    from main import send_fcm_notification
+    from main import send_fcm_notification, state
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_response = MagicMock()
-        mock_response.json.return_value = {"success": 1}
-        mock_response.raise_for_status = MagicMock()
+    mock_response = MagicMock()
+    mock_response.json.return_value = {"success": 1}
+    mock_response.raise_for_status = MagicMock()
 
-        mock_client.return_value.__aenter__.return_value.post = AsyncMock(
-            return_value=mock_response
-        )
+    state.http_client = MagicMock()
+    state.http_client.post = AsyncMock(return_value=mock_response)
+
+    with patch("main.get_access_token", new_callable=AsyncMock) as mock_token:
+        mock_token.return_value = "token"
 
         result = await send_fcm_notification(
             push_token="test_token", title="Test", body="Test message"
         )
 
         assert result["success"] == 1
+        state.http_client.post.assert_called_once()
+
+
+def test_create_http_client_uses_http2_pool():
+    """Test the shared FCM client is pooled and HTTP/2 enabled"""
+    from src.services import create_http_client
+
+    client = create_http_client(max_connections=5, max_keepalive_connections=2)
+
+    pool = client._transport._pool
+    assert pool._http2 is True
+    assert pool._max_connections == 5
+    assert pool._max_keepalive_connections == 2
 
 
 @pytest.mark.asyncio
@@ -82,9 +132,9 @@ async def test_process_push_notification():
     from main import process_push_notification, state
 
     # Mock dependencies
-    state.redis_client = MagicMock()
-    state.redis_client.exists = AsyncMock(return_value=False)
-    state.redis_client.setex = AsyncMock()
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.complete = AsyncMock()
 
     message_body = {
         "notification_id": "notif_123",
@@ -110,14 +160,17 @@ async def test_process_push_notification():
         # Verify status updates were sent
         assert mock_status.call_count == 2  # pending and delivered
 
+        # Verify the claim was promoted to done
+        state.idempotency.complete.assert_awaited_once_with("req_123")
+
 
 @pytest.mark.asyncio
 async def test_idempotency():
     """Test idempotency check"""
     from main import process_push_notification, state
 
-    state.redis_client = MagicMock()
-    state.redis_client.exists = AsyncMock(return_value=True)  # Already processed
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.DONE)  # Already processed
 
     message_body = {
         "notification_id": "notif_123",
@@ -134,21 +187,287 @@ async def test_idempotency():
         mock_fcm.assert_not_called()
 
 
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value, nx=False, ex=None):
+        self.commands.append(("set", key, value, nx))
+        return self
+
+    def get(self, key):
+        self.commands.append(("get", key))
+        return self
+
+    async def execute(self):
+        self.redis.round_trips += 1
+        replies = []
+        for command in self.commands:
+            if command[0] == "get":
+                replies.append(self.redis.data.get(command[1]))
+            else:
+                _, key, value, nx = command
+                if nx and key in self.redis.data:
+                    replies.append(None)
+                else:
+                    self.redis.data[key] = value
+                    replies.append(True)
+        return replies
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.round_trips = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def get(self, key):
+        self.round_trips += 1
+        return self.data.get(key)
+
+    async def set(self, key, value, nx=False, ex=None):
+        self.round_trips += 1
+        self.data[key] = value
+
+    async def delete(self, key):
+        self.round_trips += 1
+        self.data.pop(key, None)
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_batches_claims_in_one_pipeline():
+    """Test concurrent claims share one pipelined round trip"""
+    import asyncio
+    from src.services import IdempotencyStore
+
+    redis = FakeRedis()
+    redis.data["push:processed:req_done"] = "done"
+    redis.data["push:processed:req_busy"] = "inflight"
+    store = IdempotencyStore(redis)
+
+    results = await asyncio.gather(
+        store.claim("req_1"),
+        store.claim("req_2"),
+        store.claim("req_done"),
+        store.claim("req_busy"),
+    )
+
+    assert results == [
+        ClaimStatus.CLAIMED,
+        ClaimStatus.CLAIMED,
+        ClaimStatus.DONE,
+        ClaimStatus.IN_FLIGHT,
+    ]
+    assert redis.round_trips == 1
+
+    await store.complete("req_1")
+    await store.release("req_2")
+    assert redis.data["push:processed:req_1"] == "done"
+    assert "push:processed:req_2" not in redis.data
+
+    # Hot duplicates are answered from the local LRU
+    round_trips = redis.round_trips
+    assert await store.claim("req_1") == ClaimStatus.DONE
+    assert redis.round_trips == round_trips
+
+
+@pytest.mark.asyncio
+async def test_idempotency_store_claims_duplicates_in_one_batch_once():
+    """Test two copies of a request claimed in the same tick are not both sent"""
+    import asyncio
+    from src.services import IdempotencyStore
+
+    redis = FakeRedis()
+    store = IdempotencyStore(redis)
+
+    results = await asyncio.gather(
+        store.claim("req_1"), store.claim("req_2"), store.claim("req_1")
+    )
+
+    assert results == [ClaimStatus.CLAIMED, ClaimStatus.CLAIMED, ClaimStatus.IN_FLIGHT]
+    assert redis.round_trips == 1
+
+
+@pytest.mark.asyncio
+async def test_invalid_token_cache_remembers_valid_tokens_locally():
+    """Test repeat sends to a valid token skip the Redis lookup until it is invalidated"""
+    from src.services import InvalidTokenCache
+
+    redis = FakeRedis()
+    cache = InvalidTokenCache(redis, valid_ttl=60)
+
+    assert await cache.is_invalid("token_ok") is False
+    assert await cache.is_invalid("token_ok") is False
+    assert redis.round_trips == 1
+    assert cache.metrics()["valid_hits"] == 1
+
+    await cache.mark_invalid("token_ok", "UNREGISTERED")
+    round_trips = redis.round_trips
+    assert await cache.is_invalid("token_ok") is True
+    assert redis.round_trips == round_trips
+
+
+@pytest.mark.asyncio
+async def test_permanent_fcm_error_marks_token_invalid_without_retry():
+    """Test UNREGISTERED tokens are cached, reported and never retried"""
+    from main import process_push_notification, state
+    from src.services import FCMError
+
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.complete = AsyncMock()
+    state.retry_scheduler = MagicMock()
+    state.retry_scheduler.schedule = AsyncMock()
+    state.publisher = MagicMock()
+    state.publisher.publish = AsyncMock()
+
+    message_body = {
+        "notification_id": "notif_123",
+        "request_id": "req_123",
+        "user_id": "user_1",
+        "push_token": "dead_token",
+        "title": "Test",
+        "body": "Test message",
+    }
+
+    with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm, patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ) as mock_status:
+        mock_fcm.side_effect = FCMError(404, "UNREGISTERED", "not registered")
+
+        await process_push_notification(message_body)
+
+    state.retry_scheduler.schedule.assert_not_called()
+    state.invalid_tokens.mark_invalid.assert_awaited_once_with(
+        "dead_token", "UNREGISTERED"
+    )
+    assert state.publisher.publish.call_args.kwargs["routing_key"] == "token.invalid"
+    assert mock_status.call_args.args[1] == "failed"
+
+    # Later sends to the same token fail fast without calling FCM
+    state.invalid_tokens.is_invalid = AsyncMock(return_value=True)
+    with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm, patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ):
+        await process_push_notification({**message_body, "request_id": "req_456"})
+        mock_fcm.assert_not_called()
+
+
+def test_fcm_error_parses_error_code_and_retry_after():
+    """Test FCM v1 error bodies are classified by their errorCode"""
+    import httpx
+    from src.services import FCMError
+
+    response = httpx.Response(
+        404,
+        headers={"Retry-After": "5"},
+        json={
+            "error": {
+                "code": 404,
+                "message": "Requested entity was not found.",
+                "status": "NOT_FOUND",
+                "details": [
+                    {
+                        "@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError",
+                        "errorCode": "UNREGISTERED",
+                    }
+                ],
+            }
+        },
+    )
+
+    error = FCMError.from_response(response)
+    assert error.error_code == "UNREGISTERED"
+    assert error.is_permanent
+    assert error.retry_after == 5
+    assert not FCMError(503, "UNAVAILABLE").is_permanent
+
+
+@pytest.mark.asyncio
+async def test_invalid_argument_blames_the_token_only_for_token_field():
+    """Test a payload INVALID_ARGUMENT fails the message but keeps the token valid"""
+    import httpx
+    from main import process_push_notification, state
+    from src.services import FCMError
+
+    def invalid_argument(field):
+        return FCMError.from_response(
+            httpx.Response(
+                400,
+                json={
+                    "error": {
+                        "status": "INVALID_ARGUMENT",
+                        "message": "Invalid value",
+                        "details": [
+                            {
+                                "@type": "type.googleapis.com/google.rpc.BadRequest",
+                                "fieldViolations": [{"field": field}],
+                            }
+                        ],
+                    }
+                },
+            )
+        )
+
+    bad_token = invalid_argument("message.token")
+    bad_image = invalid_argument("message.notification.image")
+    assert bad_token.is_permanent and bad_token.is_invalid_token
+    assert bad_image.is_permanent and not bad_image.is_invalid_token
+    assert FCMError(404, "UNREGISTERED").is_invalid_token
+    assert not FCMError(400, "INVALID_ARGUMENT").is_invalid_token
+
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.release = AsyncMock()
+    state.idempotency.complete = AsyncMock()
+    state.retry_scheduler = MagicMock()
+    state.retry_scheduler.schedule = AsyncMock()
+    state.publisher = MagicMock()
+    state.publisher.publish = AsyncMock()
+
+    with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm, patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ) as mock_status:
+        mock_fcm.side_effect = bad_image
+        await process_push_notification(
+            {
+                "notification_id": "notif_img",
+                "request_id": "req_img",
+                "push_token": "good_token",
+                "title": "Test",
+                "image": "not a url",
+            }
+        )
+
+    state.retry_scheduler.schedule.assert_not_called()
+    state.invalid_tokens.mark_invalid.assert_not_called()
+    publish = state.publisher.publish.call_args
+    assert publish.kwargs["routing_key"] == "failed.queue"
+    assert publish.args[0]["error_code"] == "INVALID_ARGUMENT"
+    assert mock_status.call_args.args[1] == "failed"
+
+
 @pytest.mark.asyncio
 async def test_retry_logic():
     """Test retry logic on failure"""
     from main import process_push_notification, state
 
-    state.redis_client = MagicMock()
-    state.redis_client.exists = AsyncMock(return_value=False)
-    state.retry_count = {}
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.release = AsyncMock()
 
-    # Mock RabbitMQ channel
-    mock_channel = MagicMock()
-    mock_exchange = MagicMock()
-    mock_exchange.publish = AsyncMock()
-    mock_channel.declare_exchange = AsyncMock(return_value=mock_exchange)
-    state.rabbitmq_channel = mock_channel
+    # Mock retry scheduler
+    state.retry_scheduler = MagicMock()
+    state.retry_scheduler.schedule = AsyncMock(return_value=1)
 
     message_body = {
         "notification_id": "notif_123",
@@ -160,12 +479,1339 @@ async def test_retry_logic():
 
     with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm, patch(
         "asyncio.sleep", new_callable=AsyncMock
-    ):
+    ) as mock_sleep:
+
+        mock_fcm.side_effect = Exception("FCM Error")
+
+        await process_push_notification(message_body)
+
+        # Retry state travels with the message, not in process memory
+        assert not hasattr(state, "retry_count")
 
+        # Retry is parked in a delay queue instead of sleeping in the handler
+        state.retry_scheduler.schedule.assert_awaited_once_with(
+            message_body, 1, headers=None, lane="normal"
+        )
+        mock_sleep.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_publisher_declares_exchange_once():
+    """Test the publisher declares its exchange at startup, not per publish"""
+    from src.services import Publisher
+
+    exchange = MagicMock()
+    exchange.publish = AsyncMock()
+    channel = MagicMock()
+    channel.declare_exchange = AsyncMock(return_value=exchange)
+    connection = MagicMock()
+    connection.channel = AsyncMock(return_value=channel)
+
+    publisher = Publisher(connection)
+    await publisher.start()
+    for i in range(3):
+        await publisher.publish({"n": i}, routing_key="status.queue")
+
+    connection.channel.assert_awaited_once_with(publisher_confirms=True)
+    channel.declare_exchange.assert_awaited_once()
+    assert exchange.publish.await_count == 3
+    assert publisher.published == 3
+
+
+@pytest.mark.asyncio
+async def test_status_batcher_suppresses_pending_and_flushes_on_stop():
+    """Test pending is dropped when delivered follows, and stop flushes the rest"""
+    from src.services import StatusBatcher
+
+    publisher = MagicMock()
+    publisher.publish = AsyncMock()
+    batcher = StatusBatcher(publisher, pending_window=60, max_batch=100)
+
+    await batcher.add({"notification_id": "n1", "status": "pending"})
+    await batcher.add({"notification_id": "n1", "status": "delivered"})
+    await batcher.add({"notification_id": "n2", "status": "pending"})
+
+    await batcher.flush()
+    published = [call.args[0] for call in publisher.publish.call_args_list]
+    assert published == [{"notification_id": "n1", "status": "delivered"}]
+
+    await batcher.stop()
+    published = [call.args[0] for call in publisher.publish.call_args_list]
+    assert published[-1] == {"notification_id": "n2", "status": "pending"}
+    assert batcher.metrics() == {
+        "buffered": 0,
+        "published": 2,
+        "suppressed": 1,
+        "failed": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_status_batcher_flushes_when_full():
+    """Test a full buffer is flushed without waiting for the interval"""
+    from src.services import StatusBatcher
+
+    publisher = MagicMock()
+    publisher.publish = AsyncMock()
+    batcher = StatusBatcher(publisher, max_batch=2)
+
+    await batcher.add({"notification_id": "n1", "status": "delivered"})
+    assert publisher.publish.await_count == 0
+    await batcher.add({"notification_id": "n2", "status": "failed"})
+    assert publisher.publish.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_status_batcher_keeps_suppressing_pending_under_load():
+    """Test held pending updates survive size-triggered flushes at full batch load"""
+    from src.services import StatusBatcher
+
+    publisher = MagicMock()
+    publisher.publish = AsyncMock()
+    batcher = StatusBatcher(publisher, pending_window=60, max_batch=100)
+
+    for index in range(100):
+        await batcher.add({"notification_id": f"n{index}", "status": "pending"})
+    assert publisher.publish.await_count == 0
+    for index in range(100):
+        await batcher.add({"notification_id": f"n{index}", "status": "delivered"})
+
+    published = [call.args[0]["status"] for call in publisher.publish.await_args_list]
+    assert published == ["delivered"] * 100
+    assert batcher.suppressed == 100
+    assert len(batcher) == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_count_read_from_message_body():
+    """Test the PushNotification.retry_count field drives the DLQ decision"""
+    from main import process_push_notification, state
+
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.release = AsyncMock()
+    state.retry_scheduler = MagicMock()
+    state.retry_scheduler.schedule = AsyncMock()
+
+    state.publisher = MagicMock()
+    state.publisher.publish = AsyncMock()
+
+    message_body = {
+        "notification_id": "notif_123",
+        "request_id": "req_123",
+        "push_token": "invalid_token",
+        "title": "Test",
+        "body": "Test message",
+        "retry_count": 3,
+    }
+
+    with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm, patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ):
         mock_fcm.side_effect = Exception("FCM Error")
 
         await process_push_notification(message_body)
 
-        # Check retry count was incremented
-        assert "notif_123" in state.retry_count
-        assert state.retry_count["notif_123"] == 1
+    state.retry_scheduler.schedule.assert_not_called()
+    assert state.publisher.publish.call_args.kwargs["routing_key"] == "failed.queue"
+
+
+@pytest.mark.asyncio
+async def test_retry_scheduler_publishes_to_delay_queue():
+    """Test retries are routed to the TTL queue for their attempt"""
+    from src.services import RETRY_COUNT_HEADER, RetryScheduler
+
+    publisher = MagicMock()
+    publisher.exchange_name = "notifications.direct"
+    publisher.publish = AsyncMock()
+    scheduler = RetryScheduler(publisher, delays=[1, 2, 4])
+
+    delay = await scheduler.schedule({"notification_id": "notif_123"}, 3)
+
+    assert delay == 4
+    body = publisher.publish.call_args.args[0]
+    assert body["retry_count"] == 3
+    assert publisher.publish.call_args.kwargs["headers"][RETRY_COUNT_HEADER] == 3
+    assert publisher.publish.call_args.kwargs["routing_key"] == "push.retry.4s"
+
+    channel = MagicMock()
+    queue = MagicMock()
+    queue.bind = AsyncMock()
+    channel.declare_queue = AsyncMock(return_value=queue)
+    await scheduler.declare(channel)
+
+    arguments = channel.declare_queue.call_args_list[0].kwargs["arguments"]
+    assert arguments["x-message-ttl"] == 1000
+    assert arguments["x-dead-letter-routing-key"] == "push.queue"
+
+
+class FakeIncomingMessage:
+    def __init__(self, body: dict):
+        notification_id = body.get("notification_id")
+        body = {
+            "request_id": f"req_{notification_id}",
+            "push_token": f"token_{notification_id}",
+            **body,
+        }
+        self.body = json.dumps(body).encode()
+        self.headers = {}
+        self.acked = False
+        self.rejected = False
+        self.requeued = False
+        self.queue = None
+
+    async def nack(self, requeue=True):
+        if requeue and self.queue is not None:
+            self.queue.messages.append(self)
+
+    def process(self, requeue=False):
+        message = self
+
+        class _Process:
+            async def __aenter__(self):
+                return message
+
+            async def __aexit__(self, exc_type, exc, tb):
+                if exc_type is None:
+                    message.acked = True
+                else:
+                    message.rejected = True
+                    message.requeued = requeue
+                return False
+
+        return _Process()
+
+
+class FakeQueue:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        for message in self.messages:
+            message.queue = self
+
+    def iterator(self):
+        messages = self.messages
+
+        class _Iterator:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+            def __aiter__(self):
+                return self._generate()
+
+            async def _generate(self):
+                while messages:
+                    yield messages.pop(0)
+
+        return _Iterator()
+
+
+class EndlessQueue(FakeQueue):
+    """A queue whose consumer stays open after the last message, like the broker's"""
+
+    def iterator(self):
+        import asyncio
+
+        messages = self.messages
+
+        class _Iterator:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, exc_type, exc, tb):
+                return False
+
+            def __aiter__(self):
+                return self._generate()
+
+            async def _generate(self):
+                while messages:
+                    yield messages.pop(0)
+                await asyncio.Event().wait()
+
+        return _Iterator()
+
+
+@pytest.mark.asyncio
+async def test_consume_push_queue_runs_handlers_concurrently():
+    """Test consumer keeps several handlers in flight and acks each one"""
+    import asyncio
+    from main import consume_push_queue, state
+
+    messages = [
+        FakeIncomingMessage({"notification_id": f"n{i}", "push_token": f"t{i}"})
+        for i in range(8)
+    ]
+    state.push_queues = {"normal": FakeQueue(messages)}
+    peak = 0
+
+    async def slow_process(message_body, *args):
+        nonlocal peak
+        peak = max(peak, state.in_flight)
+        await asyncio.sleep(0.01)
+
+    with patch("main.PUSH_CONCURRENCY", 4), patch(
+        "main.process_push_notification", side_effect=slow_process
+    ):
+        await consume_push_queue()
+
+    assert peak == 4
+    assert all(message.acked for message in messages)
+
+
+@pytest.mark.asyncio
+async def test_consume_push_queue_keeps_order_per_push_token():
+    """Test messages sharing a push_token are handled in arrival order"""
+    import asyncio
+    from main import consume_push_queue, state
+
+    messages = [
+        FakeIncomingMessage({"notification_id": f"n{i}", "push_token": "same"})
+        for i in range(5)
+    ]
+    state.push_queues = {"normal": FakeQueue(messages)}
+    handled = []
+
+    async def process(message_body, *args):
+        await asyncio.sleep(0.01 * (5 - int(message_body["notification_id"][1:])))
+        handled.append(message_body["notification_id"])
+
+    with patch("main.PUSH_CONCURRENCY", 5), patch(
+        "main.process_push_notification", side_effect=process
+    ):
+        await consume_push_queue()
+
+    assert handled == ["n0", "n1", "n2", "n3", "n4"]
+    assert len(state.ordering_locks) == 0
+
+
+@pytest.mark.asyncio
+async def test_weighted_lane_scheduler_prefers_high_priority():
+    """Test lanes are served by weight with starvation protection"""
+    from src.services import WeightedLaneScheduler, priority_lane
+
+    assert priority_lane(5) == "high"
+    assert priority_lane(1) == "normal"
+    assert priority_lane(0) == "low"
+    assert priority_lane(None) == "normal"
+
+    scheduler = WeightedLaneScheduler({"high": 6, "normal": 3, "low": 1}, max_wait=60)
+    for i in range(10):
+        for lane in ("high", "normal", "low"):
+            scheduler.put(lane, f"{lane}_{i}")
+
+    picked = [(await scheduler.get())[0] for _ in range(10)]
+    assert picked.count("high") == 6
+    assert picked.count("normal") == 3
+    assert picked.count("low") == 1
+
+    # A delivery waiting longer than max_wait jumps the queue
+    scheduler.max_wait = 0
+    lane, item = await scheduler.get()
+    assert (lane, item) == ("low", "low_1")
+
+    for lane in ("high", "normal", "low"):
+        scheduler.close_lane(lane)
+    while await scheduler.get() is not None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_consume_push_queue_serves_high_priority_first():
+    """Test a high priority backlog is dispatched ahead of a low priority one"""
+    from main import consume_push_queue, state
+
+    low = [FakeIncomingMessage({"notification_id": f"low{i}"}) for i in range(5)]
+    high = [FakeIncomingMessage({"notification_id": f"high{i}"}) for i in range(5)]
+    state.push_queues = {"low": FakeQueue(low), "high": FakeQueue(high)}
+    handled = []
+
+    async def process(message_body, *args):
+        handled.append(message_body["notification_id"])
+
+    with patch("main.PUSH_CONCURRENCY", 1), patch(
+        "main.PUSH_PRIORITY_WEIGHTS", {"high": 100, "low": 1}
+    ), patch("main.process_push_notification", side_effect=process):
+        await consume_push_queue()
+
+    assert handled[:5] == [f"high{i}" for i in range(5)]
+    assert len(handled) == 10
+
+
+@pytest.mark.asyncio
+async def test_throttled_send_waits_and_is_not_a_failure():
+    """Test a 429 slows the limiter and the send is retried in place"""
+    from main import deliver_push, state
+    from src.services import AdaptiveRateLimiter, FCMError
+
+    state.rate_limiter = AdaptiveRateLimiter(initial_rate=1000, min_rate=10)
+
+    with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm:
+        mock_fcm.side_effect = [FCMError(429, "QUOTA_EXCEEDED", retry_after=0.01), {"ok": 1}]
+
+        result = await deliver_push("token", "Title", "Body")
+
+    assert result == {"ok": 1}
+    assert mock_fcm.await_count == 2
+    assert 500 <= state.rate_limiter.rate < 501
+    assert state.rate_limiter.throttled == 1
+
+
+@pytest.mark.asyncio
+async def test_throttling_503_is_not_a_circuit_or_flow_control_failure():
+    """Test a 503 retried in place as throttling is not counted against FCM health"""
+    import httpx
+    from main import deliver_push, state
+    from src.services import AdaptiveRateLimiter
+
+    state.rate_limiter = AdaptiveRateLimiter(initial_rate=1000, min_rate=10)
+    request = httpx.Request("POST", "https://fcm.example/send")
+    state.http_client = MagicMock()
+    state.http_client.post = AsyncMock(
+        side_effect=[
+            httpx.Response(
+                503,
+                json={"error": {"status": "UNAVAILABLE"}},
+                headers={"Retry-After": "0.01"},
+                request=request,
+            ),
+            httpx.Response(200, json={"name": "ok"}, request=request),
+        ]
+    )
+    calls_before = list(state.circuit_breaker._calls)
+
+    with patch("main.get_access_token", new_callable=AsyncMock, return_value="t"), patch.object(
+        state.flow_controller, "observe"
+    ) as observe:
+        assert await deliver_push("token", "Title", "Body") == {"name": "ok"}
+
+    new_calls = list(state.circuit_breaker._calls)[len(calls_before):]
+    assert [failed for _, failed in new_calls] == [False, False]
+    assert [call.kwargs.get("failed", False) for call in observe.call_args_list] == [
+        False,
+        False,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_recovers_additively():
+    """Test successes raise the rate again after a multiplicative decrease"""
+    from src.services import AdaptiveRateLimiter
+
+    limiter = AdaptiveRateLimiter(initial_rate=100, increase=10, cooldown=0)
+    limiter.on_throttle()
+    assert limiter.rate == 50
+
+    for _ in range(50):
+        limiter.on_success()
+    assert 55 < limiter.rate < 61
+
+
+def test_circuit_breaker_opens_on_failure_rate_and_probes_half_open():
+    """Test sliding-window tripping and limited half-open probing"""
+    import asyncio
+    from src.services import AsyncCircuitBreaker, CircuitOpenError
+
+    breaker = AsyncCircuitBreaker(
+        min_calls=4,
+        failure_rate=0.5,
+        open_timeout=0,
+        half_open_max_calls=1,
+        half_open_successes=2,
+    )
+
+    async def fail():
+        raise RuntimeError("FCM down")
+
+    async def succeed():
+        return "ok"
+
+    async def scenario():
+        for func in (succeed, succeed, fail):
+            try:
+                await breaker.call(func)
+            except RuntimeError:
+                pass
+        assert breaker.state == "closed"
+
+        with pytest.raises(RuntimeError):
+            await breaker.call(fail)
+        assert breaker._state == "open"
+
+        # open_timeout elapsed: one probe at a time is let through
+        assert breaker.state == "half_open"
+        blocked = asyncio.Event()
+
+        async def slow_probe():
+            await blocked.wait()
+            return "ok"
+
+        probe = asyncio.create_task(breaker.call(slow_probe))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(succeed)
+        blocked.set()
+        await probe
+        await breaker.call(succeed)
+        assert breaker.state == "closed"
+
+        states = [entry["to"] for entry in breaker.metrics()["transitions"]]
+        assert states == ["open", "half_open", "closed"]
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.asyncio
+async def test_consumption_pauses_while_circuit_open():
+    """Test buffered deliveries are requeued, not processed, while open"""
+    from main import consume_push_queue, state
+    from src.services import AsyncCircuitBreaker
+
+    breaker = AsyncCircuitBreaker(open_timeout=0.05, half_open_successes=1)
+    state.circuit_breaker = breaker
+    messages = [FakeIncomingMessage({"notification_id": f"n{i}"}) for i in range(5)]
+    state.push_queues = {"normal": FakeQueue(messages)}
+    handled = []
+
+    async def process(message_body, *args):
+        handled.append((message_body["notification_id"], breaker.state))
+        if len(handled) == 1:
+            breaker._transition("open")
+
+    with patch("main.PUSH_CONCURRENCY", 1), patch(
+        "main.process_push_notification", side_effect=process
+    ):
+        await consume_push_queue()
+
+    assert sorted(notification_id for notification_id, _ in handled) == [
+        f"n{i}" for i in range(5)
+    ]
+    assert all(circuit != "open" for _, circuit in handled)
+    assert not breaker.listeners
+
+
+class FakeCredentials:
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.token = None
+        self.expiry = None
+        self.refresh_calls = 0
+
+    @property
+    def valid(self):
+        return self.token is not None
+
+    def refresh(self, request):
+        import time
+
+        time.sleep(self.delay)
+        self.refresh_calls += 1
+        self.token = f"token_{self.refresh_calls}"
+
+
+@pytest.mark.asyncio
+async def test_token_manager_single_flight_refresh():
+    """Test concurrent callers share one refresh that runs off the event loop"""
+    import asyncio
+    from src.services import TokenManager
+
+    credentials = FakeCredentials()
+    manager = TokenManager(lambda: credentials)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.005)
+
+    ticker_task = asyncio.create_task(ticker())
+    tokens = await asyncio.gather(*(manager.get_token() for _ in range(10)))
+    ticker_task.cancel()
+
+    assert tokens == ["token_1"] * 10
+    assert credentials.refresh_calls == 1
+    assert ticks > 1
+    metrics = manager.metrics()
+    assert metrics["refresh_count"] == 1
+    assert metrics["last_refresh_latency_ms"] >= 50
+
+
+def test_metrics_registry_renders_prometheus_histograms():
+    """Test histogram buckets, quantiles and label escaping in the exposition"""
+    from src.utils import MetricsRegistry
+
+    registry = MetricsRegistry()
+    stages = registry.histogram("stage_seconds", "Stage time", ["stage"])
+    outcomes = registry.counter("outcomes_total", "Outcomes", ["error_code"])
+    for value in (0.002, 0.004, 0.02, 0.2):
+        stages.observe(value, stage="fcm")
+    outcomes.inc(error_code='bad"code')
+
+    text = registry.render_prometheus()
+    assert "# TYPE stage_seconds histogram" in text
+    assert 'stage_seconds_bucket{stage="fcm",le="0.005"} 2' in text
+    assert 'stage_seconds_bucket{stage="fcm",le="+Inf"} 4' in text
+    assert 'stage_seconds_count{stage="fcm"} 4' in text
+    assert 'outcomes_total{error_code="bad\\"code"} 1' in text
+    assert 0.0025 <= stages.quantile(0.5, stage="fcm") <= 0.005
+    assert registry.snapshot()["stage_seconds"]["fcm"]["count"] == 4
+
+
+def test_prometheus_metrics_endpoint(client):
+    """Test stage histograms are exposed in Prometheus text format"""
+    from main import STAGE_SECONDS
+
+    STAGE_SECONDS.observe(0.01, stage="fcm")
+    response = client.get("/metrics/prometheus")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'push_stage_duration_seconds_count{stage="fcm"}' in response.text
+    assert "push_in_flight" in response.text
+
+
+@pytest.mark.asyncio
+async def test_queue_depth_sampler_derives_rates_from_samples():
+    """Test /metrics depth and rates come from in-memory samples"""
+    from src.services import QueueDepthSampler
+
+    depths = iter([100, 80])
+    queue = MagicMock()
+    queue.declare = AsyncMock(
+        side_effect=lambda: MagicMock(message_count=next(depths))
+    )
+    consumed = iter([0, 30])
+    sampler = QueueDepthSampler(history=10)
+    sampler.track("push.queue", [queue], consumed=lambda: next(consumed))
+
+    with patch("src.services.queue_sampler.time") as clock:
+        clock.monotonic.side_effect = [0, 10, 10]
+        await sampler.sample()
+        await sampler.sample()
+        stats = sampler.stats("push.queue")
+
+    assert queue.declare.await_count == 2
+    assert sampler.depth("push.queue") == 80
+    assert stats["net_rate"] == -2
+    assert stats["egress_rate"] == 3
+    assert stats["ingress_rate"] == 1
+    assert stats["drain_seconds"] == 40
+
+
+@pytest.mark.asyncio
+async def test_fake_fcm_server_injects_throttling():
+    """Test the benchmark FCM stand-in answers 429s the way FCM does"""
+    from src.benchmarks.fake_fcm import FakeFCMServer
+    from src.services import FCMError, create_http_client
+
+    server = FakeFCMServer(throttle_rate=1.0, retry_after=2)
+    await server.start()
+    client = create_http_client(http2=False)
+    try:
+        response = await client.post(server.url, json={"message": {}})
+    finally:
+        await client.aclose()
+        await server.stop()
+
+    error = FCMError.from_response(response)
+    assert error.status_code == 429
+    assert error.error_code == "QUOTA_EXCEEDED"
+    assert error.retry_after == 2
+    assert server.responses[429] == 1
+
+
+def test_metrics_aggregated_across_workers(client):
+    """Test the API process sums live worker reports and drops stale ones"""
+    import time
+    from main import metrics, state
+    from src.services import WorkerRegistry
+
+    worker_metrics = metrics.merged([])
+    worker_metrics.get("push_notifications_total").inc(outcome="delivered")
+    worker_metrics.get("push_stage_duration_seconds").observe(0.02, stage="fcm")
+
+    def report(in_flight, heartbeat_at):
+        local = {
+            "is_processing": True,
+            "in_flight": in_flight,
+            "concurrency": 10,
+            "circuit_breaker_open": False,
+            "priorities": {},
+        }
+        return json.dumps(
+            {
+                "pid": 100 + in_flight,
+                "local": local,
+                "metrics": worker_metrics.dump(),
+                "heartbeat_at": heartbeat_at,
+            }
+        )
+
+    redis = MagicMock()
+    redis.hgetall = AsyncMock(
+        return_value={
+            "0": report(2, time.time()),
+            "1": report(3, time.time()),
+            "2": report(7, time.time() - 60),
+        }
+    )
+    redis.hdel = AsyncMock()
+    state.worker_registry = WorkerRegistry(redis, stale_after=15)
+    state.role = "api"
+    try:
+        data = client.get("/metrics").json()["data"]
+        text = client.get("/metrics/prometheus").text
+    finally:
+        state.role = "all"
+
+    assert set(data["workers"]) == {"0", "1"}
+    assert data["in_flight"] == 5
+    assert data["concurrency"] == 20
+    assert data["outcomes"]["delivered,"] == 2
+    assert data["stages"]["fcm"]["count"] == 2
+    assert 'push_notifications_total{outcome="delivered",error_code=""} 2.0' in text
+    redis.hdel.assert_awaited_with("push:workers", "2")
+
+
+def test_merged_gauges_sum_per_process_values_and_max_shared_ones():
+    """Test worker gauges merge without multiplying shared state by the worker count"""
+    from src.utils import MetricsRegistry
+
+    def worker(in_flight, circuit_open, local_rate):
+        registry = MetricsRegistry()
+        registry.gauge("in_flight", "", function=lambda: in_flight)
+        registry.gauge("circuit_open", "", function=lambda: circuit_open, aggregate="max")
+        registry.gauge("rate", "", function=lambda: local_rate)
+        return registry
+
+    workers = [worker(2, 1.0, 250.0), worker(3, 1.0, 250.0), worker(1, 0.0, 250.0)]
+    merged = workers[0].merged(registry.dump() for registry in workers)
+
+    text = merged.render_prometheus()
+    assert "in_flight 6" in text
+    assert "circuit_open 1" in text
+    assert "rate 750" in text
+
+
+@pytest.mark.asyncio
+async def test_malformed_message_goes_straight_to_dlq():
+    """Test a message failing validation is dead-lettered without processing"""
+    from main import consume_push_queue, state
+
+    valid = FakeIncomingMessage({"notification_id": "n1"})
+    missing_token = FakeIncomingMessage({"notification_id": "n2", "push_token": None})
+    not_json = FakeIncomingMessage({"notification_id": "n3"})
+    not_json.body = b"{not json"
+    state.push_queues = {"normal": FakeQueue([valid, missing_token, not_json])}
+    state.publisher = MagicMock()
+    state.publisher.publish = AsyncMock()
+    processed = []
+
+    async def process(message_body, *args):
+        processed.append(message_body["notification_id"])
+
+    with patch("main.process_push_notification", side_effect=process), patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ) as mock_status:
+        await consume_push_queue()
+
+    assert processed == ["n1"]
+    assert all(m.acked for m in (valid, missing_token, not_json))
+    dead_lettered = [call.args[0] for call in state.publisher.publish.call_args_list]
+    assert all(
+        call.kwargs["routing_key"] == "failed.queue"
+        for call in state.publisher.publish.call_args_list
+    )
+    assert dead_lettered[0]["notification_id"] == "n2"
+    assert dead_lettered[0]["error"].startswith("push_token:")
+    assert dead_lettered[1]["raw_body"] == "{not json"
+    mock_status.assert_awaited_once()
+    assert mock_status.call_args.args[:2] == ("n2", "failed")
+
+
+
+def test_decode_gateway_message_with_json_string_metadata():
+    """Test the gateway's message shape, with metadata published as a JSON string"""
+    from pydantic import ValidationError
+    from src.schemas import decode_push_message
+    from src.services import coalesce_key
+
+    gateway_message = {
+        "notification_id": "7f9c1a52-1d1e-4c44-9d0e-8b7a4f3e2a10",
+        "request_id": "req-42",
+        "notification_type": "push",
+        "user_id": "3d6f0a8e-5b1c-4f2a-9e7d-1c2b3a4d5e6f",
+        "email": "jane@example.com",
+        "push_token": "device_token",
+        "template_code": "ride_arrival",
+        "variables": {"name": "Jane", "link": "https://app.example/ride"},
+        "priority": 2,
+        "metadata": json.dumps({"collapse_key": "ride", "expires_at": 1800000000}),
+        "created_at": "2026-10-17T08:00:00.000Z",
+    }
+
+    message = decode_push_message(json.dumps(gateway_message).encode())
+    assert message["metadata"] == {"collapse_key": "ride", "expires_at": 1800000000}
+    assert coalesce_key(message) == "device_token:ride"
+
+    for metadata in (None, ""):
+        body = json.dumps({**gateway_message, "metadata": metadata}).encode()
+        assert decode_push_message(body)["metadata"] is None
+
+    with pytest.raises(ValidationError):
+        decode_push_message(
+            json.dumps({**gateway_message, "metadata": "{not json"}).encode()
+        )
+
+
+@pytest.mark.asyncio
+async def test_template_client_caches_and_single_flights_fetches():
+    """Test concurrent misses share one fetch and rendering is local"""
+    import asyncio
+    import httpx
+    from src.services import TemplateClient, TemplateNotFoundError
+
+    requests = []
+
+    async def handler(request):
+        requests.append(request)
+        await asyncio.sleep(0.01)
+        if request.url.path.endswith("/missing"):
+            return httpx.Response(404, json={"detail": "Template not found"})
+        return httpx.Response(
+            200,
+            json={
+                "success": True,
+                "data": {
+                    "title": "Hi {{ name }}",
+                    "body": "Your code is {{code}}, {{unknown}}",
+                    "version": 3,
+                },
+            },
+        )
+
+    client = TemplateClient(
+        "http://templates",
+        http_client=httpx.AsyncClient(
+            base_url="http://templates", transport=httpx.MockTransport(handler)
+        ),
+    )
+    rendered = await asyncio.gather(
+        *(client.render("welcome", {"name": "Jane", "code": 42}) for _ in range(10))
+    )
+    pinned = await client.get("welcome", "en", 3)
+    with pytest.raises(TemplateNotFoundError):
+        await client.get("missing")
+    await client.close()
+
+    assert rendered[0] == ("Hi Jane", "Your code is 42, {{unknown}}")
+    assert len(requests) == 2
+    assert requests[0].url.params["language"] == "en"
+    assert pinned.version == 3
+    assert client.metrics()["fetches"] == 2
+
+
+@pytest.mark.asyncio
+async def test_process_push_notification_renders_template():
+    """Test a gateway message without title/body is rendered from its template"""
+    from main import process_push_notification, state
+
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.complete = AsyncMock()
+    state.templates = MagicMock()
+    state.templates.render = AsyncMock(return_value=("Hello Jane", "Welcome aboard"))
+
+    message_body = {
+        "notification_id": "notif_tpl",
+        "request_id": "req_tpl",
+        "push_token": "test_token",
+        "template_code": "welcome",
+        "language": "fr",
+        "variables": {"name": "Jane"},
+    }
+
+    with patch("main.deliver_push", new_callable=AsyncMock) as mock_deliver, patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ):
+        await process_push_notification(message_body)
+
+    state.templates.render.assert_awaited_once_with(
+        "welcome", {"name": "Jane"}, language="fr", version=None
+    )
+    assert mock_deliver.call_args.args[1:3] == ("Hello Jane", "Welcome aboard")
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_handlers_and_requeues_on_deadline():
+    """Test drain lets quick handlers finish and requeues ones past the deadline"""
+    import asyncio
+    from main import consume_push_queue, drain, state
+
+    quick = FakeIncomingMessage({"notification_id": "quick"})
+    slow = FakeIncomingMessage({"notification_id": "slow"})
+    state.push_queues = {"normal": EndlessQueue([quick, slow])}
+    state.idempotency = MagicMock()
+    state.idempotency.release = AsyncMock()
+
+    async def process(message_body, *args):
+        if message_body["notification_id"] == "slow":
+            await asyncio.sleep(10)
+
+    with patch("main.process_push_notification", side_effect=process):
+        state.consumer_task = asyncio.create_task(consume_push_queue())
+        await asyncio.sleep(0.05)
+        assert state.in_flight == 1
+        try:
+            await drain(0.1)
+        finally:
+            state.draining = False
+
+    assert quick.acked
+    assert slow.rejected and slow.requeued
+    assert state.in_flight == 0
+    assert state.drain_cancelled == 1
+    assert state.consumer_task is None
+
+
+def test_flow_controller_sizes_concurrency_from_latency_and_errors():
+    """Test concurrency follows rate x latency, backs off on errors, within bounds"""
+    from src.services import FlowController
+
+    changes = []
+    controller = FlowController(
+        rate=lambda: 100.0,
+        concurrency=10,
+        prefetch=10,
+        max_concurrency=50,
+        headroom=1.0,
+        smoothing=1.0,
+    )
+    controller.listeners.append(lambda *limits: changes.append(limits))
+
+    assert not controller.update()  # nothing observed yet
+
+    for _ in range(10):
+        controller.observe(0.2)
+    assert controller.update()
+    assert (controller.concurrency, controller.prefetch) == (20, 30)
+
+    for _ in range(10):
+        controller.observe(2.0)
+    controller.update()
+    assert controller.concurrency == 50
+    assert controller.prefetch == 75
+
+    for failed in [True] * 5 + [False] * 5:
+        controller.observe(2.0, failed=failed)
+    controller.update()
+    assert controller.concurrency == 25
+    assert changes == [(20, 30), (50, 75), (25, 38)]
+    assert controller.metrics()["error_rate"] == 0.5
+
+
+@pytest.mark.asyncio
+async def test_consumer_applies_flow_control_limits():
+    """Test a new limit resizes the handlers and a new prefetch resubscribes"""
+    import asyncio
+    from main import consume_push_queue, state
+
+    messages = [
+        FakeIncomingMessage({"notification_id": f"n{i}", "push_token": f"t{i}"})
+        for i in range(12)
+    ]
+    state.push_queues = {"normal": FakeQueue(messages)}
+    channel = state.rabbitmq_channel
+    state.rabbitmq_channel = MagicMock()
+    state.rabbitmq_channel.set_qos = AsyncMock()
+    set_qos = state.rabbitmq_channel.set_qos
+    peaks = []
+
+    async def process(message_body, *args):
+        peaks.append(state.in_flight)
+        if message_body["notification_id"] == "n0":
+            state.flow_controller.prefetch = 5
+            for listener in state.flow_controller.listeners:
+                listener(3, 5)
+        await asyncio.sleep(0.01)
+
+    try:
+        with patch("main.PUSH_CONCURRENCY", 1), patch(
+            "main.process_push_notification", side_effect=process
+        ):
+            await consume_push_queue()
+    finally:
+        state.flow_controller.prefetch = 10
+        state.rabbitmq_channel = channel
+
+    set_qos.assert_awaited_once_with(prefetch_count=5)
+    assert max(peaks) == 3
+    assert all(message.acked for message in messages)
+    assert not state.flow_controller.listeners
+
+
+@pytest.mark.asyncio
+async def test_consumer_coalesces_pushes_by_collapse_key():
+    """Test a burst to one device sends only a summary and supersedes the rest"""
+    import asyncio
+    from main import consume_push_queue, drain, state
+
+    chat = {
+        "push_token": "t1",
+        "metadata": {"collapse_key": "chat", "summary_title": "{{coalesced_count}} new messages"},
+    }
+    burst = [FakeIncomingMessage({"notification_id": f"n{i}", **chat}) for i in range(3)]
+    other = FakeIncomingMessage({"notification_id": "other", "push_token": "t2"})
+    state.push_queues = {"normal": EndlessQueue(burst + [other])}
+    state.idempotency = MagicMock()
+    state.idempotency.is_processed = AsyncMock(return_value=False)
+    state.idempotency.complete = AsyncMock()
+    state.status_batcher = MagicMock()
+    state.status_batcher.add = AsyncMock()
+    sent = []
+
+    async def process(message_body, *args):
+        sent.append(message_body)
+
+    with patch("main.PUSH_COALESCE_WINDOW", 0.05), patch(
+        "main.PUSH_COALESCE_MODE", "summary"
+    ), patch("main.process_push_notification", side_effect=process):
+        state.consumer_task = asyncio.create_task(consume_push_queue())
+        await asyncio.sleep(0.2)
+        try:
+            await drain(1)
+        finally:
+            state.draining = False
+
+    assert [body["notification_id"] for body in sent] == ["other", "n2"]
+    assert sent[1]["title"] == "3 new messages"
+    assert sent[1]["variables"]["coalesced_count"] == 3
+    assert all(message.acked for message in burst + [other])
+    statuses = [call.args[0] for call in state.status_batcher.add.await_args_list]
+    assert [(s["notification_id"], s["status"]) for s in statuses] == [
+        ("n0", "superseded"),
+        ("n1", "superseded"),
+    ]
+    assert state.coalescer.metrics()["superseded"] == 2
+
+
+@pytest.mark.asyncio
+async def test_future_send_at_is_parked_without_claiming():
+    """Test a push with a future send_at is parked and not sent"""
+    import time
+    from main import process_push_notification, state
+
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock()
+    state.send_scheduler = MagicMock()
+    state.send_scheduler.park = park = AsyncMock()
+    send_at = time.time() + 3600
+    message_body = {
+        "notification_id": "n1",
+        "request_id": "r1",
+        "push_token": "t1",
+        "metadata": {"send_at": send_at},
+    }
+
+    try:
+        with patch("main.send_fcm_notification", new_callable=AsyncMock) as mock_fcm, patch(
+            "main.send_status_update", new_callable=AsyncMock
+        ) as mock_status:
+            await process_push_notification(message_body)
+    finally:
+        state.send_scheduler = None
+
+    mock_fcm.assert_not_called()
+    state.idempotency.claim.assert_not_awaited()
+    park.assert_awaited_once_with({**message_body, "retry_count": 0}, send_at, lane="normal")
+    mock_status.assert_awaited_once_with("n1", "scheduled")
+
+
+@pytest.mark.asyncio
+async def test_send_scheduler_releases_due_pushes_within_rate():
+    """Test due pushes are published to their lane, at most the rate per interval"""
+    from src.services import SendScheduler
+    from src.utils import json_dumps
+
+    class RecordingPipeline:
+        def __init__(self, calls):
+            self.calls = calls
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: self.calls.append((name, args))
+
+        async def execute(self):
+            return []
+
+    due = [
+        (f"r{i}", json_dumps({"lane": "high" if i == 0 else "normal", "body": {"n": i}}))
+        for i in range(5)
+    ]
+    claims = []
+
+    async def claim_due(keys, args):
+        now, limit, leased_until = args
+        claims.append(limit)
+        batch, due[:] = due[:limit], due[limit:]
+        return [part for member, raw in batch for part in (member, raw.decode())]
+
+    calls = []
+    redis = MagicMock()
+    redis.register_script = MagicMock(return_value=claim_due)
+    redis.pipeline = lambda transaction=True: RecordingPipeline(calls)
+    publisher = MagicMock()
+    publisher.publish = AsyncMock()
+    scheduler = SendScheduler(
+        redis,
+        publisher,
+        lanes={"normal": "push.queue", "high": "push.queue.high"},
+        batch_size=2,
+        release_rate=3,
+    )
+
+    assert await scheduler.release() == 3
+    assert claims == [2, 1]
+    assert [call.kwargs["routing_key"] for call in publisher.publish.await_args_list] == [
+        "push.queue.high",
+        "push.queue",
+        "push.queue",
+    ]
+    assert ("zrem", ("push:scheduled", "r0", "r1")) in calls
+    assert ("hdel", ("push:scheduled:messages", "r2")) in calls
+    assert len(due) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_queue_replay_filters_dedups_and_resumes():
+    """Test a replay sends matching messages to their lane and resumes where it stopped"""
+    from main import LANE_QUEUES, message_lane
+    from src.services import FailedQueueReplayer, ReplayFilter
+
+    class DeadLetter:
+        def __init__(self, body):
+            self.body = json.dumps(body).encode()
+            self.acked = False
+
+        async def ack(self):
+            self.acked = True
+
+    class DeadLetterQueue:
+        name = "failed.queue"
+
+        def __init__(self, bodies):
+            self.messages = [DeadLetter(body) for body in bodies]
+
+        async def declare(self):
+            return MagicMock(message_count=len(self.messages))
+
+        async def get(self, no_ack=False, fail=True):
+            return self.messages.pop(0) if self.messages else None
+
+    def dead_letter(request_id, error_code="UNAVAILABLE", **fields):
+        return {
+            "notification_id": f"n_{request_id}",
+            "request_id": request_id,
+            "push_token": "t",
+            "error": f"FCM error {error_code}",
+            "error_code": error_code,
+            "failed_at": "2026-10-17T08:30:00",
+            "retry_count": 3,
+            **fields,
+        }
+
+    queue = DeadLetterQueue(
+        [
+            dead_letter("r1", priority=5),
+            dead_letter("r1"),
+            dead_letter("r3", error_code="UNREGISTERED"),
+            dead_letter("r4"),
+            dead_letter("r5"),
+            dead_letter("r6"),
+        ]
+    )
+    published = []
+
+    async def publish(body, routing_key):
+        published.append((body["request_id"], routing_key))
+        if routing_key == queue.name:
+            queue.messages.append(DeadLetter(body))
+
+    publisher = MagicMock()
+    publisher.publish = AsyncMock(side_effect=publish)
+    idempotency = MagicMock()
+    idempotency.is_processed = AsyncMock(side_effect=lambda request_id: request_id == "r4")
+    replayer = FailedQueueReplayer(
+        queue,
+        publisher,
+        idempotency,
+        FakeRedis(),
+        lanes=LANE_QUEUES,
+        lane_of=message_lane,
+        rate=1000,
+    )
+    replay_filter = ReplayFilter(since="2026-10-17T08:00:00Z", error_codes=["UNAVAILABLE"])
+
+    progress = await replayer.run(replay_filter, limit=2)
+    assert progress["status"] == "stopped"
+    assert published == [
+        ("r1", "push.queue.high"),
+        ("r3", "failed.queue"),
+        ("r5", "push.queue"),
+    ]
+    replayed_body = publisher.publish.await_args_list[0].args[0]
+    assert "error_code" not in replayed_body and "retry_count" not in replayed_body
+    assert replayed_body["replay_count"] == 1
+
+    resumed = await replayer.run(run_id=progress["run_id"])
+    assert resumed["status"] == "done"
+    assert published[3:] == [("r6", "push.queue"), ("r3", "failed.queue")]
+    assert {key: resumed[key] for key in FailedQueueReplayer.COUNTERS} == {
+        "scanned": 7,
+        "replayed": 3,
+        "skipped": 2,
+        "duplicates": 2,
+    }
+    assert await replayer.load(progress["run_id"]) == resumed
+
+
+@pytest.mark.asyncio
+async def test_traced_message_propagates_traceparent_and_exports_spans(tmp_path):
+    """Test a sampled delivery is traced per stage and its retry carries the trace"""
+    from main import handle_push_message, state
+    from src.utils import AdjustableSemaphore, JsonFileExporter, Tracer
+    from src.utils.tracing import parse_traceparent
+
+    trace_file = tmp_path / "traces.jsonl"
+    state.tracer = Tracer(JsonFileExporter(str(trace_file)), sample_rate=0.0)
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.release = AsyncMock()
+    state.retry_scheduler = MagicMock()
+    state.retry_scheduler.schedule = AsyncMock(return_value=1)
+
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    message = FakeIncomingMessage(
+        {"notification_id": "traced", "created_at": "2026-01-01T00:00:00"}
+    )
+    message.headers = {"traceparent": f"00-{trace_id}-{parent_id}-01"}
+    unsampled = FakeIncomingMessage({"notification_id": "untraced"})
+    semaphore = AdjustableSemaphore(2)
+
+    try:
+        with patch(
+            "main.send_fcm_notification", new_callable=AsyncMock
+        ) as mock_fcm, patch("main.send_status_update", new_callable=AsyncMock):
+            mock_fcm.side_effect = Exception("FCM Error")
+            for incoming in (message, unsampled):
+                await semaphore.acquire()
+                await handle_push_message(
+                    incoming, json.loads(incoming.body), semaphore
+                )
+        await state.tracer.flush()
+        metrics = state.tracer.metrics()
+    finally:
+        state.tracer = Tracer()
+
+    first_retry, second_retry = state.retry_scheduler.schedule.await_args_list
+    retry_trace_id, _, sampled = parse_traceparent(
+        first_retry.kwargs["headers"]["traceparent"]
+    )
+    assert (retry_trace_id, sampled) == (trace_id, True)
+    # The trace header carries the sampling decision, so unsampled retries stay unsampled
+    assert parse_traceparent(second_retry.kwargs["headers"]["traceparent"])[2] is False
+
+    spans = {
+        span["name"]: span
+        for span in map(json.loads, trace_file.read_text().splitlines())
+    }
+    assert set(spans) == {"push.message", "push.queue_wait", "push.dedup"}
+    root = spans["push.message"]
+    assert root["parent_id"] == parent_id
+    assert root["attributes"]["request_id"] == "req_traced"
+    assert root["attributes"]["outcome"] == "retried"
+    assert spans["push.queue_wait"]["parent_id"] == root["span_id"]
+    assert spans["push.queue_wait"]["start_ns"] == root["start_ns"]
+    assert metrics["sampled_traces"] == 1 and metrics["exported_spans"] == 3
+
+
+def test_deadline_from_type_ttl_metadata_and_fcm_ttl():
+    """Test deadlines combine per-type TTLs with metadata and reach the FCM payload"""
+    from src.services import build_fcm_message, deadline_of, parse_ttls
+
+    ttls = parse_ttls("otp:300, ride_arrival:120")
+    assert ttls == {"otp": 300.0, "ride_arrival": 120.0}
+
+    created_at = "2026-10-17T08:00:00"
+    created = datetime.fromisoformat(created_at + "+00:00").timestamp()
+    otp = {"notification_type": "otp", "created_at": created_at}
+    assert deadline_of(otp, ttls) == created + 300
+    assert deadline_of({**otp, "metadata": {"ttl": 30}}, ttls) == created + 30
+    assert (
+        deadline_of({**otp, "metadata": {"expires_at": created + 60}}, ttls)
+        == created + 60
+    )
+    # A scheduled push counts its TTL from its send time
+    assert (
+        deadline_of({**otp, "metadata": {"send_at": created + 3600}}, ttls)
+        == created + 3900
+    )
+    assert deadline_of({"notification_type": "news", "created_at": created_at}, ttls) is None
+    assert deadline_of({"notification_type": "news", "created_at": created_at}, ttls, 60)
+
+    message = build_fcm_message("token", "Title", "Body", ttl=42.3)["message"]
+    assert message["android"] == {"ttl": "43s"}
+    assert int(message["apns"]["headers"]["apns-expiration"]) >= int(time.time()) + 43
+    assert "android" not in build_fcm_message("token", "Title", "Body")["message"]
+
+
+@pytest.mark.asyncio
+async def test_expired_push_is_dropped_before_redis_and_fcm():
+    """Test a stale push is reported expired without claiming, sending or retrying"""
+    from main import process_push_notification, state
+
+    state.idempotency = MagicMock()
+    state.idempotency.claim = AsyncMock(return_value=ClaimStatus.CLAIMED)
+    state.idempotency.release = AsyncMock()
+    state.retry_scheduler = MagicMock()
+    state.retry_scheduler.schedule = AsyncMock(return_value=4)
+    state.retry_scheduler.delay_for = MagicMock(return_value=4)
+
+    stale = {
+        "notification_id": "stale",
+        "request_id": "req_stale",
+        "push_token": "token",
+        "title": "Your ride is here",
+        "notification_type": "ride_arrival",
+        "created_at": datetime.utcfromtimestamp(time.time() - 3600).isoformat(),
+    }
+    fresh = {
+        **stale,
+        "notification_id": "fresh",
+        "created_at": datetime.utcfromtimestamp(time.time() - 118).isoformat(),
+    }
+
+    with patch.dict("main.PUSH_NOTIFICATION_TTLS", {"ride_arrival": 120}), patch(
+        "main.deliver_push", new_callable=AsyncMock
+    ) as mock_deliver, patch(
+        "main.send_status_update", new_callable=AsyncMock
+    ) as mock_status:
+        await process_push_notification(stale)
+        state.idempotency.claim.assert_not_awaited()
+        mock_deliver.assert_not_awaited()
+        assert mock_status.await_args.args[:2] == ("stale", "expired")
+
+        # The remaining deadline is passed to FCM, and a retry that would
+        # land after it is dropped instead of scheduled
+        mock_deliver.side_effect = Exception("FCM Error")
+        await process_push_notification(fresh)
+        assert 0 < mock_deliver.await_args.kwargs["ttl"] <= 2
+        state.retry_scheduler.schedule.assert_not_awaited()
+        assert mock_status.await_args.args[:2] == ("fresh", "expired")
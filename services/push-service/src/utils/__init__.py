@@ -0,0 +1,21 @@
+from .codec import json_dumps, json_loads
+from .concurrency import AdjustableSemaphore, KeyedLock
+from .lru import LRUCache
+from .metrics import Counter, Gauge, Histogram, MetricsRegistry
+from .tracing import JsonFileExporter, OTLPExporter, Tracer
+
+
+__all__ = [
+    "AdjustableSemaphore",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "JsonFileExporter",
+    "json_dumps",
+    "json_loads",
+    "KeyedLock",
+    "LRUCache",
+    "MetricsRegistry",
+    "OTLPExporter",
+    "Tracer",
+]
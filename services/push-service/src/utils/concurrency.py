@@ -0,0 +1,88 @@
+from contextlib import asynccontextmanager
+from collections import deque
+from typing import Deque, Dict
+import asyncio
+
+
+class KeyedLock:
+    """Per-key asyncio locks, discarded once no task holds or waits on them"""
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._holders: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        """Serialize work for the same key in arrival order"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._holders[key] = self._holders.get(key, 0) + 1
+
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class AdjustableSemaphore:
+    """A bounded semaphore whose limit can change while it is held.
+
+    Lowering the limit never interrupts holders; new acquirers wait until
+    enough of them have released.
+    """
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @limit.setter
+    def limit(self, value: int):
+        self._limit = value
+        self._wake()
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    async def acquire(self):
+        if self._in_use < self._limit and not self._waiters:
+            self._in_use += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Woken and cancelled at once: pass the slot on
+                self._in_use -= 1
+                self._wake()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        if self._in_use <= 0:
+            raise ValueError("AdjustableSemaphore released too many times")
+        self._in_use -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_use < self._limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_use += 1
+                waiter.set_result(None)
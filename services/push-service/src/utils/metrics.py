@@ -0,0 +1,317 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+import time
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+    def dump(self) -> List[list]:
+        """JSON-serialisable values, for merging metrics from other processes"""
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, entries: List[list]):
+        for key, value in entries:
+            key = tuple(key)
+            self._values[key] = self._values.get(key, 0.0) + value
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in self._values.items():
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            )
+        return lines
+
+    def snapshot(self) -> dict:
+        return {
+            ",".join(str(part) for part in key) or "total": value
+            for key, value in self._values.items()
+        }
+
+
+class Gauge(_Metric):
+    """A value that goes up and down.
+
+    `aggregate` says how reports from several processes combine: "sum" for
+    per-process amounts (in-flight handlers), "max" for flags and values
+    every process shares (circuit open).
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        *args,
+        function: Optional[Callable[[], float]] = None,
+        aggregate: str = "sum",
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._function = function
+        self.aggregate = aggregate
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        values = dict(self._values)
+        if self._function is not None:
+            values[()] = self._function()
+        for key, value in values.items():
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            )
+        return lines
+
+    def dump(self) -> List[list]:
+        entries = super().dump()
+        if self._function is not None:
+            entries.append([[], self._function()])
+        return entries
+
+    def merge(self, entries: List[list]):
+        if self.aggregate != "max":
+            return super().merge(entries)
+        for key, value in entries:
+            key = tuple(key)
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def snapshot(self) -> dict:
+        if self._function is not None:
+            return {"value": self._function()}
+        return {
+            ",".join(str(part) for part in key) or "value": value
+            for key, value in self._values.items()
+        }
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def dump(self) -> List[list]:
+        return [
+            [list(key), [list(counts), total[0]]]
+            for key, (counts, total) in self._values.items()
+        ]
+
+    def merge(self, entries: List[list]):
+        for key, (counts, total) in entries:
+            key = tuple(key)
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            for index, count in enumerate(counts):
+                entry[0][index] += count
+            entry[1][0] += total
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        entry = self._values.get(self._key(labels))
+        if entry is None:
+            return None
+        counts = entry[0]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index >= len(self.buckets):
+                    return lower
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    def snapshot(self) -> dict:
+        snapshot = {}
+        for key, (counts, total) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            count = sum(counts)
+            snapshot[",".join(str(part) for part in key) or "all"] = {
+                "count": count,
+                "avg_ms": total[0] / count * 1000 if count else None,
+                "p50_ms": (self.quantile(0.5, **labels) or 0) * 1000,
+                "p99_ms": (self.quantile(0.99, **labels) or 0) * 1000,
+            }
+        return snapshot
+
+
+class MetricsRegistry:
+    """In-process metrics rendered as JSON or Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        function=None,
+        aggregate: str = "sum",
+    ) -> Gauge:
+        return self._register(
+            Gauge(name, documentation, labelnames, function=function, aggregate=aggregate)
+        )
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets=buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def dump(self) -> dict:
+        return {name: metric.dump() for name, metric in self._metrics.items()}
+
+    def merged(self, dumps: Iterable[dict]) -> "MetricsRegistry":
+        """A registry with the same metrics holding the sum of several dumps.
+
+        Counters and histograms add up. Gauges combine by their own
+        `aggregate`: summed, or the largest value for shared state.
+        """
+        registry = MetricsRegistry()
+        for name, metric in self._metrics.items():
+            if isinstance(metric, Histogram):
+                registry.histogram(
+                    name, metric.documentation, metric.labelnames, metric.buckets
+                )
+            elif isinstance(metric, Gauge):
+                registry.gauge(
+                    name,
+                    metric.documentation,
+                    metric.labelnames,
+                    aggregate=metric.aggregate,
+                )
+            else:
+                registry.counter(name, metric.documentation, metric.labelnames)
+        for dump in dumps:
+            for name, entries in dump.items():
+                if name in registry._metrics:
+                    registry._metrics[name].merge(entries)
+        return registry
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
@@ -0,0 +1,369 @@
+"""Lightweight span tracing with W3C trace context.
+
+Spans are buffered in memory and exported in batches, either as OTLP/HTTP
+JSON to a collector or as JSON lines to a file. The current span lives in
+a context variable, so each asyncio task traces its own message.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import random
+import re
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CONSUMER = 5
+
+
+def parse_traceparent(value) -> Optional[Tuple[str, str, bool]]:
+    """(trace id, parent span id, sampled) from a traceparent header"""
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    match = TRACEPARENT_PATTERN.match(str(value).strip().lower()) if value else None
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, bool(int(flags, 16) & 1)
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "sampled",
+        "kind",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        sampled: bool,
+        kind: int = SPAN_KIND_INTERNAL,
+        start_ns: Optional[int] = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, object] = {}
+        self.error: Optional[str] = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class Tracer:
+    """Create spans and export the sampled ones.
+
+    A message whose traceparent says "sampled" is always traced, one that
+    says "not sampled" never is, and one without a traceparent starts a new
+    trace that is sampled with probability `sample_rate`. Without an
+    exporter nothing is recorded. Finished spans wait in a buffer of at
+    most `max_buffer` (the oldest are dropped) and are exported every
+    `flush_interval` seconds or once `batch_size` are waiting.
+    """
+
+    def __init__(
+        self,
+        exporter=None,
+        sample_rate: float = 0.1,
+        batch_size: int = 512,
+        flush_interval: float = 5.0,
+        max_buffer: int = 10000,
+    ):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: Deque[Span] = deque(maxlen=max_buffer)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.started_traces = 0
+        self.sampled_traces = 0
+        self.exported = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def _finish(self, span: Span, token, error: Optional[BaseException]):
+        _current_span.reset(token)
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if span.sampled:
+            self.record(span)
+
+    @contextmanager
+    def trace(
+        self,
+        name: str,
+        traceparent=None,
+        start_ns: Optional[int] = None,
+        **attributes,
+    ) -> Iterator[Optional[Span]]:
+        """Root span for one message, continuing the trace in `traceparent`"""
+        if not self.enabled:
+            yield None
+            return
+        parent = parse_traceparent(traceparent)
+        self.started_traces += 1
+        if parent:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            sampled = random.random() < self.sample_rate
+        if sampled:
+            self.sampled_traces += 1
+
+        span = Span(name, trace_id, parent_id, sampled, SPAN_KIND_CONSUMER, start_ns)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(span, token, error)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Child of the current span; does nothing outside a sampled trace"""
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            yield None
+            return
+        span = Span(name, parent.trace_id, parent.span_id, True)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._finish(span, token, error)
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, **attributes):
+        """Record an already finished child of the current span, e.g. queue wait"""
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return
+        span = Span(name, parent.trace_id, parent.span_id, True, start_ns=start_ns)
+        span.end_ns = end_ns
+        span.attributes.update(attributes)
+        self.record(span)
+
+    def annotate(self, **attributes):
+        """Set attributes on the current span, if there is one"""
+        span = _current_span.get()
+        if span is not None and span.sampled:
+            span.attributes.update(attributes)
+
+    def inject(self, headers: Optional[dict] = None) -> Optional[dict]:
+        """`headers` plus the current traceparent, for publishing downstream"""
+        span = _current_span.get()
+        if span is None:
+            return headers
+        return {**(headers or {}), "traceparent": span.traceparent}
+
+    def record(self, span: Span):
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(span)
+        if self._wakeup is not None and len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self):
+        while self._buffer:
+            batch = [
+                self._buffer.popleft()
+                for _ in range(min(self.batch_size, len(self._buffer)))
+            ]
+            try:
+                await self.exporter.export(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.error(f"Failed to export {len(batch)} spans: {e}")
+
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """Export what is buffered and close the exporter"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled:
+            await self.flush()
+            await self.exporter.close()
+
+    def metrics(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "started_traces": self.started_traces,
+            "sampled_traces": self.sampled_traces,
+            "buffered_spans": len(self._buffer),
+            "exported_spans": self.exported,
+            "dropped_spans": self.dropped,
+        }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter:
+    """Send spans to an OTLP/HTTP collector as JSON (e.g. localhost:4318)"""
+
+    def __init__(
+        self,
+        endpoint: str = "http://localhost:4318/v1/traces",
+        service_name: str = "push-service",
+        http_client: Optional[httpx.AsyncClient] = None,
+        timeout: float = 5.0,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.http_client = http_client or httpx.AsyncClient(timeout=timeout)
+
+    def payload(self, spans: List[Span]) -> dict:
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {"key": "service.name", "value": _otlp_value(self.service_name)}
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": self.service_name},
+                            "spans": [self._span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    @staticmethod
+    def _span(span: Span) -> dict:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span.attributes.items()
+                if value is not None
+            ],
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        if span.error:
+            otlp_span["status"] = {"code": 2, "message": span.error}
+        return otlp_span
+
+    async def export(self, spans: List[Span]):
+        response = await self.http_client.post(self.endpoint, json=self.payload(spans))
+        response.raise_for_status()
+
+    async def close(self):
+        await self.http_client.aclose()
+
+
+class JsonFileExporter:
+    """Append spans to a file, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: List[str]):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(lines)
+
+    async def export(self, spans: List[Span]):
+        lines = [json.dumps(span.to_dict(), default=str) + "\n" for span in spans]
+        await asyncio.to_thread(self._write, lines)
+
+    async def close(self):
+        pass
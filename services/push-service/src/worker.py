@@ -0,0 +1,93 @@
+"""
+Push consumer worker processes.
+
+With PUSH_WORKERS > 0 the API process starts this many workers through
+`WorkerSupervisor`. Each worker has its own AMQP connection, Redis client
+and FCM pool, and every PUSH_WORKER_HEARTBEAT_INTERVAL seconds it reports
+its metrics to Redis for the API process to aggregate. On SIGTERM or SIGINT
+a worker stops consuming, finishes its in-flight messages and exits.
+
+The workers can also run without the API:
+
+    python -m src.worker --workers 4
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from src import main
+from src.services import WorkerSupervisor
+
+logger = logging.getLogger(__name__)
+
+
+async def report_periodically(worker_id: str):
+    while True:
+        try:
+            await main.state.worker_registry.publish(
+                worker_id,
+                {
+                    "pid": os.getpid(),
+                    "local": main.local_metrics(),
+                    "metrics": main.metrics.dump(),
+                },
+            )
+        except Exception as e:
+            logger.error(f"Failed to report worker metrics: {e}")
+        await asyncio.sleep(main.PUSH_WORKER_HEARTBEAT_INTERVAL)
+
+
+async def serve_worker(worker_id: str):
+    """Consume until asked to stop, then drain and disconnect"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    await main.start_service("worker")
+    logger.info(f"Push worker {worker_id} consuming (pid {os.getpid()})")
+    reporter = asyncio.create_task(report_periodically(worker_id))
+
+    await stop.wait()
+    logger.info(f"Push worker {worker_id} shutting down")
+    reporter.cancel()
+    try:
+        await reporter
+    except asyncio.CancelledError:
+        pass
+    try:
+        await main.state.worker_registry.remove(worker_id)
+    except Exception as e:
+        logger.error(f"Failed to remove worker report: {e}")
+    await main.stop_service()
+
+
+def run_worker(worker_id: str):
+    """Process entry point used by WorkerSupervisor"""
+    asyncio.run(serve_worker(worker_id))
+
+
+async def supervise(workers: int):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    supervisor = WorkerSupervisor(
+        run_worker, workers, shutdown_timeout=main.PUSH_WORKER_SHUTDOWN_TIMEOUT
+    )
+    supervisor.start()
+    supervisor.watch(main.PUSH_WORKER_HEARTBEAT_INTERVAL)
+    await stop.wait()
+    await supervisor.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", type=int, default=main.PUSH_WORKERS or os.cpu_count())
+    asyncio.run(supervise(parser.parse_args().workers))